@@ -1,13 +1,260 @@
 import json
 import os
+import time
 import psycopg2
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
 from datetime import datetime, timedelta
 
+METRICS_TTL_SECONDS = int(os.environ.get('ADMIN_METRICS_TTL_SECONDS', '60'))
+METRIC_SECTIONS = ['users', 'financial', 'proposals', 'regions', 'engagement']
+ACTIVITY_SHARD_BITS = 8192
+
+# Источники дневных агрегатов: metric -> (таблица, колонка времени, измерение, агрегат)
+ROLLUP_SOURCES = {
+    'signups': ('users', 'created_at', 'role', 'COUNT(*)'),
+    'revenue': ('investments', 'date', "'all'", 'COALESCE(SUM(amount), 0)'),
+    'investments': ('investments', 'date', "'all'", 'COUNT(*)'),
+    'proposals': ('proposals', 'created_at', 'type', 'COUNT(*)')
+}
+
+# In-process кэш между вызовами одного экземпляра функции: {type: (expires_at, metrics)}
+_metrics_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+
+def refresh_daily_metrics(cur, schema: str, full: bool = False) -> Dict[str, Any]:
+    '''
+    Business: Инкрементально обновить дневные агрегаты daily_metrics по водяным знакам
+    Args: cur - курсор БД, schema - схема БД, full - пересобрать агрегаты за все дни
+    Returns: dict с новыми водяными знаками по метрикам
+    '''
+    watermarks: Dict[str, Any] = {}
+    for metric, (table, ts_column, dimension, aggregate) in ROLLUP_SOURCES.items():
+        job_name = f'daily_metrics:{metric}'
+        cur.execute(f"""
+            INSERT INTO {schema}.stats_watermarks (job_name) VALUES (%s)
+            ON CONFLICT (job_name) DO NOTHING
+        """, (job_name,))
+        cur.execute(f"""
+            SELECT watermark FROM {schema}.stats_watermarks WHERE job_name = %s FOR UPDATE
+        """, (job_name,))
+        watermark = cur.fetchone()[0]
+        
+        cur.execute(f"SELECT MAX({ts_column}) FROM {schema}.{table}")
+        new_watermark = cur.fetchone()[0]
+        if new_watermark is None or (new_watermark <= watermark and not full):
+            watermarks[metric] = watermark.isoformat()
+            continue
+        
+        # Дни начиная с дня водяного знака пересчитываются целиком - повторный запуск идемпотентен
+        since = datetime(1970, 1, 1) if full else datetime.combine(watermark.date(), datetime.min.time())
+        cur.execute(f"""
+            DELETE FROM {schema}.daily_metrics WHERE metric = %s AND day >= %s
+        """, (metric, since.date()))
+        cur.execute(f"""
+            INSERT INTO {schema}.daily_metrics (day, metric, dimension, value, updated_at)
+            SELECT DATE({ts_column}), %s, COALESCE({dimension}::text, ''), {aggregate}, CURRENT_TIMESTAMP
+            FROM {schema}.{table}
+            WHERE {ts_column} >= %s
+            GROUP BY DATE({ts_column}), COALESCE({dimension}::text, '')
+        """, (metric, since))
+        
+        cur.execute(f"""
+            UPDATE {schema}.stats_watermarks
+            SET watermark = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE job_name = %s
+        """, (new_watermark, job_name))
+        watermarks[metric] = new_watermark.isoformat()
+    
+    return watermarks
+
+def daily_series_sql(schema: str, metric: str, value_name: str, value_type: str = 'bigint') -> str:
+    '''
+    Business: CTE дневного ряда из таблицы агрегатов daily_metrics (последние 30 дней)
+    Args: schema - схема БД, metric - метрика агрегата, value_name - имя колонки значения,
+          value_type - SQL-тип значения в ответе
+    Returns: SQL-выражение подзапроса
+    '''
+    return f"""(
+                SELECT day, SUM(value)::{value_type} AS {value_name}
+                FROM {schema}.daily_metrics
+                WHERE metric = '{metric}' AND day >= %(month_ago)s
+                GROUP BY day
+                ORDER BY day DESC
+                LIMIT 30
+            )"""
+
+def get_activity_metrics(cur, schema: str, today: Any) -> Dict[str, Any]:
+    '''
+    Business: DAU/WAU/MAU и недельный retention по дневным битовым картам активности (бит = пользователь)
+    Args: cur - курсор БД, schema - схема БД, today - текущая дата
+    Returns: dict с dau, wau, mau, retention_week
+    '''
+    cur.execute(f"""
+        SELECT day, shard, bitmap FROM {schema}.user_activity_bitmaps
+        WHERE day > %s AND day <= %s
+    """, (today - timedelta(days=30), today))
+    
+    # Объединение битовых карт за окно: OR по каждому шарду, затем подсчет единичных бит
+    windows: Dict[str, Dict[int, int]] = {'dau': {}, 'wau': {}, 'mau': {}, 'prev_week': {}}
+    for day, shard, bitmap in cur.fetchall():
+        bits = int.from_bytes(bytes(bitmap), 'little')
+        age = (today - day).days
+        for window, in_window in (('dau', age == 0), ('wau', age < 7), ('mau', True), ('prev_week', 7 <= age < 14)):
+            if in_window:
+                windows[window][shard] = windows[window].get(shard, 0) | bits
+    
+    def count(shards: Dict[int, int]) -> int:
+        return sum(bin(bits).count('1') for bits in shards.values())
+    
+    prev_week = count(windows['prev_week'])
+    retained = sum(
+        bin(bits & windows['wau'].get(shard, 0)).count('1')
+        for shard, bits in windows['prev_week'].items()
+    )
+    
+    return {
+        'dau': count(windows['dau']),
+        'wau': count(windows['wau']),
+        'mau': count(windows['mau']),
+        'retention_week': round(retained / prev_week, 4) if prev_week else 0
+    }
+
+def build_section_sql(schema: str, section: str) -> Tuple[List[str], str]:
+    '''
+    Business: SQL-фрагменты раздела метрик - CTE и json-выражение для итогового SELECT
+    Args: schema - схема БД, section - раздел метрик
+    Returns: (список CTE, выражение json_build_object)
+    '''
+    if section == 'users':
+        return [
+            f"""users_by_role AS (
+                SELECT role, COUNT(*) AS total
+                FROM {schema}.users
+                GROUP BY role
+            )""",
+            f"daily_signups AS {daily_series_sql(schema, 'signups', 'count')}"
+        ], f"""json_build_object(
+            'signups_today', (SELECT COUNT(*) FROM {schema}.users WHERE created_at >= %(today)s AND created_at < %(tomorrow)s),
+            'signups_month', (SELECT COUNT(*) FROM {schema}.users WHERE created_at >= %(month_ago)s),
+            'total', (SELECT COALESCE(SUM(total), 0) FROM users_by_role),
+            'by_role', (SELECT COALESCE(json_object_agg(role, total), '{{}}'::json) FROM users_by_role),
+            'daily_signups', (SELECT COALESCE(json_agg(json_build_object('date', day, 'count', count) ORDER BY day DESC), '[]'::json)
+                              FROM daily_signups)
+        )"""
+    
+    if section == 'financial':
+        return [
+            f"""investment_totals AS (
+                SELECT COUNT(*) AS total_investments,
+                       COALESCE(SUM(amount), 0) AS total_revenue,
+                       COALESCE(AVG(amount), 0) AS avg_investment
+                FROM {schema}.investments
+            )""",
+            f"daily_revenue AS {daily_series_sql(schema, 'revenue', 'revenue', 'float8')}"
+        ], """(SELECT json_build_object(
+            'total_investments', total_investments,
+            'total_revenue', total_revenue,
+            'avg_investment', avg_investment,
+            'daily_revenue', (SELECT COALESCE(json_agg(json_build_object('date', day, 'revenue', revenue) ORDER BY day DESC), '[]'::json)
+                              FROM daily_revenue)
+        ) FROM investment_totals)"""
+    
+    if section == 'proposals':
+        return [
+            f"""proposals_by_type AS (
+                SELECT type,
+                       COUNT(*) AS total,
+                       COUNT(*) FILTER (WHERE status = 'active') AS active
+                FROM {schema}.proposals
+                GROUP BY type
+            )""",
+            f"daily_proposals AS {daily_series_sql(schema, 'proposals', 'count')}"
+        ], f"""json_build_object(
+            'total', (SELECT COALESCE(SUM(total), 0) FROM proposals_by_type),
+            'active', (SELECT COALESCE(SUM(active), 0) FROM proposals_by_type),
+            'recent_week', (SELECT COUNT(*) FROM {schema}.proposals WHERE created_at >= %(week_ago)s),
+            'by_type', (SELECT COALESCE(json_object_agg(type, total), '{{}}'::json) FROM proposals_by_type),
+            'daily_proposals', (SELECT COALESCE(json_agg(json_build_object('date', day, 'count', count) ORDER BY day DESC), '[]'::json)
+                                FROM daily_proposals)
+        )"""
+    
+    if section == 'regions':
+        return [
+            f"""top_regions AS (
+                SELECT fd.region AS name,
+                       COUNT(DISTINCT fd.user_id) AS users,
+                       COUNT(DISTINCT p.id) AS proposals
+                FROM {schema}.farmer_data fd
+                LEFT JOIN {schema}.proposals p ON fd.user_id = p.user_id
+                WHERE fd.region IS NOT NULL AND fd.region != ''
+                GROUP BY fd.region
+                ORDER BY users DESC
+                LIMIT 10
+            )"""
+        ], """json_build_object(
+            'top_regions', (SELECT COALESCE(json_agg(json_build_object('name', name, 'users', users, 'proposals', proposals)
+                                                     ORDER BY users DESC), '[]'::json)
+                            FROM top_regions)
+        )"""
+    
+    if section == 'engagement':
+        return [
+            f"""rating_stats AS (
+                SELECT COALESCE(AVG(total_score), 0) AS avg_points, MAX(total_score) AS max_points
+                FROM {schema}.farmer_scores
+                WHERE total_score > 0
+            )"""
+        ], f"""json_build_object(
+            'avg_rating_score', (SELECT avg_points FROM rating_stats),
+            'max_rating_score', (SELECT max_points FROM rating_stats),
+            'active_farmers_week', (SELECT COUNT(DISTINCT user_id) FROM {schema}.proposals WHERE created_at >= %(week_ago)s),
+            'active_investors_week', (SELECT COUNT(DISTINCT user_id) FROM {schema}.investments WHERE date >= %(week_ago)s)
+        )"""
+    
+    raise ValueError(f'Unknown metrics section: {section}')
+
+def compute_metrics(cur, schema: str, sections: List[str]) -> Dict[str, Any]:
+    '''
+    Business: Посчитать все запрошенные разделы метрик одним SQL-запросом (один round trip)
+    Args: cur - курсор БД, schema - схема БД, sections - разделы метрик
+    Returns: dict с метриками по разделам
+    '''
+    today = datetime.now().date()
+    
+    ctes: List[str] = []
+    columns: List[str] = []
+    for section in sections:
+        section_ctes, expression = build_section_sql(schema, section)
+        ctes.extend(section_ctes)
+        columns.append(f"{expression} AS {section}")
+    
+    cur.execute(
+        f"WITH {', '.join(ctes)} SELECT {', '.join(columns)}",
+        {
+            'today': today,
+            'tomorrow': today + timedelta(days=1),
+            'week_ago': today - timedelta(days=7),
+            'month_ago': today - timedelta(days=30)
+        }
+    )
+    row = cur.fetchone()
+    metrics = dict(zip(sections, row))
+    
+    if 'users' in metrics:
+        metrics['users'].update(get_activity_metrics(cur, schema, today))
+    if 'financial' in metrics:
+        financial = metrics['financial']
+        financial['total_revenue'] = float(financial['total_revenue'])
+        financial['avg_investment'] = float(financial['avg_investment'])
+    if 'engagement' in metrics:
+        metrics['engagement']['avg_rating_score'] = float(metrics['engagement']['avg_rating_score'] or 0)
+    
+    return metrics
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: API для бизнес-метрик админ-панели (DAU/MAU, Revenue, Churn, регионы)
-    Args: event - dict с httpMethod, queryStringParameters
+    Args: event - dict с httpMethod, queryStringParameters (type, refresh=1 - пересчитать без кэша;
+          POST action=refresh - обновить дневные агрегаты)
           context - объект с request_id
     Returns: HTTP response с метриками или ошибкой
     '''
@@ -18,13 +265,38 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, OPTIONS',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
                 'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
+    params = event.get('queryStringParameters') or {}
+    
+    if method not in ('GET', 'POST') or (method == 'POST' and params.get('action') != 'refresh'):
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Метод не поддерживается'})
+        }
+    
+    metric_type = params.get('type', 'all')
+    force_refresh = params.get('refresh') == '1'
+    sections = METRIC_SECTIONS if metric_type == 'all' else [s for s in METRIC_SECTIONS if s == metric_type]
+    
+    cached = _metrics_cache.get(metric_type)
+    if method == 'GET' and cached and cached[0] > time.time() and not force_refresh:
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*',
+                'X-Cache': 'memory'
+            },
+            'body': json.dumps(cached[1])
+        }
+    
     db_url = os.environ.get('DATABASE_URL')
     if not db_url:
         return {
@@ -38,209 +310,53 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     cur = conn.cursor()
     
     try:
-        if method == 'GET':
-            params = event.get('queryStringParameters') or {}
-            metric_type = params.get('type', 'all')
-            
-            now = datetime.now()
-            today = now.date()
-            month_ago = today - timedelta(days=30)
-            week_ago = today - timedelta(days=7)
-            
-            metrics = {}
-            
-            if metric_type in ['all', 'users']:
-                cur.execute(f"""
-                    SELECT COUNT(DISTINCT id) 
-                    FROM {schema}.users 
-                    WHERE DATE(created_at) = %s
-                """, (today,))
-                dau = cur.fetchone()[0]
-                
-                cur.execute(f"""
-                    SELECT COUNT(DISTINCT id) 
-                    FROM {schema}.users 
-                    WHERE created_at >= %s
-                """, (month_ago,))
-                mau = cur.fetchone()[0]
-                
-                cur.execute(f"""
-                    SELECT role, COUNT(*) 
-                    FROM {schema}.users 
-                    GROUP BY role
-                """)
-                users_by_role = dict(cur.fetchall())
-                
-                cur.execute(f"""
-                    SELECT DATE(created_at) as day, COUNT(*) as count
-                    FROM {schema}.users
-                    WHERE created_at >= %s
-                    GROUP BY DATE(created_at)
-                    ORDER BY day DESC
-                    LIMIT 30
-                """, (month_ago,))
-                
-                daily_signups = []
-                for row in cur.fetchall():
-                    daily_signups.append({
-                        'date': row[0].isoformat(),
-                        'count': row[1]
-                    })
-                
-                metrics['users'] = {
-                    'dau': dau,
-                    'mau': mau,
-                    'total': sum(users_by_role.values()),
-                    'by_role': users_by_role,
-                    'daily_signups': daily_signups
-                }
-            
-            if metric_type in ['all', 'financial']:
-                cur.execute(f"""
-                    SELECT 
-                        COUNT(*) as total_investments,
-                        COALESCE(SUM(amount), 0) as total_revenue,
-                        COALESCE(AVG(amount), 0) as avg_investment
-                    FROM {schema}.investments
-                """)
-                inv_row = cur.fetchone()
-                
-                cur.execute(f"""
-                    SELECT DATE(date) as day, COALESCE(SUM(amount), 0) as revenue
-                    FROM {schema}.investments
-                    WHERE date >= %s
-                    GROUP BY DATE(date)
-                    ORDER BY day DESC
-                    LIMIT 30
-                """, (month_ago,))
-                
-                daily_revenue = []
-                for row in cur.fetchall():
-                    daily_revenue.append({
-                        'date': row[0].isoformat(),
-                        'revenue': float(row[1])
-                    })
-                
-                metrics['financial'] = {
-                    'total_investments': inv_row[0],
-                    'total_revenue': float(inv_row[1]),
-                    'avg_investment': float(inv_row[2]),
-                    'daily_revenue': daily_revenue
-                }
-            
-            if metric_type in ['all', 'proposals']:
-                cur.execute(f"""
-                    SELECT 
-                        COUNT(*) as total,
-                        COUNT(*) FILTER (WHERE status = 'active') as active,
-                        COUNT(*) FILTER (WHERE created_at >= %s) as recent
-                    FROM {schema}.proposals
-                """, (week_ago,))
-                prop_row = cur.fetchone()
-                
-                cur.execute(f"""
-                    SELECT type, COUNT(*) 
-                    FROM {schema}.proposals 
-                    GROUP BY type
-                """)
-                proposals_by_type = dict(cur.fetchall())
-                
-                cur.execute(f"""
-                    SELECT DATE(created_at) as day, COUNT(*) as count
-                    FROM {schema}.proposals
-                    WHERE created_at >= %s
-                    GROUP BY DATE(created_at)
-                    ORDER BY day DESC
-                    LIMIT 30
-                """, (month_ago,))
-                
-                daily_proposals = []
-                for row in cur.fetchall():
-                    daily_proposals.append({
-                        'date': row[0].isoformat(),
-                        'count': row[1]
-                    })
-                
-                metrics['proposals'] = {
-                    'total': prop_row[0],
-                    'active': prop_row[1],
-                    'recent_week': prop_row[2],
-                    'by_type': proposals_by_type,
-                    'daily_proposals': daily_proposals
-                }
-            
-            if metric_type in ['all', 'regions']:
-                cur.execute(f"""
-                    SELECT 
-                        fd.region, 
-                        COUNT(DISTINCT fd.user_id) as user_count,
-                        COUNT(DISTINCT p.id) as proposal_count
-                    FROM {schema}.farmer_data fd
-                    LEFT JOIN {schema}.proposals p ON fd.user_id = p.user_id
-                    WHERE fd.region IS NOT NULL AND fd.region != ''
-                    GROUP BY fd.region
-                    ORDER BY user_count DESC
-                    LIMIT 10
-                """)
-                
-                top_regions = []
-                for row in cur.fetchall():
-                    top_regions.append({
-                        'name': row[0],
-                        'users': row[1],
-                        'proposals': row[2]
-                    })
-                
-                metrics['regions'] = {
-                    'top_regions': top_regions
-                }
-            
-            if metric_type in ['all', 'engagement']:
-                cur.execute(f"""
-                    SELECT 
-                        COALESCE(AVG(fs.total_score), 0) as avg_points,
-                        MAX(fs.total_score) as max_points
-                    FROM {schema}.farmer_scores fs
-                    WHERE fs.total_score > 0
-                """)
-                gamif_row = cur.fetchone()
-                
-                cur.execute(f"""
-                    SELECT COUNT(DISTINCT user_id) 
-                    FROM {schema}.proposals 
-                    WHERE created_at >= %s
-                """, (week_ago,))
-                active_farmers = cur.fetchone()[0]
-                
-                cur.execute(f"""
-                    SELECT COUNT(DISTINCT user_id) 
-                    FROM {schema}.investments 
-                    WHERE date >= %s
-                """, (week_ago,))
-                active_investors = cur.fetchone()[0]
-                
-                metrics['engagement'] = {
-                    'avg_rating_score': float(gamif_row[0]) if gamif_row else 0,
-                    'max_rating_score': gamif_row[1] if gamif_row else 0,
-                    'active_farmers_week': active_farmers,
-                    'active_investors_week': active_investors
-                }
-            
+        # POST ?action=refresh[&full=1] - batch-задача (таймер): дозаполнить дневные агрегаты
+        if method == 'POST':
+            watermarks = refresh_daily_metrics(cur, schema, full=params.get('full') == '1')
+            conn.commit()
             conn.close()
-            
             return {
                 'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps(metrics)
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'success': True, 'watermarks': watermarks})
             }
         
+        cache_source = 'db'
+        metrics = None
+        
+        # Общий кэш в БД: пересчет не чаще раза в TTL на все экземпляры функции
+        if not force_refresh:
+            cur.execute(f"""
+                SELECT payload FROM {schema}.admin_metrics_cache
+                WHERE metric_type = %s AND computed_at > NOW() - INTERVAL '1 second' * %s
+            """, (metric_type, METRICS_TTL_SECONDS))
+            row = cur.fetchone()
+            metrics = row[0] if row else None
+        
+        if metrics is None:
+            cache_source = 'miss'
+            refresh_daily_metrics(cur, schema)
+            metrics = compute_metrics(cur, schema, sections) if sections else {}
+            cur.execute(f"""
+                INSERT INTO {schema}.admin_metrics_cache (metric_type, payload, computed_at)
+                VALUES (%s, %s, NOW())
+                ON CONFLICT (metric_type) DO UPDATE SET
+                    payload = EXCLUDED.payload,
+                    computed_at = EXCLUDED.computed_at
+            """, (metric_type, json.dumps(metrics)))
+            conn.commit()
+        
+        conn.close()
+        _metrics_cache[metric_type] = (time.time() + METRICS_TTL_SECONDS, metrics)
+        
         return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Метод не поддерживается'})
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*',
+                'X-Cache': cache_source
+            },
+            'body': json.dumps(metrics)
         }
     
     except Exception as e:
@@ -250,4 +366,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
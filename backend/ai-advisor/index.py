@@ -6,10 +6,29 @@ Returns: Personalized recommendations and analytics
 
 import json
 import os
+import uuid
+import time
+import hashlib
 import requests
-from typing import Dict, Any, List
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 
+JOB_SOURCE = 'ai-advisor'
+JOB_STALE_MINUTES = 5
+MAX_WAIT_SECONDS = 25
+PROMPT_VERSION = 'v1'
+CACHE_TTL_HOURS = int(os.environ.get('AI_CACHE_TTL_HOURS', '168'))
+CACHE_MAX_ENTRIES = int(os.environ.get('AI_CACHE_MAX_ENTRIES', '5000'))
+BREAKER_NAME = 'gigachat'
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('GIGACHAT_BREAKER_THRESHOLD', '5'))
+BREAKER_COOLDOWN_SECONDS = int(os.environ.get('GIGACHAT_BREAKER_COOLDOWN', '60'))
+GIGACHAT_TIMEOUT_SECONDS = int(os.environ.get('GIGACHAT_TIMEOUT_SECONDS', '30'))
+# Пробный запрос half_open - получение токена и запрос к модели, каждый ограничен GIGACHAT_TIMEOUT_SECONDS
+BREAKER_PROBE_LEASE_SECONDS = 2 * GIGACHAT_TIMEOUT_SECONDS
+ADMIN_SECRET = "farmer_admin_2025_secret_key"
+
 def get_access_token() -> str:
     """Get GigaChat access token using client credentials"""
     api_key = os.environ.get('GIGACHAT_API_KEY', '')
@@ -22,7 +41,8 @@ def get_access_token() -> str:
             'Content-Type': 'application/x-www-form-urlencoded'
         },
         data={'scope': 'GIGACHAT_API_PERS'},
-        verify=False
+        verify=False,
+        timeout=GIGACHAT_TIMEOUT_SECONDS
     )
     
     if response.status_code != 200:
@@ -76,7 +96,8 @@ def analyze_with_gigachat(farm_data: Dict[str, Any], access_token: str) -> Dict[
             'temperature': 0.7,
             'max_tokens': 2000
         },
-        verify=False
+        verify=False,
+        timeout=GIGACHAT_TIMEOUT_SECONDS
     )
     
     if response.status_code != 200:
@@ -149,7 +170,798 @@ def format_equipment(equipment: List[Dict]) -> str:
     
     return "\n".join(lines) if lines else "Нет данных"
 
+class CircuitOpenError(Exception):
+    """GigaChat call rejected by the open circuit breaker without touching upstream"""
+
+def inject_fault() -> None:
+    """Local fault-injection stub: GIGACHAT_FAULT_INJECTION=error|timeout|slow:<seconds>"""
+    fault = os.environ.get('GIGACHAT_FAULT_INJECTION', '')
+    if fault == 'error':
+        raise requests.ConnectionError('Injected GigaChat fault')
+    if fault == 'timeout':
+        raise requests.Timeout('Injected GigaChat timeout')
+    if fault.startswith('slow:'):
+        time.sleep(float(fault.split(':', 1)[1]))
+
+def breaker_allow(dsn: str) -> bool:
+    """Closed breaker lets calls through; open one admits a single half-open probe after the cooldown"""
+    schema = 't_p53065890_farmer_landing_proje'
+    try:
+        conn = psycopg2.connect(dsn)
+    except Exception as e:
+        print(f'Circuit breaker storage unavailable: {e}')
+        return True
+    
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f'SELECT state FROM {schema}.circuit_breakers WHERE name = %s', (BREAKER_NAME,))
+            row = cur.fetchone()
+            if not row or row['state'] == 'closed':
+                return True
+            
+            # Строка блокируется UPDATE: пробный запрос получит только один вызов
+            cur.execute(f'''
+                UPDATE {schema}.circuit_breakers
+                SET state = 'half_open',
+                    probe_started_at = CURRENT_TIMESTAMP,
+                    half_open_count = half_open_count + CASE WHEN state = 'open' THEN 1 ELSE 0 END,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE name = %s
+                  AND ((state = 'open' AND opened_at <= CURRENT_TIMESTAMP - INTERVAL '1 second' * %s)
+                       OR (state = 'half_open' AND probe_started_at <= CURRENT_TIMESTAMP - INTERVAL '1 second' * %s))
+                RETURNING name
+            ''', (BREAKER_NAME, BREAKER_COOLDOWN_SECONDS, BREAKER_PROBE_LEASE_SECONDS))
+            allowed = cur.fetchone() is not None
+            
+            if not allowed:
+                cur.execute(f'''
+                    UPDATE {schema}.circuit_breakers
+                    SET rejected_count = rejected_count + 1
+                    WHERE name = %s
+                ''', (BREAKER_NAME,))
+            
+            conn.commit()
+            return allowed
+    finally:
+        conn.close()
+
+def breaker_record(success: bool, error: Optional[str], dsn: str) -> None:
+    """Record call outcome: success closes the breaker, threshold failures or a failed probe open it"""
+    schema = 't_p53065890_farmer_landing_proje'
+    try:
+        conn = psycopg2.connect(dsn)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f'''
+                    UPDATE {schema}.circuit_breakers
+                    SET state = CASE
+                            WHEN %(ok)s THEN 'closed'
+                            WHEN state = 'half_open' OR failure_count + 1 >= %(threshold)s THEN 'open'
+                            ELSE state END,
+                        opened_at = CASE
+                            WHEN NOT %(ok)s AND state <> 'open'
+                                 AND (state = 'half_open' OR failure_count + 1 >= %(threshold)s)
+                            THEN CURRENT_TIMESTAMP ELSE opened_at END,
+                        open_count = open_count + CASE
+                            WHEN NOT %(ok)s AND state <> 'open'
+                                 AND (state = 'half_open' OR failure_count + 1 >= %(threshold)s)
+                            THEN 1 ELSE 0 END,
+                        failure_count = CASE WHEN %(ok)s THEN 0 ELSE failure_count + 1 END,
+                        last_error = CASE WHEN %(ok)s THEN last_error ELSE %(error)s END,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE name = %(name)s
+                      AND NOT (%(ok)s AND state = 'closed' AND failure_count = 0)
+                ''', {'ok': success, 'threshold': BREAKER_FAILURE_THRESHOLD, 'error': error, 'name': BREAKER_NAME})
+                conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f'Failed to record circuit breaker outcome: {e}')
+
+def breaker_status(dsn: str) -> Dict[str, Any]:
+    """Breaker state and open/half-open/rejected counters for monitoring"""
+    schema = 't_p53065890_farmer_landing_proje'
+    conn = psycopg2.connect(dsn)
+    
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f'''
+                SELECT name, state, failure_count, opened_at, last_error,
+                       open_count, half_open_count, rejected_count
+                FROM {schema}.circuit_breakers
+                WHERE name = %s
+            ''', (BREAKER_NAME,))
+            row = cur.fetchone()
+            if not row:
+                return {'name': BREAKER_NAME, 'state': 'closed'}
+            
+            status = dict(row)
+            status['opened_at'] = row['opened_at'].isoformat() if row['opened_at'] else None
+            return status
+    finally:
+        conn.close()
+
+def guarded_call(dsn: str, func, *args):
+    """Run an upstream GigaChat call through the shared circuit breaker"""
+    if dsn and not breaker_allow(dsn):
+        raise CircuitOpenError('GigaChat circuit breaker is open')
+    
+    try:
+        inject_fault()
+        result = func(*args)
+    except Exception as e:
+        if dsn:
+            breaker_record(False, str(e)[:500], dsn)
+        raise
+    
+    if dsn:
+        breaker_record(True, None, dsn)
+    return result
+
+RATING_CATEGORY_NAMES = {
+    'land': 'земля',
+    'animal': 'животноводство',
+    'equipment': 'техника',
+    'crop': 'растениеводство',
+    'staff': 'персонал',
+    'finance': 'финансы'
+}
+
+RATING_CATEGORY_TIPS = {
+    'land': 'Переведите арендуемую землю в собственность или долгосрочную аренду и введите неиспользуемые площади в оборот',
+    'animal': 'Поднимите продуктивность стада: сбалансированный рацион, учет надоев и привесов, племенная работа',
+    'equipment': 'Обновите самую изношенную технику или возьмите ее в лизинг - это снизит расходы на топливо и ремонт',
+    'crop': 'Сравните урожайность по культурам с региональными нормами и скорректируйте систему удобрений',
+    'staff': 'Закрепите постоянный персонал и спланируйте сезонные работы заранее',
+    'finance': 'Пересмотрите каналы сбыта: прямые продажи и переработка повышают цену реализации'
+}
+
+def to_number(value: Any) -> float:
+    """Parse a user-supplied number ("5", "5.5", 5, None); anything unparsable counts as 0"""
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+def to_rating_diagnostics(farm_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Map camelCase farmData onto the diagnostics shape used by farmer-rating"""
+    equipment = []
+    for item in farm_data.get('equipment', []) or []:
+        attachments = item.get('attachments', '')
+        if isinstance(attachments, list):
+            attachments = ', '.join(str(a) for a in attachments)
+        equipment.append({**item, 'attachments': attachments or ''})
+    
+    return {
+        'land_area': to_number(farm_data.get('landArea')),
+        'land_owned': to_number(farm_data.get('landOwned')),
+        'land_rented': to_number(farm_data.get('landRented')),
+        'animals': farm_data.get('animals', []) or [],
+        'equipment': equipment,
+        'crops': farm_data.get('crops', []) or [],
+        'employees_permanent': int(to_number(farm_data.get('employeesPermanent'))),
+        'employees_seasonal': int(to_number(farm_data.get('employeesSeasonal')))
+    }
+
+def build_rule_based_analysis(farm_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Degraded-mode analysis from the farmer-rating breakdown while GigaChat is unavailable"""
+    diagnostics = to_rating_diagnostics(farm_data)
+    breakdown = {
+        'land': calculate_land_score(diagnostics, farm_data.get('region', ''))[0],
+        'animal': calculate_animal_score(diagnostics['animals'])[0],
+        'equipment': calculate_equipment_score(diagnostics['equipment'])[0],
+        'crop': calculate_crop_score(diagnostics['crops'])[0],
+        'staff': calculate_staff_score(diagnostics)[0],
+        'finance': calculate_finance_score(diagnostics)[0]
+    }
+    weakest = sorted(breakdown, key=breakdown.get)[:3]
+    weakest_names = ', '.join(RATING_CATEGORY_NAMES[c] for c in weakest)
+    
+    lines = [
+        f"1. ПРОДУКТИВНОСТЬ: животноводство {breakdown['animal']:.0f}/100, растениеводство {breakdown['crop']:.0f}/100.",
+        f"2. ТЕХНОЛОГИЧНОСТЬ: оснащенность техникой {breakdown['equipment']:.0f}/100.",
+        f"3. ИНВЕСТИЦИИ: в первую очередь - {RATING_CATEGORY_NAMES[weakest[0]]} и {RATING_CATEGORY_NAMES[weakest[1]]}.",
+        f"4. РИСКИ: самые слабые направления - {weakest_names}; финансовый потенциал {breakdown['finance']:.0f}/100.",
+        "5. РЕКОМЕНДАЦИИ:"
+    ] + [f"- {RATING_CATEGORY_TIPS[c]}" for c in weakest]
+    
+    return {
+        'analysis': '\n'.join(lines),
+        'breakdown': {k: round(v, 1) for k, v in breakdown.items()},
+        'timestamp': datetime.now().isoformat(),
+        'model': 'rule-based',
+        'degraded': True
+    }
+
+def calculate_land_score(diagnostics: Dict[str, Any], region: str) -> Tuple[float, float]:
+    land_area = float(diagnostics.get('land_area', 0))
+    land_owned = float(diagnostics.get('land_owned', 0))
+    
+    if land_area == 0:
+        return 0, 1.0
+    
+    area_score = min(100, (land_area / 100) * 50)
+    ownership_ratio = land_owned / land_area if land_area > 0 else 0
+    ownership_score = ownership_ratio * 50
+    
+    base_score = area_score + ownership_score
+    
+    poor_soil_regions = [
+        'Архангельская область', 'Республика Коми', 'Мурманская область',
+        'Ненецкий автономный округ', 'Ямало-Ненецкий автономный округ'
+    ]
+    
+    medium_soil_regions = [
+        'Ленинградская область', 'Новгородская область', 'Псковская область',
+        'Вологодская область', 'Костромская область', 'Тверская область'
+    ]
+    
+    if region in poor_soil_regions:
+        coefficient = 1.2
+    elif region in medium_soil_regions:
+        coefficient = 1.1
+    else:
+        coefficient = 1.0
+    
+    return base_score, coefficient
+
+def calculate_animal_score(animals: List[Dict[str, Any]]) -> Tuple[float, float]:
+    if not animals:
+        return 0, 1.0
+    
+    total_score = 0
+    has_rare_breed = False
+    has_uncommon_breed = False
+    
+    rare_breeds = ['якутская', 'калмыцкая', 'казахская белоголовая', 'герефорд', 'абердин-ангус']
+    uncommon_breeds = ['симментальская', 'шароле', 'лимузин', 'голштинская']
+    
+    animal_productivity = {
+        'cows': {'base': 15, 'meat': 20, 'milk': 25, 'mixed': 22},
+        'pigs': {'base': 12, 'meat': 18},
+        'chickens': {'base': 8, 'meat': 10},
+        'sheep': {'base': 10, 'meat': 12},
+        'horses': {'base': 20},
+        'deer': {'base': 18},
+        'hives': {'base': 25}
+    }
+    
+    for animal in animals:
+        animal_type = animal.get('type', '')
+        count = animal.get('count', 0)
+        direction = animal.get('direction', 'other')
+        breed = animal.get('breed', '').lower()
+        
+        if any(rare in breed for rare in rare_breeds):
+            has_rare_breed = True
+        elif any(uncommon in breed for uncommon in uncommon_breeds):
+            has_uncommon_breed = True
+        
+        if animal_type in animal_productivity:
+            base_value = animal_productivity[animal_type].get(direction, 
+                         animal_productivity[animal_type].get('base', 10))
+            
+            productivity_bonus = 1.0
+            if direction == 'milk' and animal.get('milkYield', 0) > 5000:
+                productivity_bonus = 1.3
+            elif direction == 'meat' and animal.get('meatYield', 0) > 300:
+                productivity_bonus = 1.2
+            
+            total_score += (count / 10) * base_value * productivity_bonus
+    
+    base_score = min(100, total_score)
+    
+    if has_rare_breed:
+        coefficient = 1.2
+    elif has_uncommon_breed:
+        coefficient = 1.1
+    else:
+        coefficient = 1.0
+    
+    return base_score, coefficient
+
+def calculate_equipment_score(equipment: List[Dict[str, Any]]) -> Tuple[float, float]:
+    if not equipment:
+        return 0, 1.2
+    
+    current_year = datetime.now().year
+    total_score = 0
+    avg_age = 0
+    
+    for item in equipment:
+        year = int(item.get('year', current_year))
+        age = current_year - year
+        avg_age += age
+        
+        if age <= 3:
+            age_score = 20
+        elif age <= 7:
+            age_score = 15
+        elif age <= 15:
+            age_score = 10
+        else:
+            age_score = 5
+        
+        has_attachments = bool(item.get('attachments', '').strip())
+        attachment_bonus = 5 if has_attachments else 0
+        
+        total_score += age_score + attachment_bonus
+    
+    base_score = min(100, total_score)
+    avg_age = avg_age / len(equipment) if equipment else 0
+    
+    if avg_age > 15:
+        coefficient = 1.2
+    elif avg_age > 7:
+        coefficient = 1.1
+    else:
+        coefficient = 1.0
+    
+    return base_score, coefficient
+
+def calculate_crop_score(crops: List[Dict[str, Any]]) -> Tuple[float, float]:
+    if not crops:
+        return 0, 1.0
+    
+    complex_crops = ['garlic', 'rapeseed', 'soy']
+    moderate_crops = ['beet', 'cabbage']
+    
+    has_complex = False
+    has_moderate = False
+    
+    crop_benchmarks = {
+        'beet': 45.0,
+        'cabbage': 35.0,
+        'rapeseed': 2.5,
+        'soy': 2.0,
+        'corn': 8.0,
+        'garlic': 15.0,
+        'other': 3.5
+    }
+    
+    total_score = 0
+    
+    for crop in crops:
+        crop_type = crop.get('type', 'other')
+        area = crop.get('area', 0)
+        crop_yield = crop.get('yield', 0)
+        price_per_kg = crop.get('pricePerKg', 10)
+        
+        if crop_type in complex_crops:
+            has_complex = True
+        elif crop_type in moderate_crops:
+            has_moderate = True
+        
+        if area > 0 and crop_yield > 0:
+            benchmark_yield = crop_benchmarks.get(crop_type, 3.5)
+            actual_yield_per_ha = crop_yield / area
+            yield_ratio = actual_yield_per_ha / benchmark_yield
+            
+            price_factor = min(2.0, price_per_kg / 10)
+            
+            crop_score = yield_ratio * area * price_factor * 5
+            total_score += crop_score
+    
+    base_score = min(100, total_score)
+    
+    if has_complex:
+        coefficient = 1.2
+    elif has_moderate:
+        coefficient = 1.1
+    else:
+        coefficient = 1.0
+    
+    return base_score, coefficient
+
+def calculate_staff_score(diagnostics: Dict[str, Any]) -> Tuple[float, float]:
+    permanent = diagnostics.get('employees_permanent', 0)
+    seasonal = diagnostics.get('employees_seasonal', 0)
+    
+    permanent_score = min(70, permanent * 7)
+    seasonal_score = min(30, seasonal * 2)
+    
+    base_score = permanent_score + seasonal_score
+    
+    if permanent < 3:
+        coefficient = 1.2
+    elif permanent < 7:
+        coefficient = 1.1
+    else:
+        coefficient = 1.0
+    
+    return base_score, coefficient
+
+def calculate_finance_score(diagnostics: Dict[str, Any]) -> Tuple[float, float]:
+    animals = diagnostics.get('animals', [])
+    crops = diagnostics.get('crops', [])
+    
+    total_revenue_potential = 0
+    avg_price_level = 0
+    price_count = 0
+    
+    for animal in animals:
+        count = animal.get('count', 0)
+        direction = animal.get('direction', 'other')
+        
+        if direction == 'milk':
+            milk_yield = animal.get('milkYield', 4000)
+            milk_price = animal.get('milkPrice', 35)
+            total_revenue_potential += count * milk_yield * milk_price / 1000
+            avg_price_level += milk_price
+            price_count += 1
+        elif direction == 'meat':
+            meat_yield = animal.get('meatYield', 250)
+            meat_price = animal.get('meatPrice', 300)
+            total_revenue_potential += count * meat_yield * meat_price / 1000
+            avg_price_level += meat_price / 10
+            price_count += 1
+    
+    for crop in crops:
+        crop_yield = crop.get('yield', 0)
+        price_per_kg = crop.get('pricePerKg', 10)
+        total_revenue_potential += crop_yield * price_per_kg / 1000
+        avg_price_level += price_per_kg
+        price_count += 1
+    
+    if total_revenue_potential > 10000:
+        base_score = 100
+    elif total_revenue_potential > 5000:
+        base_score = 85
+    elif total_revenue_potential > 1000:
+        base_score = 70
+    elif total_revenue_potential > 500:
+        base_score = 50
+    elif total_revenue_potential > 100:
+        base_score = 30
+    else:
+        base_score = 10
+    
+    avg_price = avg_price_level / price_count if price_count > 0 else 20
+    
+    if avg_price < 15:
+        coefficient = 1.2
+    elif avg_price < 30:
+        coefficient = 1.1
+    else:
+        coefficient = 1.0
+    
+    return base_score, coefficient
+
+def normalize_farm_data(farm_data: Dict[str, Any]) -> str:
+    """Canonical JSON of farm data: key order and whitespace do not affect hashes"""
+    return json.dumps(farm_data, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+
+def get_diagnostics_version(farm_data: Dict[str, Any]) -> str:
+    """Hash normalized farm data so identical diagnostics map to the same version"""
+    return hashlib.sha256(normalize_farm_data(farm_data).encode('utf-8')).hexdigest()
+
+def get_cache_key(farm_data: Dict[str, Any]) -> str:
+    """Cache key: prompt template version + normalized farm data"""
+    return hashlib.sha256(f'{PROMPT_VERSION}:{normalize_farm_data(farm_data)}'.encode('utf-8')).hexdigest()
+
+def cache_lookup(cur, cache_key: str) -> Optional[Dict[str, Any]]:
+    """Return a live cached response and bump its LRU position in the same statement"""
+    schema = 't_p53065890_farmer_landing_proje'
+    cur.execute(f'''
+        UPDATE {schema}.ai_response_cache
+        SET hit_count = hit_count + 1, last_hit_at = CURRENT_TIMESTAMP
+        WHERE cache_key = %s AND expires_at > CURRENT_TIMESTAMP
+        RETURNING response
+    ''', (cache_key,))
+    row = cur.fetchone()
+    return row['response'] if row else None
+
+def cache_store(cur, cache_key: str, response: Dict[str, Any]) -> None:
+    """Store response with TTL and evict expired and least recently used entries over the size bound"""
+    schema = 't_p53065890_farmer_landing_proje'
+    cur.execute(f'''
+        INSERT INTO {schema}.ai_response_cache (cache_key, source, prompt_version, response, expires_at)
+        VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP + INTERVAL '1 hour' * %s)
+        ON CONFLICT (cache_key) DO UPDATE SET
+            response = EXCLUDED.response,
+            expires_at = EXCLUDED.expires_at,
+            last_hit_at = CURRENT_TIMESTAMP
+    ''', (cache_key, JOB_SOURCE, PROMPT_VERSION, json.dumps(response, ensure_ascii=False), CACHE_TTL_HOURS))
+    
+    cur.execute(f'''
+        DELETE FROM {schema}.ai_response_cache
+        WHERE expires_at <= CURRENT_TIMESTAMP
+           OR cache_key IN (
+               SELECT cache_key FROM {schema}.ai_response_cache
+               WHERE source = %s
+               ORDER BY last_hit_at DESC
+               OFFSET %s
+           )
+    ''', (JOB_SOURCE, CACHE_MAX_ENTRIES))
+
+def record_cache_metric(cur, hit: bool) -> None:
+    """Increment today's hit or miss counter"""
+    schema = 't_p53065890_farmer_landing_proje'
+    cur.execute(f'''
+        INSERT INTO {schema}.ai_cache_metrics (metric_date, source, hits, misses)
+        VALUES (CURRENT_DATE, %s, %s, %s)
+        ON CONFLICT (metric_date, source) DO UPDATE SET
+            hits = {schema}.ai_cache_metrics.hits + EXCLUDED.hits,
+            misses = {schema}.ai_cache_metrics.misses + EXCLUDED.misses
+    ''', (JOB_SOURCE, 1 if hit else 0, 0 if hit else 1))
+
+def get_cache_stats(days: int, dsn: str) -> Dict[str, Any]:
+    """Hit ratio over the last N days plus current cache size"""
+    schema = 't_p53065890_farmer_landing_proje'
+    conn = psycopg2.connect(dsn)
+    
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f'''
+                SELECT
+                    COALESCE(SUM(hits), 0) AS hits,
+                    COALESCE(SUM(misses), 0) AS misses,
+                    (SELECT COUNT(*) FROM {schema}.ai_response_cache WHERE source = %s) AS entries
+                FROM {schema}.ai_cache_metrics
+                WHERE source = %s AND metric_date > CURRENT_DATE - %s
+            ''', (JOB_SOURCE, JOB_SOURCE, days))
+            row = cur.fetchone()
+            
+            hits = int(row['hits'])
+            misses = int(row['misses'])
+            total = hits + misses
+            
+            return {
+                'days': days,
+                'hits': hits,
+                'misses': misses,
+                'hit_ratio': round(hits / total, 4) if total else 0.0,
+                'entries': int(row['entries']),
+                'max_entries': CACHE_MAX_ENTRIES,
+                'ttl_hours': CACHE_TTL_HOURS,
+                'prompt_version': PROMPT_VERSION
+            }
+    finally:
+        conn.close()
+
+def analyze_cached(farm_data: Dict[str, Any], dsn: str) -> Dict[str, Any]:
+    """Serve analysis from cache or call GigaChat and cache the response"""
+    cache_key = get_cache_key(farm_data)
+    
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cached = cache_lookup(cur, cache_key)
+            record_cache_metric(cur, cached is not None)
+            conn.commit()
+    finally:
+        conn.close()
+    
+    if cached:
+        return {**cached, 'cached': True}
+    
+    # Соединение не держим открытым на время запроса к модели
+    result = guarded_call(dsn, lambda: analyze_with_gigachat(farm_data, get_access_token()))
+    
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cache_store(cur, cache_key, result)
+            conn.commit()
+    finally:
+        conn.close()
+    
+    return result
+
+def submit_job(user_id: str, farm_data: Dict[str, Any], dsn: str) -> Dict[str, Any]:
+    """Return stored analysis for this diagnostics version or enqueue a new job"""
+    schema = 't_p53065890_farmer_landing_proje'
+    version = get_diagnostics_version(farm_data)
+    conn = psycopg2.connect(dsn)
+    
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f'''
+                SELECT id, status, diagnostics_version, result, error
+                FROM {schema}.ai_analysis_jobs
+                WHERE user_id = %s AND source = %s AND diagnostics_version = %s
+            ''', (str(user_id), JOB_SOURCE, version))
+            job = cur.fetchone()
+            
+            if job and job['status'] != 'failed':
+                return dict(job)
+            
+            # Тот же анализ уже есть в кэше - задача сразу завершена, без обращения к модели
+            cached = cache_lookup(cur, get_cache_key(farm_data))
+            if cached:
+                record_cache_metric(cur, True)
+                status = 'done'
+                result = json.dumps({**cached, 'cached': True}, ensure_ascii=False)
+            else:
+                status = 'pending'
+                result = None
+            
+            # Новая задача или повтор после ошибки
+            cur.execute(f'''
+                INSERT INTO {schema}.ai_analysis_jobs (id, user_id, source, diagnostics_version, farm_data, status, result)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (user_id, source, diagnostics_version) DO UPDATE SET
+                    status = CASE WHEN {schema}.ai_analysis_jobs.status = 'failed'
+                                  THEN EXCLUDED.status ELSE {schema}.ai_analysis_jobs.status END,
+                    result = CASE WHEN {schema}.ai_analysis_jobs.status = 'failed'
+                                  THEN EXCLUDED.result ELSE {schema}.ai_analysis_jobs.result END,
+                    error = NULL
+                RETURNING id, status, diagnostics_version, result, error
+            ''', (str(uuid.uuid4()), str(user_id), JOB_SOURCE, version,
+                  json.dumps(farm_data, ensure_ascii=False), status, result))
+            job = cur.fetchone()
+            conn.commit()
+            
+            return dict(job)
+    finally:
+        conn.close()
+
+def get_job(job_id: str, user_id: str, dsn: str) -> Optional[Dict[str, Any]]:
+    """Load job status and result for its owner"""
+    schema = 't_p53065890_farmer_landing_proje'
+    conn = psycopg2.connect(dsn)
+    
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f'''
+                SELECT id, status, diagnostics_version, result, error
+                FROM {schema}.ai_analysis_jobs
+                WHERE id = %s AND user_id = %s AND source = %s
+            ''', (job_id, str(user_id), JOB_SOURCE))
+            job = cur.fetchone()
+            
+            return dict(job) if job else None
+    finally:
+        conn.close()
+
+def get_flight_key(user_id: str, diagnostics_version: str) -> str:
+    """Single-flight key: one in-flight analysis per user and payload hash"""
+    return f'{JOB_SOURCE}:{user_id}:{diagnostics_version}'
+
+def claim_job(cur, job_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Atomically take a pending (or stale running) job and its flight lock; concurrent workers skip locked rows"""
+    schema = 't_p53065890_farmer_landing_proje'
+    cur.execute(f'''
+        UPDATE {schema}.ai_analysis_jobs
+        SET status = 'running', started_at = CURRENT_TIMESTAMP, attempts = attempts + 1
+        WHERE id = (
+            SELECT id FROM {schema}.ai_analysis_jobs
+            WHERE source = %s
+              AND (%s IS NULL OR id = %s)
+              AND (status = 'pending'
+                   OR (status = 'running' AND started_at < CURRENT_TIMESTAMP - INTERVAL '{JOB_STALE_MINUTES} minutes'))
+            ORDER BY created_at
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, user_id, diagnostics_version, farm_data
+    ''', (JOB_SOURCE, job_id, job_id))
+    job = cur.fetchone()
+    if not job:
+        return None
+    
+    # Session-level advisory lock берется до коммита статуса running: кто видит running, тот может ждать lock
+    cur.execute(
+        'SELECT pg_try_advisory_lock(hashtextextended(%s, 0)) AS locked',
+        (get_flight_key(job['user_id'], job['diagnostics_version']),)
+    )
+    if not cur.fetchone()['locked']:
+        # Предыдущий исполнитель зависшей задачи еще жив - не дублируем вызов модели
+        return None
+    
+    return dict(job)
+
+def finish_job(job: Dict[str, Any], result: Optional[Dict[str, Any]], error: Optional[str], dsn: str) -> None:
+    """Persist job result and notify the farmer that the analysis is ready"""
+    schema = 't_p53065890_farmer_landing_proje'
+    status = 'failed' if error else 'done'
+    conn = psycopg2.connect(dsn)
+    
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'''
+                UPDATE {schema}.ai_analysis_jobs
+                SET status = %s, result = %s, error = %s, finished_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            ''', (status, json.dumps(result, ensure_ascii=False) if result else None, error, job['id']))
+            
+            if status == 'done' and str(job['user_id']).isdigit():
+                cur.execute(f'''
+                    INSERT INTO {schema}.notifications (user_id, type, payload)
+                    VALUES (%s, 'ai_analysis_ready', %s)
+                ''', (int(job['user_id']), json.dumps({'job_id': job['id'], 'source': JOB_SOURCE})))
+            
+            conn.commit()
+    finally:
+        conn.close()
+
+def run_job(job_id: Optional[str], dsn: str) -> Optional[Dict[str, Any]]:
+    """Worker step: claim one job with its flight lock, run (cached) GigaChat analysis and store the outcome"""
+    conn = psycopg2.connect(dsn)
+    
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            job = claim_job(cur, job_id)
+            if not job:
+                conn.rollback()
+                return None
+            conn.commit()
+        
+        try:
+            result = analyze_cached(job['farm_data'], dsn)
+            finish_job(job, result, None, dsn)
+            return {'id': job['id'], 'status': 'done'}
+        except CircuitOpenError as e:
+            # Деградированный режим: ответ по разбивке рейтинга, задача повторится при следующем запросе.
+            # Ошибка в самом fallback не должна оставить задачу в running до истечения захвата
+            try:
+                fallback = build_rule_based_analysis(job['farm_data'])
+            except Exception as fallback_error:
+                print(f"Rule-based fallback failed: {fallback_error}")
+                fallback = None
+            finish_job(job, fallback, str(e), dsn)
+            return {'id': job['id'], 'status': 'failed', 'degraded': fallback is not None}
+        except Exception as e:
+            finish_job(job, None, str(e), dsn)
+            return {'id': job['id'], 'status': 'failed', 'error': str(e)}
+    finally:
+        # Закрытие сессии снимает advisory lock и будит ожидающих
+        conn.close()
+
+def wait_for_job(job: Dict[str, Any], user_id: str, wait_seconds: int, dsn: str) -> Dict[str, Any]:
+    """Block on the leader's flight lock (bounded by lock_timeout), then return the fresh job row"""
+    schema = 't_p53065890_farmer_landing_proje'
+    flight_key = get_flight_key(str(user_id), job['diagnostics_version'])
+    conn = psycopg2.connect(dsn)
+    
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f"SET lock_timeout = '{int(wait_seconds)}s'")
+            try:
+                cur.execute('SELECT pg_advisory_lock(hashtextextended(%s, 0))', (flight_key,))
+                cur.execute('SELECT pg_advisory_unlock(hashtextextended(%s, 0))', (flight_key,))
+            except psycopg2.errors.LockNotAvailable:
+                conn.rollback()
+            
+            cur.execute(f'''
+                SELECT id, status, diagnostics_version, result, error
+                FROM {schema}.ai_analysis_jobs
+                WHERE id = %s
+            ''', (job['id'],))
+            row = cur.fetchone()
+            
+            return dict(row) if row else job
+    finally:
+        conn.close()
+
+def await_job(job: Dict[str, Any], user_id: str, wait_seconds: int, dsn: str) -> Dict[str, Any]:
+    """Single-flight: the first caller runs the job, concurrent duplicates wait for its result"""
+    if job['status'] == 'pending':
+        # Если задачу уже забрал другой экземпляр, run_job вернет None и мы просто ждем
+        run_job(job['id'], dsn)
+    return wait_for_job(job, user_id, wait_seconds, dsn)
+
+def job_response(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Serialize job for the client: finished and degraded jobs carry the analysis fields inline"""
+    body = {
+        'job_id': job['id'],
+        'status': job['status'],
+        'diagnostics_version': job.get('diagnostics_version')
+    }
+    if job.get('result'):
+        body.update(job['result'])
+    if job.get('error'):
+        body['error'] = job['error']
+    return body
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Business: Async farm analysis jobs - POST submits farmData and returns job_id (or the stored result;
+              ?wait=N waits up to N seconds, concurrent duplicates share one GigaChat call),
+              GET ?job_id= polls status; admin-only (X-Admin-Secret): POST ?action=run_job runs the worker
+              step for the timer trigger, GET ?action=cache_stats returns response cache hit ratio,
+              GET ?action=breaker_status - GigaChat breaker
+    """
     method: str = event.get('httpMethod', 'GET')
     
     # Handle CORS
@@ -159,32 +971,105 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Admin-Secret',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
+    response_headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*'
+    }
+    
+    params = event.get('queryStringParameters') or {}
+    action = params.get('action', '')
+    dsn = os.environ.get('DATABASE_URL', '')
+    
     headers = event.get('headers', {})
+    
+    # Worker step (только таймер с X-Admin-Secret): запускает платные вызовы GigaChat для поставленных задач
+    if method == 'POST' and action == 'run_job':
+        admin_secret = headers.get('x-admin-secret') or headers.get('X-Admin-Secret')
+        if admin_secret != ADMIN_SECRET:
+            return {
+                'statusCode': 403,
+                'headers': response_headers,
+                'body': json.dumps({'error': 'Access denied'})
+            }
+        processed = run_job(params.get('job_id'), dsn)
+        return {
+            'statusCode': 200,
+            'headers': response_headers,
+            'body': json.dumps({'processed': processed}, ensure_ascii=False)
+        }
+    
     user_id = headers.get('X-User-Id') or headers.get('x-user-id')
     
     if not user_id:
         return {
             'statusCode': 401,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
+            'headers': response_headers,
             'body': json.dumps({'error': 'Missing X-User-Id header'})
         }
     
+    if method == 'GET' and action in ('breaker_status', 'cache_stats'):
+        admin_secret = headers.get('x-admin-secret') or headers.get('X-Admin-Secret')
+        if admin_secret != ADMIN_SECRET:
+            return {
+                'statusCode': 403,
+                'headers': response_headers,
+                'body': json.dumps({'error': 'Access denied'})
+            }
+    
+    if method == 'GET' and action == 'breaker_status':
+        return {
+            'statusCode': 200,
+            'headers': response_headers,
+            'body': json.dumps(breaker_status(dsn))
+        }
+    
+    if method == 'GET' and action == 'cache_stats':
+        days = params.get('days') or '7'
+        if not days.isdigit():
+            return {
+                'statusCode': 400,
+                'headers': response_headers,
+                'body': json.dumps({'error': 'days must be a number'})
+            }
+        return {
+            'statusCode': 200,
+            'headers': response_headers,
+            'body': json.dumps(get_cache_stats(int(days), dsn))
+        }
+    
+    if method == 'GET':
+        job_id = params.get('job_id')
+        if not job_id:
+            return {
+                'statusCode': 400,
+                'headers': response_headers,
+                'body': json.dumps({'error': 'job_id is required'})
+            }
+        
+        job = get_job(job_id, user_id, dsn)
+        if not job:
+            return {
+                'statusCode': 404,
+                'headers': response_headers,
+                'body': json.dumps({'error': 'Job not found'})
+            }
+        
+        return {
+            'statusCode': 200,
+            'headers': response_headers,
+            'body': json.dumps(job_response(job), ensure_ascii=False)
+        }
+    
     if method != 'POST':
         return {
             'statusCode': 405,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
+            'headers': response_headers,
             'body': json.dumps({'error': 'Method not allowed'})
         }
     
@@ -199,23 +1084,29 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     if not farm_data:
         return {
             'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
+            'headers': response_headers,
             'body': json.dumps({'error': 'Farm data is required'})
         }
     
-    # Get access token and analyze
-    access_token = get_access_token()
-    analysis_result = analyze_with_gigachat(farm_data, access_token)
+    wait = params.get('wait')
+    if wait and not wait.isdigit():
+        return {
+            'statusCode': 400,
+            'headers': response_headers,
+            'body': json.dumps({'error': 'wait must be a number'})
+        }
+    
+    # Повторный просмотр того же отчета - одно чтение из БД вместо вызова модели
+    job = submit_job(user_id, farm_data, dsn)
+    
+    # ?wait=N - дождаться результата: первый запрос выполняет анализ, дубли ждут его (single-flight)
+    wait_seconds = min(int(wait or 0), MAX_WAIT_SECONDS)
+    if wait_seconds > 0 and job['status'] in ('pending', 'running'):
+        job = await_job(job, user_id, wait_seconds, dsn)
     
     return {
         'statusCode': 200,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
+        'headers': response_headers,
         'isBase64Encoded': False,
-        'body': json.dumps(analysis_result, ensure_ascii=False)
-    }
\ No newline at end of file
+        'body': json.dumps(job_response(job), ensure_ascii=False)
+    }
@@ -1,56 +1,29 @@
 import json
 import os
-from typing import Dict, Any
+import uuid
+import time
+import hashlib
+from typing import Dict, Any, Optional
 import requests
+import psycopg2
+from psycopg2.extras import RealDictCursor
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    '''
-    Business: Analyze farm data using GigaChat AI and provide recommendations
-    Args: event with httpMethod, body (farmData), headers (X-User-Id)
-          context with request_id, function_name attributes
-    Returns: HTTP response with AI analysis and recommendations
-    '''
-    method: str = event.get('httpMethod', 'POST')
-    
-    # Handle CORS
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
-    
-    if method != 'POST':
-        return {
-            'statusCode': 405,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
-    
-    # Parse request
-    body_data = json.loads(event.get('body', '{}'))
-    farm_data = body_data.get('farmData', {})
-    
-    # Get GigaChat credentials
+JOB_SOURCE = 'ai-analysis'
+JOB_STALE_MINUTES = 5
+MAX_WAIT_SECONDS = 25
+BREAKER_NAME = 'gigachat'
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('GIGACHAT_BREAKER_THRESHOLD', '5'))
+BREAKER_COOLDOWN_SECONDS = int(os.environ.get('GIGACHAT_BREAKER_COOLDOWN', '60'))
+GIGACHAT_TIMEOUT_SECONDS = int(os.environ.get('GIGACHAT_TIMEOUT_SECONDS', '30'))
+# Пробный запрос half_open - получение токена и запрос к модели, каждый ограничен GIGACHAT_TIMEOUT_SECONDS
+BREAKER_PROBE_LEASE_SECONDS = 2 * GIGACHAT_TIMEOUT_SECONDS
+ADMIN_SECRET = "farmer_admin_2025_secret_key"
+
+def analyze_farm(farm_data: Dict[str, Any], request_id: str) -> str:
+    """Run GigaChat analysis of farm data and return the markdown report"""
     gigachat_key = os.environ.get('GIGACHAT_API_KEY', '')
-    
     if not gigachat_key:
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'GigaChat API key not configured'})
-        }
+        raise Exception('GigaChat API key not configured')
     
     # Prepare analysis prompt
     prompt = f"""Ты — эксперт по сельскому хозяйству. Проанализируй данные фермерского хозяйства и дай конкретные рекомендации.
@@ -83,63 +56,549 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 
 Отвечай кратко, по делу, с конкретными цифрами и примерами."""
 
+    # Get GigaChat access token
+    auth_response = requests.post(
+        'https://ngw.devices.sberbank.ru:9443/api/v2/oauth',
+        headers={
+            'Authorization': f'Bearer {gigachat_key}',
+            'RqUID': request_id,
+            'Content-Type': 'application/x-www-form-urlencoded'
+        },
+        data={'scope': 'GIGACHAT_API_PERS'},
+        verify=False,
+        timeout=GIGACHAT_TIMEOUT_SECONDS
+    )
+    
+    if auth_response.status_code != 200:
+        raise Exception('Failed to authenticate with GigaChat')
+    
+    access_token = auth_response.json().get('access_token')
+    
+    # Call GigaChat API
+    chat_response = requests.post(
+        'https://gigachat.devices.sberbank.ru/api/v1/chat/completions',
+        headers={
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/json'
+        },
+        json={
+            'model': 'GigaChat',
+            'messages': [
+                {'role': 'system', 'content': 'Ты — эксперт по агробизнесу и консультант фермеров.'},
+                {'role': 'user', 'content': prompt}
+            ],
+            'temperature': 0.7,
+            'max_tokens': 1500
+        },
+        verify=False,
+        timeout=GIGACHAT_TIMEOUT_SECONDS
+    )
+    
+    if chat_response.status_code != 200:
+        raise Exception('GigaChat API error')
+    
+    return chat_response.json()['choices'][0]['message']['content']
+
+class CircuitOpenError(Exception):
+    """GigaChat call rejected by the open circuit breaker without touching upstream"""
+
+def inject_fault() -> None:
+    """Local fault-injection stub: GIGACHAT_FAULT_INJECTION=error|timeout|slow:<seconds>"""
+    fault = os.environ.get('GIGACHAT_FAULT_INJECTION', '')
+    if fault == 'error':
+        raise requests.ConnectionError('Injected GigaChat fault')
+    if fault == 'timeout':
+        raise requests.Timeout('Injected GigaChat timeout')
+    if fault.startswith('slow:'):
+        time.sleep(float(fault.split(':', 1)[1]))
+
+def breaker_allow(dsn: str) -> bool:
+    """Closed breaker lets calls through; open one admits a single half-open probe after the cooldown"""
+    schema = 't_p53065890_farmer_landing_proje'
     try:
-        # Get GigaChat access token
-        auth_response = requests.post(
-            'https://ngw.devices.sberbank.ru:9443/api/v2/oauth',
-            headers={
-                'Authorization': f'Bearer {gigachat_key}',
-                'RqUID': context.request_id,
-                'Content-Type': 'application/x-www-form-urlencoded'
-            },
-            data={'scope': 'GIGACHAT_API_PERS'},
-            verify=False,
-            timeout=10
+        conn = psycopg2.connect(dsn)
+    except Exception as e:
+        print(f'Circuit breaker storage unavailable: {e}')
+        return True
+    
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f'SELECT state FROM {schema}.circuit_breakers WHERE name = %s', (BREAKER_NAME,))
+            row = cur.fetchone()
+            if not row or row['state'] == 'closed':
+                return True
+            
+            # Строка блокируется UPDATE: пробный запрос получит только один вызов
+            cur.execute(f'''
+                UPDATE {schema}.circuit_breakers
+                SET state = 'half_open',
+                    probe_started_at = CURRENT_TIMESTAMP,
+                    half_open_count = half_open_count + CASE WHEN state = 'open' THEN 1 ELSE 0 END,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE name = %s
+                  AND ((state = 'open' AND opened_at <= CURRENT_TIMESTAMP - INTERVAL '1 second' * %s)
+                       OR (state = 'half_open' AND probe_started_at <= CURRENT_TIMESTAMP - INTERVAL '1 second' * %s))
+                RETURNING name
+            ''', (BREAKER_NAME, BREAKER_COOLDOWN_SECONDS, BREAKER_PROBE_LEASE_SECONDS))
+            allowed = cur.fetchone() is not None
+            
+            if not allowed:
+                cur.execute(f'''
+                    UPDATE {schema}.circuit_breakers
+                    SET rejected_count = rejected_count + 1
+                    WHERE name = %s
+                ''', (BREAKER_NAME,))
+            
+            conn.commit()
+            return allowed
+    finally:
+        conn.close()
+
+def breaker_record(success: bool, error: Optional[str], dsn: str) -> None:
+    """Record call outcome: success closes the breaker, threshold failures or a failed probe open it"""
+    schema = 't_p53065890_farmer_landing_proje'
+    try:
+        conn = psycopg2.connect(dsn)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f'''
+                    UPDATE {schema}.circuit_breakers
+                    SET state = CASE
+                            WHEN %(ok)s THEN 'closed'
+                            WHEN state = 'half_open' OR failure_count + 1 >= %(threshold)s THEN 'open'
+                            ELSE state END,
+                        opened_at = CASE
+                            WHEN NOT %(ok)s AND state <> 'open'
+                                 AND (state = 'half_open' OR failure_count + 1 >= %(threshold)s)
+                            THEN CURRENT_TIMESTAMP ELSE opened_at END,
+                        open_count = open_count + CASE
+                            WHEN NOT %(ok)s AND state <> 'open'
+                                 AND (state = 'half_open' OR failure_count + 1 >= %(threshold)s)
+                            THEN 1 ELSE 0 END,
+                        failure_count = CASE WHEN %(ok)s THEN 0 ELSE failure_count + 1 END,
+                        last_error = CASE WHEN %(ok)s THEN last_error ELSE %(error)s END,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE name = %(name)s
+                      AND NOT (%(ok)s AND state = 'closed' AND failure_count = 0)
+                ''', {'ok': success, 'threshold': BREAKER_FAILURE_THRESHOLD, 'error': error, 'name': BREAKER_NAME})
+                conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f'Failed to record circuit breaker outcome: {e}')
+
+def breaker_status(dsn: str) -> Dict[str, Any]:
+    """Breaker state and open/half-open/rejected counters for monitoring"""
+    schema = 't_p53065890_farmer_landing_proje'
+    conn = psycopg2.connect(dsn)
+    
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f'''
+                SELECT name, state, failure_count, opened_at, last_error,
+                       open_count, half_open_count, rejected_count
+                FROM {schema}.circuit_breakers
+                WHERE name = %s
+            ''', (BREAKER_NAME,))
+            row = cur.fetchone()
+            if not row:
+                return {'name': BREAKER_NAME, 'state': 'closed'}
+            
+            status = dict(row)
+            status['opened_at'] = row['opened_at'].isoformat() if row['opened_at'] else None
+            return status
+    finally:
+        conn.close()
+
+def guarded_call(dsn: str, func, *args):
+    """Run an upstream GigaChat call through the shared circuit breaker"""
+    if dsn and not breaker_allow(dsn):
+        raise CircuitOpenError('GigaChat circuit breaker is open')
+    
+    try:
+        inject_fault()
+        result = func(*args)
+    except Exception as e:
+        if dsn:
+            breaker_record(False, str(e)[:500], dsn)
+        raise
+    
+    if dsn:
+        breaker_record(True, None, dsn)
+    return result
+
+def get_latest_result(user_id: str, dsn: str) -> Optional[Dict[str, Any]]:
+    """Last successful analysis of the user, served as a stale answer while GigaChat is unavailable"""
+    schema = 't_p53065890_farmer_landing_proje'
+    conn = psycopg2.connect(dsn)
+    
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f'''
+                SELECT result FROM {schema}.ai_analysis_jobs
+                WHERE user_id = %s AND source = %s AND status = 'done'
+                ORDER BY finished_at DESC
+                LIMIT 1
+            ''', (str(user_id), JOB_SOURCE))
+            row = cur.fetchone()
+            
+            return row['result'] if row else None
+    finally:
+        conn.close()
+
+def get_diagnostics_version(farm_data: Dict[str, Any]) -> str:
+    """Hash normalized farm data so identical diagnostics map to the same version"""
+    normalized = json.dumps(farm_data, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+def submit_job(user_id: str, farm_data: Dict[str, Any], dsn: str) -> Dict[str, Any]:
+    """Return stored analysis for this diagnostics version or enqueue a new job"""
+    schema = 't_p53065890_farmer_landing_proje'
+    version = get_diagnostics_version(farm_data)
+    conn = psycopg2.connect(dsn)
+    
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f'''
+                SELECT id, status, diagnostics_version, result, error
+                FROM {schema}.ai_analysis_jobs
+                WHERE user_id = %s AND source = %s AND diagnostics_version = %s
+            ''', (str(user_id), JOB_SOURCE, version))
+            job = cur.fetchone()
+            
+            if job and job['status'] != 'failed':
+                return dict(job)
+            
+            # Новая задача или повтор после ошибки
+            cur.execute(f'''
+                INSERT INTO {schema}.ai_analysis_jobs (id, user_id, source, diagnostics_version, farm_data)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (user_id, source, diagnostics_version) DO UPDATE SET
+                    status = CASE WHEN {schema}.ai_analysis_jobs.status = 'failed'
+                                  THEN 'pending' ELSE {schema}.ai_analysis_jobs.status END,
+                    error = NULL
+                RETURNING id, status, diagnostics_version, result, error
+            ''', (str(uuid.uuid4()), str(user_id), JOB_SOURCE, version, json.dumps(farm_data, ensure_ascii=False)))
+            job = cur.fetchone()
+            conn.commit()
+            
+            return dict(job)
+    finally:
+        conn.close()
+
+def get_job(job_id: str, user_id: str, dsn: str) -> Optional[Dict[str, Any]]:
+    """Load job status and result for its owner"""
+    schema = 't_p53065890_farmer_landing_proje'
+    conn = psycopg2.connect(dsn)
+    
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f'''
+                SELECT id, status, diagnostics_version, result, error
+                FROM {schema}.ai_analysis_jobs
+                WHERE id = %s AND user_id = %s AND source = %s
+            ''', (job_id, str(user_id), JOB_SOURCE))
+            job = cur.fetchone()
+            
+            return dict(job) if job else None
+    finally:
+        conn.close()
+
+def get_flight_key(user_id: str, diagnostics_version: str) -> str:
+    """Single-flight key: one in-flight analysis per user and payload hash"""
+    return f'{JOB_SOURCE}:{user_id}:{diagnostics_version}'
+
+def claim_job(cur, job_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Atomically take a pending (or stale running) job and its flight lock; concurrent workers skip locked rows"""
+    schema = 't_p53065890_farmer_landing_proje'
+    cur.execute(f'''
+        UPDATE {schema}.ai_analysis_jobs
+        SET status = 'running', started_at = CURRENT_TIMESTAMP, attempts = attempts + 1
+        WHERE id = (
+            SELECT id FROM {schema}.ai_analysis_jobs
+            WHERE source = %s
+              AND (%s IS NULL OR id = %s)
+              AND (status = 'pending'
+                   OR (status = 'running' AND started_at < CURRENT_TIMESTAMP - INTERVAL '{JOB_STALE_MINUTES} minutes'))
+            ORDER BY created_at
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
         )
+        RETURNING id, user_id, diagnostics_version, farm_data
+    ''', (JOB_SOURCE, job_id, job_id))
+    job = cur.fetchone()
+    if not job:
+        return None
+    
+    # Session-level advisory lock берется до коммита статуса running: кто видит running, тот может ждать lock
+    cur.execute(
+        'SELECT pg_try_advisory_lock(hashtextextended(%s, 0)) AS locked',
+        (get_flight_key(job['user_id'], job['diagnostics_version']),)
+    )
+    if not cur.fetchone()['locked']:
+        # Предыдущий исполнитель зависшей задачи еще жив - не дублируем вызов модели
+        return None
+    
+    return dict(job)
+
+def finish_job(job: Dict[str, Any], result: Optional[Dict[str, Any]], error: Optional[str], dsn: str) -> None:
+    """Persist job result and notify the farmer that the analysis is ready"""
+    schema = 't_p53065890_farmer_landing_proje'
+    status = 'failed' if error else 'done'
+    conn = psycopg2.connect(dsn)
+    
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'''
+                UPDATE {schema}.ai_analysis_jobs
+                SET status = %s, result = %s, error = %s, finished_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            ''', (status, json.dumps(result, ensure_ascii=False) if result else None, error, job['id']))
+            
+            if status == 'done' and str(job['user_id']).isdigit():
+                cur.execute(f'''
+                    INSERT INTO {schema}.notifications (user_id, type, payload)
+                    VALUES (%s, 'ai_analysis_ready', %s)
+                ''', (int(job['user_id']), json.dumps({'job_id': job['id'], 'source': JOB_SOURCE})))
+            
+            conn.commit()
+    finally:
+        conn.close()
+
+def run_job(job_id: Optional[str], request_id: str, dsn: str) -> Optional[Dict[str, Any]]:
+    """Worker step: claim one job with its flight lock, run GigaChat analysis and store the outcome"""
+    conn = psycopg2.connect(dsn)
+    
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            job = claim_job(cur, job_id)
+            if not job:
+                conn.rollback()
+                return None
+            conn.commit()
         
-        if auth_response.status_code != 200:
+        try:
+            result = {'analysis': guarded_call(dsn, lambda: analyze_farm(job['farm_data'], request_id))}
+            finish_job(job, result, None, dsn)
+            return {'id': job['id'], 'status': 'done'}
+        except CircuitOpenError as e:
+            # Деградированный режим: отдаем последний успешный анализ, задача повторится при следующем запросе
+            latest = get_latest_result(job['user_id'], dsn)
+            fallback = {**latest, 'degraded': True, 'stale': True} if latest else None
+            finish_job(job, fallback, str(e), dsn)
+            return {'id': job['id'], 'status': 'failed', 'degraded': fallback is not None}
+        except Exception as e:
+            finish_job(job, None, str(e), dsn)
+            return {'id': job['id'], 'status': 'failed', 'error': str(e)}
+    finally:
+        # Закрытие сессии снимает advisory lock и будит ожидающих
+        conn.close()
+
+def wait_for_job(job: Dict[str, Any], user_id: str, wait_seconds: int, dsn: str) -> Dict[str, Any]:
+    """Block on the leader's flight lock (bounded by lock_timeout), then return the fresh job row"""
+    schema = 't_p53065890_farmer_landing_proje'
+    flight_key = get_flight_key(str(user_id), job['diagnostics_version'])
+    conn = psycopg2.connect(dsn)
+    
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f"SET lock_timeout = '{int(wait_seconds)}s'")
+            try:
+                cur.execute('SELECT pg_advisory_lock(hashtextextended(%s, 0))', (flight_key,))
+                cur.execute('SELECT pg_advisory_unlock(hashtextextended(%s, 0))', (flight_key,))
+            except psycopg2.errors.LockNotAvailable:
+                conn.rollback()
+            
+            cur.execute(f'''
+                SELECT id, status, diagnostics_version, result, error
+                FROM {schema}.ai_analysis_jobs
+                WHERE id = %s
+            ''', (job['id'],))
+            row = cur.fetchone()
+            
+            return dict(row) if row else job
+    finally:
+        conn.close()
+
+def await_job(job: Dict[str, Any], user_id: str, wait_seconds: int, request_id: str, dsn: str) -> Dict[str, Any]:
+    """Single-flight: the first caller runs the job, concurrent duplicates wait for its result"""
+    if job['status'] == 'pending':
+        # Если задачу уже забрал другой экземпляр, run_job вернет None и мы просто ждем
+        run_job(job['id'], request_id, dsn)
+    return wait_for_job(job, user_id, wait_seconds, dsn)
+
+def job_response(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Serialize job for the client: finished and degraded jobs carry the analysis fields inline"""
+    body = {
+        'job_id': job['id'],
+        'status': job['status'],
+        'diagnostics_version': job.get('diagnostics_version')
+    }
+    if job.get('result'):
+        body.update(job['result'])
+    if job.get('error'):
+        body['error'] = job['error']
+    return body
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Analyze farm data using GigaChat AI and provide recommendations as async jobs
+    Args: event with httpMethod, body (farmData), headers (X-User-Id),
+          queryStringParameters (job_id - poll status, action=run_job - worker step for the timer trigger (X-Admin-Secret),
+          wait - seconds to wait for the result; concurrent duplicates share one GigaChat call)
+          context with request_id, function_name attributes
+    Returns: HTTP response with job status; finished jobs include the AI analysis
+    '''
+    method: str = event.get('httpMethod', 'POST')
+    
+    # Handle CORS
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Admin-Secret',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': ''
+        }
+    
+    params = event.get('queryStringParameters') or {}
+    action = params.get('action', '')
+    dsn = os.environ.get('DATABASE_URL', '')
+    
+    headers = event.get('headers', {})
+    
+    # Worker step запускает платные вызовы GigaChat - только таймер с X-Admin-Secret
+    if method == 'POST' and action == 'run_job':
+        admin_secret = headers.get('x-admin-secret') or headers.get('X-Admin-Secret')
+        if admin_secret != ADMIN_SECRET:
             return {
-                'statusCode': 500,
+                'statusCode': 403,
                 'headers': {
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({'error': 'Failed to authenticate with GigaChat'})
+                'body': json.dumps({'error': 'Access denied'})
             }
-        
-        access_token = auth_response.json().get('access_token')
-        
-        # Call GigaChat API
-        chat_response = requests.post(
-            'https://gigachat.devices.sberbank.ru/api/v1/chat/completions',
-            headers={
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
+        processed = run_job(params.get('job_id'), context.request_id, dsn)
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
             },
-            json={
-                'model': 'GigaChat',
-                'messages': [
-                    {'role': 'system', 'content': 'Ты — эксперт по агробизнесу и консультант фермеров.'},
-                    {'role': 'user', 'content': prompt}
-                ],
-                'temperature': 0.7,
-                'max_tokens': 1500
+            'body': json.dumps({'processed': processed}, ensure_ascii=False)
+        }
+    
+    user_id = headers.get('X-User-Id') or headers.get('x-user-id')
+    
+    if not user_id:
+        return {
+            'statusCode': 401,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
             },
-            verify=False,
-            timeout=50
-        )
+            'body': json.dumps({'error': 'Missing X-User-Id header'})
+        }
+    
+    if method == 'GET' and params.get('action') == 'breaker_status':
+        # Состояние breaker содержит текст ошибок внешнего API - только для администратора
+        admin_secret = headers.get('x-admin-secret') or headers.get('X-Admin-Secret')
+        if admin_secret != ADMIN_SECRET:
+            return {
+                'statusCode': 403,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': 'Access denied'})
+            }
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps(breaker_status(dsn))
+        }
+    
+    if method == 'GET':
+        job_id = params.get('job_id')
+        if not job_id:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': 'job_id is required'})
+            }
         
-        if chat_response.status_code != 200:
+        job = get_job(job_id, user_id, dsn)
+        if not job:
             return {
-                'statusCode': 500,
+                'statusCode': 404,
                 'headers': {
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({'error': 'GigaChat API error'})
+                'body': json.dumps({'error': 'Job not found'})
             }
         
-        analysis = chat_response.json()['choices'][0]['message']['content']
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps(job_response(job), ensure_ascii=False)
+        }
+    
+    if method != 'POST':
+        return {
+            'statusCode': 405,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': 'Method not allowed'})
+        }
+    
+    # Parse request
+    body_data = json.loads(event.get('body') or '{}')
+    farm_data = body_data.get('farmData', {})
+    
+    if not farm_data:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': 'Farm data is required'})
+        }
+    
+    wait = params.get('wait')
+    if wait and not wait.isdigit():
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': 'wait must be a number'})
+        }
+    
+    try:
+        job = submit_job(user_id, farm_data, dsn)
+        
+        # ?wait=N - дождаться результата: первый запрос выполняет анализ, дубли ждут его (single-flight)
+        wait_seconds = min(int(wait or 0), MAX_WAIT_SECONDS)
+        if wait_seconds > 0 and job['status'] in ('pending', 'running'):
+            job = await_job(job, user_id, wait_seconds, context.request_id, dsn)
         
         return {
             'statusCode': 200,
@@ -147,7 +606,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({'analysis': analysis})
+            'body': json.dumps(job_response(job), ensure_ascii=False)
         }
         
     except Exception as e:
@@ -158,4 +617,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'Access-Control-Allow-Origin': '*'
             },
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
@@ -1,13 +1,157 @@
 import json
 import os
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
+NATIONAL_REGION = 'Россия'
+UNKNOWN_REGION = 'Не указан'
+WATERMARK_JOB = 'regional_farm_stats'
+
+NUMBER_PATTERN = r'^[0-9]+([.,][0-9]+)?$'
+
+def build_stats_query(schema: str, region_expr: str, region_filter: str) -> str:
+    """Aggregate per-farm metrics into mean/median/percentiles grouped by region_expr"""
+    return f'''
+        WITH farm_values AS (
+            SELECT
+                {region_expr} AS region,
+                CASE WHEN d.land_area ~ '{NUMBER_PATTERN}'
+                     THEN replace(d.land_area, ',', '.')::numeric END AS land_area,
+                (SELECT SUM(replace(a->>'count', ',', '.')::numeric)
+                   FROM jsonb_array_elements(CASE WHEN jsonb_typeof(d.animals) = 'array' THEN d.animals ELSE '[]'::jsonb END) a
+                  WHERE a->>'count' ~ '{NUMBER_PATTERN}') AS animals,
+                (SELECT AVG(replace(c->>'yield', ',', '.')::numeric)
+                   FROM jsonb_array_elements(CASE WHEN jsonb_typeof(d.crops) = 'array' THEN d.crops ELSE '[]'::jsonb END) c
+                  WHERE c->>'yield' ~ '{NUMBER_PATTERN}') AS crop_yield,
+                COALESCE(d.employees_permanent, 0) + COALESCE(d.employees_seasonal, 0) AS employees
+            FROM {schema}.farm_diagnostics d
+            JOIN {schema}.users u ON u.id = d.user_id
+            WHERE {region_filter}
+        ),
+        metric_values AS (
+            SELECT region, 'land_area' AS metric, land_area AS value FROM farm_values WHERE land_area > 0
+            UNION ALL
+            SELECT region, 'animals', animals FROM farm_values WHERE animals > 0
+            UNION ALL
+            SELECT region, 'crop_yield', crop_yield FROM farm_values WHERE crop_yield > 0
+            UNION ALL
+            SELECT region, 'employees', employees FROM farm_values WHERE employees > 0
+        )
+        INSERT INTO {schema}.regional_farm_stats (region, metric, farm_count, mean, median, p25, p75, p90, updated_at)
+        SELECT
+            region,
+            metric,
+            COUNT(*),
+            AVG(value),
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY value),
+            percentile_cont(0.25) WITHIN GROUP (ORDER BY value),
+            percentile_cont(0.75) WITHIN GROUP (ORDER BY value),
+            percentile_cont(0.9) WITHIN GROUP (ORDER BY value),
+            CURRENT_TIMESTAMP
+        FROM metric_values
+        GROUP BY region, metric
+    '''
+
+def refresh_regional_stats(cur, full: bool) -> Dict[str, Any]:
+    """Batch job: recompute statistics only for regions with diagnostics changed since the watermark
+    or marked dirty by triggers (region change, deleted diagnostics or users)"""
+    schema = 't_p53065890_farmer_landing_proje'
+    region_expr = f"COALESCE(NULLIF(u.region, ''), '{UNKNOWN_REGION}')"
+    
+    cur.execute(f'''
+        SELECT watermark FROM {schema}.stats_watermarks WHERE job_name = %s FOR UPDATE
+    ''', (WATERMARK_JOB,))
+    row = cur.fetchone()
+    watermark = None if full or not row else row['watermark']
+    
+    cur.execute(f'''SELECT MAX(updated_at) AS max_updated FROM {schema}.farm_diagnostics''')
+    new_watermark = cur.fetchone()['max_updated']
+    
+    # Очередь разбирается в этой же транзакции: при ошибке пересчета регионы останутся помеченными
+    cur.execute(f'''DELETE FROM {schema}.regional_stats_dirty RETURNING region''')
+    dirty_regions = [r['region'] for r in cur.fetchall()]
+    
+    if watermark is not None:
+        cur.execute(f'''
+            SELECT DISTINCT {region_expr} AS region
+            FROM {schema}.farm_diagnostics d
+            JOIN {schema}.users u ON u.id = d.user_id
+            WHERE d.updated_at > %s
+        ''', (watermark,))
+        regions: Optional[List[str]] = sorted({r['region'] for r in cur.fetchall()} | set(dirty_regions))
+    else:
+        regions = None
+    
+    if regions == []:
+        return {'regions_refreshed': 0, 'watermark': watermark.isoformat() if watermark else None}
+    
+    if regions is None:
+        cur.execute(f'''DELETE FROM {schema}.regional_farm_stats''')
+        cur.execute(build_stats_query(schema, region_expr, 'TRUE'))
+    else:
+        cur.execute(f'''
+            DELETE FROM {schema}.regional_farm_stats WHERE region = ANY(%s) OR region = %s
+        ''', (regions, NATIONAL_REGION))
+        cur.execute(build_stats_query(schema, region_expr, f'{region_expr} = ANY(%s)'), (regions,))
+    
+    # Общероссийские показатели пересчитываются при любом изменении
+    cur.execute(build_stats_query(schema, f"'{NATIONAL_REGION}'", 'TRUE'))
+    
+    cur.execute(f'''
+        INSERT INTO {schema}.stats_watermarks (job_name, watermark, updated_at)
+        VALUES (%s, COALESCE(%s, '1970-01-01'::timestamp), CURRENT_TIMESTAMP)
+        ON CONFLICT (job_name) DO UPDATE SET
+            watermark = EXCLUDED.watermark,
+            updated_at = CURRENT_TIMESTAMP
+    ''', (WATERMARK_JOB, new_watermark))
+    
+    return {
+        'regions_refreshed': len(regions) if regions is not None else 'all',
+        'watermark': new_watermark.isoformat() if new_watermark else None
+    }
+
+def load_regional_stats(cur, region: str) -> Dict[str, Any]:
+    """Serve precomputed statistics: one primary-key lookup, national figures as fallback"""
+    schema = 't_p53065890_farmer_landing_proje'
+    cur.execute(f'''
+        SELECT region, metric, farm_count, mean, median, p25, p75, p90
+        FROM {schema}.regional_farm_stats
+        WHERE region IN (%s, %s)
+    ''', (region, NATIONAL_REGION))
+    rows = cur.fetchall()
+    
+    regional = [r for r in rows if r['region'] == region]
+    selected = regional if regional else [r for r in rows if r['region'] == NATIONAL_REGION]
+    metrics = {
+        r['metric']: {
+            'farmCount': r['farm_count'],
+            'mean': float(r['mean'] or 0),
+            'median': float(r['median'] or 0),
+            'p25': float(r['p25'] or 0),
+            'p75': float(r['p75'] or 0),
+            'p90': float(r['p90'] or 0)
+        }
+        for r in selected
+    }
+    
+    def mean_of(metric: str) -> float:
+        return round(metrics.get(metric, {}).get('mean', 0), 1)
+    
+    return {
+        'region': selected[0]['region'] if selected else region,
+        'avgLandArea': mean_of('land_area'),
+        'avgAnimals': mean_of('animals'),
+        'avgYield': mean_of('crop_yield'),
+        'avgEmployees': mean_of('employees'),
+        'metrics': metrics
+    }
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Load farm data and regional statistics for AI analytics
-    Args: event with httpMethod, queryStringParameters (userId)
+    Args: event with httpMethod, queryStringParameters (userId; action=refresh with POST
+          runs the incremental regional statistics batch job, full=1 recomputes everything)
           context with request_id attribute
     Returns: HTTP response with farmData and regionalStats
     '''
@@ -19,14 +163,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, OPTIONS',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
                 'Access-Control-Allow-Headers': 'Content-Type',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
-    if method != 'GET':
+    params = event.get('queryStringParameters') or {}
+    
+    if method not in ('GET', 'POST') or (method == 'POST' and params.get('action') != 'refresh'):
         return {
             'statusCode': 405,
             'headers': {
@@ -37,10 +183,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     # Get userId from query params
-    params = event.get('queryStringParameters', {})
     user_id = params.get('userId')
     
-    if not user_id:
+    if method == 'GET' and not user_id:
         return {
             'statusCode': 400,
             'headers': {
@@ -63,18 +208,42 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Database not configured'})
         }
     
+    schema = 't_p53065890_farmer_landing_proje'
+    
     try:
         conn = psycopg2.connect(database_url)
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        # Get user data
+        # Batch job (timer trigger): пересчет статистики по измененным регионам
+        if method == 'POST':
+            result = refresh_regional_stats(cur, params.get('full') == '1')
+            conn.commit()
+            cur.close()
+            conn.close()
+            
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'success': True, **result})
+            }
+        
+        # Get user data and farm diagnostics
         cur.execute(
-            "SELECT region FROM users WHERE id = %s",
+            f"""SELECT u.region, d.land_area, d.land_owned, d.land_rented, d.animals, d.crops,
+                       d.equipment, d.employees_permanent, d.employees_seasonal
+                FROM {schema}.users u
+                LEFT JOIN {schema}.farm_diagnostics d ON d.user_id = u.id
+                WHERE u.id = %s""",
             (user_id,)
         )
         user_row = cur.fetchone()
         
         if not user_row:
+            cur.close()
+            conn.close()
             return {
                 'statusCode': 404,
                 'headers': {
@@ -84,47 +253,27 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'User not found'})
             }
         
-        region = user_row['region'] or 'Не указан'
+        region = user_row['region'] or UNKNOWN_REGION
         
-        # Get farm diagnosis
-        cur.execute(
-            "SELECT diagnosis FROM farm_diagnosis WHERE user_id = %s ORDER BY created_at DESC LIMIT 1",
-            (user_id,)
-        )
-        diagnosis_row = cur.fetchone()
+        def to_float(value: Any) -> float:
+            try:
+                return float(str(value).replace(',', '.')) if value else 0
+            except ValueError:
+                return 0
         
         farm_data = {
             'region': region,
-            'landArea': 0,
-            'landOwned': 0,
-            'landRented': 0,
-            'animals': [],
-            'crops': [],
-            'equipment': [],
-            'employeesPermanent': 0,
-            'employeesSeasonal': 0
+            'landArea': to_float(user_row['land_area']),
+            'landOwned': to_float(user_row['land_owned']),
+            'landRented': to_float(user_row['land_rented']),
+            'animals': user_row['animals'] or [],
+            'crops': user_row['crops'] or [],
+            'equipment': user_row['equipment'] or [],
+            'employeesPermanent': int(user_row['employees_permanent'] or 0),
+            'employeesSeasonal': int(user_row['employees_seasonal'] or 0)
         }
         
-        if diagnosis_row:
-            diagnosis = diagnosis_row['diagnosis']
-            assets = diagnosis.get('assets', [{}])[0]
-            
-            farm_data['landArea'] = float(assets.get('land_area', 0) or 0)
-            farm_data['landOwned'] = float(assets.get('land_owned', 0) or 0)
-            farm_data['landRented'] = float(assets.get('land_rented', 0) or 0)
-            farm_data['animals'] = assets.get('animals', [])
-            farm_data['crops'] = assets.get('crops', [])
-            farm_data['equipment'] = assets.get('equipment', [])
-            farm_data['employeesPermanent'] = int(assets.get('employees_permanent', 0) or 0)
-            farm_data['employeesSeasonal'] = int(assets.get('employees_seasonal', 0) or 0)
-        
-        # Calculate regional statistics (mock data for now)
-        regional_stats = {
-            'avgLandArea': 150,
-            'avgAnimals': 50,
-            'avgYield': 35,
-            'avgEmployees': 8
-        }
+        regional_stats = load_regional_stats(cur, region)
         
         cur.close()
         conn.close()
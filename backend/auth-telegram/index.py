@@ -84,29 +84,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         cur = conn.cursor()
         
         cur.execute("""
-            SELECT id, email, role, name FROM t_p53065890_farmer_landing_proje.users 
-            WHERE oauth_provider = 'telegram' AND oauth_id = %s
-        """, (str(telegram_id),))
+            SELECT id, email, role, name FROM t_p53065890_farmer_landing_proje.upsert_oauth_user(
+                p_provider => 'telegram', p_provider_id => %s, p_email => %s, p_name => %s, p_role => 'investor',
+                p_first_name => %s, p_last_name => %s, p_avatar_url => %s
+            )
+        """, (str(telegram_id), email, display_name, first_name, last_name, photo_url))
         
-        user = cur.fetchone()
-        
-        if user:
-            user_id, email_db, role, name = user
-            cur.execute("""
-                UPDATE t_p53065890_farmer_landing_proje.users 
-                SET avatar_url = %s, first_name = %s, last_name = %s, name = %s
-                WHERE id = %s
-            """, (photo_url, first_name, last_name, display_name, user_id))
-        else:
-            cur.execute("""
-                INSERT INTO t_p53065890_farmer_landing_proje.users 
-                (email, name, first_name, last_name, role, oauth_provider, oauth_id, avatar_url, created_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW())
-                RETURNING id, email, role, name
-            """, (email, display_name, first_name, last_name, 'investor', 'telegram', str(telegram_id), photo_url))
-            
-            user = cur.fetchone()
-            user_id, email, role, name = user
+        user_id, email, role, name = cur.fetchone()
         
         conn.commit()
         cur.close()
@@ -8,10 +8,13 @@ Returns: HTTP response с редиректом или JWT токеном
 import json
 import os
 import jwt
+import time
 import requests
 import psycopg2
 from datetime import datetime, timedelta
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 VK_CLIENT_ID = os.environ.get('VK_CLIENT_ID')
@@ -19,6 +22,92 @@ VK_CLIENT_SECRET = os.environ.get('VK_CLIENT_SECRET')
 FRONTEND_URL = os.environ.get('FRONTEND_URL', 'https://farmer-landing-project.poehali.dev')
 JWT_SECRET = os.environ.get('JWT_SECRET')
 
+OAUTH_CONNECT_TIMEOUT = float(os.environ.get('OAUTH_CONNECT_TIMEOUT', '3'))
+OAUTH_READ_TIMEOUT = float(os.environ.get('OAUTH_READ_TIMEOUT', '5'))
+OAUTH_HTTP_RETRIES = int(os.environ.get('OAUTH_HTTP_RETRIES', '2'))
+
+# Базовые URL провайдеров: для офлайн нагрузочного теста указываются адреса fake-oauth-provider.py
+VK_OAUTH_URL = os.environ.get('VK_OAUTH_URL', 'https://oauth.vk.com')
+VK_API_URL = os.environ.get('VK_API_URL', 'https://api.vk.com')
+
+LATENCY_BUCKETS_MS = [50, 100, 250, 500, 1000, 2500, 5000]
+
+def create_http_session() -> requests.Session:
+    '''
+    Business: HTTP-сессия к OAuth-провайдерам с keep-alive пулом и повтором только безопасных запросов
+    Args: нет
+    Returns: requests.Session
+    '''
+    # Повторяются ошибки соединения и 502/503/504 для GET; обмен кода (POST) при ответе не повторяется
+    retry = Retry(
+        total=OAUTH_HTTP_RETRIES,
+        connect=OAUTH_HTTP_RETRIES,
+        read=0,
+        status=OAUTH_HTTP_RETRIES,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(['GET']),
+        backoff_factor=0.2,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+# Сессия живет между вызовами теплого экземпляра функции - TLS-соединения переиспользуются
+_http_session = create_http_session()
+_latency_histograms: Dict[str, Dict[str, Any]] = {}
+
+def provider_request(provider: str, method: str, url: str, **kwargs) -> Optional[requests.Response]:
+    '''
+    Business: Запрос к OAuth-провайдеру со строгим таймаутом и учетом задержки в гистограмме провайдера
+    Args: provider - имя провайдера для метрик, method - HTTP-метод, url - адрес, kwargs - параметры requests
+    Returns: Response или None, если провайдер недоступен
+    '''
+    histogram = _latency_histograms.setdefault(provider, {
+        'buckets': {str(b): 0 for b in LATENCY_BUCKETS_MS + ['inf']},
+        'count': 0,
+        'errors': 0,
+        'total_ms': 0.0
+    })
+    started = time.monotonic()
+    try:
+        response = _http_session.request(
+            method, url, timeout=(OAUTH_CONNECT_TIMEOUT, OAUTH_READ_TIMEOUT), **kwargs
+        )
+    except requests.RequestException as e:
+        response = None
+        print(f"OAuth provider {provider} request failed: {e}")
+    
+    elapsed_ms = (time.monotonic() - started) * 1000
+    bucket = next((str(b) for b in LATENCY_BUCKETS_MS if elapsed_ms <= b), 'inf')
+    histogram['buckets'][bucket] += 1
+    histogram['count'] += 1
+    histogram['total_ms'] += elapsed_ms
+    if response is None or response.status_code >= 500:
+        histogram['errors'] += 1
+    
+    return response
+
+def http_stats_response() -> Dict[str, Any]:
+    '''
+    Business: Гистограммы задержек запросов к провайдерам в этом экземпляре функции
+    Args: нет
+    Returns: HTTP response с гистограммами
+    '''
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'buckets_ms': LATENCY_BUCKETS_MS,
+            'providers': {
+                provider: {**h, 'avg_ms': round(h['total_ms'] / h['count'], 1) if h['count'] else 0}
+                for provider, h in _latency_histograms.items()
+            }
+        })
+    }
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -40,12 +129,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     if method == 'GET':
-        params = event.get('queryStringParameters', {})
+        params = event.get('queryStringParameters') or {}
+        
+        if params.get('action') == 'http_stats':
+            return http_stats_response()
+        
         code = params.get('code')
         
         if not code:
             redirect_uri = f"{FRONTEND_URL}/oauth/callback?provider=vk"
-            vk_auth_url = f"https://oauth.vk.com/authorize?client_id={VK_CLIENT_ID}&redirect_uri={redirect_uri}&display=page&scope=email&response_type=code&v=5.131"
+            vk_auth_url = f"{VK_OAUTH_URL}/authorize?client_id={VK_CLIENT_ID}&redirect_uri={redirect_uri}&display=page&scope=email&response_type=code&v=5.131"
             
             print(f"[VK Auth] Redirect URI: {redirect_uri}")
             print(f"[VK Auth] VK Auth URL: {vk_auth_url}")
@@ -61,7 +154,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
         
         redirect_uri = f"{FRONTEND_URL}/oauth/callback?provider=vk"
-        token_url = "https://oauth.vk.com/access_token"
+        token_url = f"{VK_OAUTH_URL}/access_token"
         token_params = {
             'client_id': VK_CLIENT_ID,
             'client_secret': VK_CLIENT_SECRET,
@@ -69,8 +162,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'code': code
         }
         
-        token_response = requests.get(token_url, params=token_params)
-        token_data = token_response.json()
+        token_response = provider_request('vk', 'GET', token_url, params=token_params)
+        token_data = token_response.json() if token_response is not None else {
+            'error': 'unavailable', 'error_description': 'VK недоступен, попробуйте позже'
+        }
         
         if 'error' in token_data:
             return {
@@ -84,9 +179,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         vk_user_id = token_data.get('user_id')
         vk_email = token_data.get('email')
         
-        user_info_url = f"https://api.vk.com/method/users.get?user_ids={vk_user_id}&fields=photo_200&access_token={access_token}&v=5.131"
-        user_info_response = requests.get(user_info_url)
-        user_info = user_info_response.json()
+        user_info_url = f"{VK_API_URL}/method/users.get?user_ids={vk_user_id}&fields=photo_200&access_token={access_token}&v=5.131"
+        user_info_response = provider_request('vk', 'GET', user_info_url)
+        user_info = user_info_response.json() if user_info_response is not None else {}
         
         if 'response' not in user_info or not user_info['response']:
             return {
@@ -105,32 +200,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         cur = conn.cursor()
         
         cur.execute("""
-            SELECT id, email, role, name FROM t_p53065890_farmer_landing_proje.users 
-            WHERE oauth_provider = 'vk' AND oauth_id = %s
-        """, (str(vk_user_id),))
-        
-        user = cur.fetchone()
-        
-        if user:
-            user_id, email, role, name = user
-            cur.execute("""
-                UPDATE t_p53065890_farmer_landing_proje.users 
-                SET oauth_access_token = %s, avatar_url = %s 
-                WHERE id = %s
-            """, (access_token, photo_url, user_id))
-        else:
-            email_to_use = vk_email or f"vk{vk_user_id}@farmer.local"
-            name_to_use = f"{first_name} {last_name}".strip()
-            
-            cur.execute("""
-                INSERT INTO t_p53065890_farmer_landing_proje.users 
-                (email, name, first_name, last_name, role, oauth_provider, oauth_id, oauth_access_token, avatar_url, created_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
-                RETURNING id, email, role, name
-            """, (email_to_use, name_to_use, first_name, last_name, 'investor', 'vk', str(vk_user_id), access_token, photo_url))
-            
-            user = cur.fetchone()
-            user_id, email, role, name = user
+            SELECT id, email, role, name FROM t_p53065890_farmer_landing_proje.upsert_oauth_user(
+                p_provider => 'vk', p_provider_id => %s, p_email => %s, p_name => %s, p_role => 'investor',
+                p_first_name => %s, p_last_name => %s, p_avatar_url => %s, p_access_token => %s
+            )
+        """, (str(vk_user_id), vk_email or f"vk{vk_user_id}@farmer.local", f"{first_name} {last_name}".strip(),
+              first_name, last_name, photo_url, access_token))
+        
+        user_id, email, role, name = cur.fetchone()
         
         conn.commit()
         cur.close()
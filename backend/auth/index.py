@@ -3,11 +3,350 @@ import os
 import psycopg2
 import bcrypt
 import jwt
-from datetime import datetime, timedelta
-from typing import Dict, Any
+import time
+from datetime import datetime, timedelta, date
+from typing import Dict, Any, List
 
 ADMIN_SECRET = "farmer_admin_2025_secret_key"
 
+ACTIVITY_SHARD_BITS = 8192
+
+# Уже отмеченные за сегодня пользователи в этом экземпляре функции: повторные запросы не пишут в БД
+_activity_seen: Dict[str, Any] = {'day': None, 'users': set()}
+
+def record_activity(conn, user_id: Any) -> None:
+    '''
+    Business: Отметить активность пользователя за день битом в дневной битовой карте (не строкой на запрос)
+    Args: conn - соединение с БД, user_id - ID пользователя
+    Returns: None
+    '''
+    try:
+        uid = int(user_id)
+    except (TypeError, ValueError):
+        return
+    
+    today = date.today()
+    if _activity_seen['day'] != today:
+        _activity_seen['day'] = today
+        _activity_seen['users'] = set()
+    if uid in _activity_seen['users']:
+        return
+    
+    schema = 't_p53065890_farmer_landing_proje'
+    shard, bit = divmod(uid, ACTIVITY_SHARD_BITS)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                INSERT INTO {schema}.user_activity_bitmaps (day, shard, bitmap)
+                VALUES (%s, %s, set_bit(decode(repeat('00', %s), 'hex'), %s, 1))
+                ON CONFLICT (day, shard) DO UPDATE
+                SET bitmap = set_bit(user_activity_bitmaps.bitmap, %s, 1)
+                WHERE get_bit(user_activity_bitmaps.bitmap, %s) = 0
+            """, (today, shard, ACTIVITY_SHARD_BITS // 8, bit, bit, bit))
+        conn.commit()
+        _activity_seen['users'].add(uid)
+    except Exception as e:
+        conn.rollback()
+        print(f"Activity tracking failed: {e}")
+
+def get_rollup_totals(cur, metric: str, table: str, ts_column: str, dimension: str, aggregate: str) -> Dict[str, Any]:
+    '''
+    Business: Итоги метрики по разрезам: дневные агрегаты daily_metrics до водяного знака + живой хвост после него
+    Args: cur - курсор БД, metric - метрика агрегата, table/ts_column/dimension/aggregate - источник хвоста
+    Returns: dict {разрез: значение}
+    '''
+    schema = 't_p53065890_farmer_landing_proje'
+    cur.execute(f"""
+        WITH wm AS (
+            SELECT COALESCE(
+                (SELECT watermark::date FROM {schema}.stats_watermarks WHERE job_name = %s),
+                DATE '1970-01-01'
+            ) AS day
+        )
+        SELECT dimension, SUM(value) FROM (
+            SELECT dm.dimension, dm.value
+            FROM {schema}.daily_metrics dm, wm
+            WHERE dm.metric = %s AND dm.day < wm.day
+            UNION ALL
+            SELECT COALESCE({dimension}::text, ''), {aggregate}
+            FROM {schema}.{table}, wm
+            WHERE {ts_column} >= wm.day
+            GROUP BY COALESCE({dimension}::text, '')
+        ) totals
+        GROUP BY dimension
+    """, (f'daily_metrics:{metric}', metric))
+    return {dimension_value: total for dimension_value, total in cur.fetchall()}
+
+TOKEN_VERSION_TTL_SECONDS = int(os.environ.get('AUTH_TOKEN_VERSION_TTL_SECONDS', '30'))
+
+# Версии токенов пользователей, у которых токены отзывались (сброс пароля, удаление).
+# Синхронизируется инкрементально раз в TTL; у остальных пользователей версия 0.
+_token_versions: Dict[str, Any] = {'checked_at': 0.0, 'synced_until': None, 'versions': {}}
+
+def sync_token_versions(cur) -> None:
+    '''
+    Business: Дочитать изменения версий токенов после последней синхронизации (не чаще раза в TTL)
+    Args: cur - курсор БД
+    Returns: None
+    '''
+    if time.time() - _token_versions['checked_at'] < TOKEN_VERSION_TTL_SECONDS:
+        return
+    
+    # Перекрытие окна на 5 секунд: изменения, закоммиченные позже своей отметки времени, не теряются
+    cur.execute("""
+        SELECT user_id, token_version, changed_at
+        FROM t_p53065890_farmer_landing_proje.user_token_versions
+        WHERE changed_at > COALESCE(%s, '1970-01-01'::timestamp) - INTERVAL '5 seconds'
+    """, (_token_versions['synced_until'],))
+    for user_id, token_version, changed_at in cur.fetchall():
+        _token_versions['versions'][user_id] = token_version
+        if _token_versions['synced_until'] is None or changed_at > _token_versions['synced_until']:
+            _token_versions['synced_until'] = changed_at
+    _token_versions['checked_at'] = time.time()
+
+def record_activity_once(db_url: str, user_id: Any) -> None:
+    '''
+    Business: Отметить активность после быстрой проверки токена - соединение открывается только
+              при первом запросе пользователя за день в этом экземпляре функции
+    Args: db_url - строка подключения к БД, user_id - ID пользователя
+    Returns: None
+    '''
+    try:
+        uid = int(user_id)
+    except (TypeError, ValueError):
+        return
+    if _activity_seen['day'] == date.today() and uid in _activity_seen['users']:
+        return
+    try:
+        conn = psycopg2.connect(db_url)
+    except Exception as e:
+        print(f"Activity tracking failed: {e}")
+        return
+    try:
+        record_activity(conn, uid)
+    finally:
+        conn.close()
+
+def verify_token_fast(token: str, jwt_secret: str) -> Any:
+    '''
+    Business: Проверка токена без обращения к БД - по подписанным claims и свежему кэшу версий токенов
+    Args: token - JWT, jwt_secret - секрет подписи
+    Returns: HTTP response или None, если нужна проверка через БД
+    '''
+    try:
+        payload = jwt.decode(token, jwt_secret, algorithms=['HS256'])
+    except jwt.InvalidTokenError:
+        return None
+    
+    user_id = payload.get('user_id')
+    cache_fresh = time.time() - _token_versions['checked_at'] < TOKEN_VERSION_TTL_SECONDS
+    if 'tv' not in payload or 'name' not in payload or not cache_fresh:
+        return None
+    
+    if payload['tv'] != _token_versions['versions'].get(user_id, 0):
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Токен отозван'})
+        }
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'user': {'id': user_id, 'email': payload.get('email'), 'role': payload.get('role'), 'name': payload['name']}
+        })
+    }
+
+DELETE_CHUNK_SIZE = 500
+
+# Порядок удаления данных пользователей: сначала зависимые таблицы, затем сами пользователи.
+# Каждый запрос обрабатывает всю пачку ID сразу (= ANY(%(ids)s)), число запросов не зависит от числа пользователей.
+USER_DELETE_PLAN = [
+    ('investments', """DELETE FROM {schema}.investments
+        WHERE user_id = ANY(%(ids)s)
+           OR proposal_id IN (SELECT id FROM {schema}.proposals WHERE user_id = ANY(%(ids)s))"""),
+    # Доли, удержанные ожидающими заявками, возвращаются в предложения до удаления самих заявок
+    ('released_reservations', """SELECT request_id FROM {schema}.release_investment_requests(
+        ARRAY(
+            SELECT id FROM {schema}.investment_requests
+            WHERE status = 'pending' AND (
+                investor_id = ANY(%(ids)s)
+                OR offer_id IN (SELECT id FROM {schema}.investment_offers WHERE farmer_id = ANY(%(ids)s))
+            )
+        ),
+        'cancelled'
+    )"""),
+    ('investment_requests', """DELETE FROM {schema}.investment_requests
+        WHERE investor_id = ANY(%(ids)s)
+           OR offer_id IN (SELECT id FROM {schema}.investment_offers WHERE farmer_id = ANY(%(ids)s))"""),
+    ('investment_offers', "DELETE FROM {schema}.investment_offers WHERE farmer_id = ANY(%(ids)s)"),
+    ('proposals', "DELETE FROM {schema}.proposals WHERE user_id = ANY(%(ids)s)"),
+    ('products', "DELETE FROM {schema}.products WHERE user_id = ANY(%(ids)s)"),
+    ('ads', "DELETE FROM {schema}.ads WHERE user_id = ANY(%(ids)s)"),
+    ('notifications', "DELETE FROM {schema}.notifications WHERE user_id = ANY(%(ids)s)"),
+    ('farm_agro_tech', """DELETE FROM {schema}.farm_agro_tech
+        WHERE crop_id IN (
+            SELECT c.id FROM {schema}.farm_crops c
+            JOIN {schema}.farmer_data fd ON fd.id = c.farmer_data_id
+            WHERE fd.user_id = ANY(%(ids)s)
+        )"""),
+    ('farm_crops', """DELETE FROM {schema}.farm_crops
+        WHERE farmer_data_id IN (SELECT id FROM {schema}.farmer_data WHERE user_id = ANY(%(ids)s))"""),
+    ('farm_animals', """DELETE FROM {schema}.farm_animals
+        WHERE farmer_data_id IN (SELECT id FROM {schema}.farmer_data WHERE user_id = ANY(%(ids)s))"""),
+    ('farm_equipment', """DELETE FROM {schema}.farm_equipment
+        WHERE farmer_data_id IN (SELECT id FROM {schema}.farmer_data WHERE user_id = ANY(%(ids)s))"""),
+    ('farmer_data', "DELETE FROM {schema}.farmer_data WHERE user_id = ANY(%(ids)s)"),
+    ('seller_data', "DELETE FROM {schema}.seller_data WHERE user_id = ANY(%(ids)s)"),
+    ('garage', "DELETE FROM {schema}.garage WHERE user_id = ANY(%(ids)s)"),
+    ('leaderboard', "DELETE FROM {schema}.leaderboard WHERE user_id = ANY(%(ids)s)"),
+    ('users', "DELETE FROM {schema}.users WHERE id = ANY(%(ids)s)"),
+    ('user_token_versions', """INSERT INTO {schema}.user_token_versions (user_id, token_version, changed_at)
+        SELECT unnest(%(ids)s::int[]), -1, CURRENT_TIMESTAMP
+        ON CONFLICT (user_id) DO UPDATE SET token_version = -1, changed_at = CURRENT_TIMESTAMP""")
+]
+
+def delete_users_bulk(conn, user_ids: List[int]) -> Dict[str, int]:
+    '''
+    Business: Удалить пользователей и все их данные пачками: фиксированное число запросов на пачку,
+              отдельная транзакция на пачку ограничивает время удержания блокировок
+    Args: conn - соединение с БД, user_ids - ID пользователей
+    Returns: dict {таблица: число удаленных строк}
+    '''
+    schema = 't_p53065890_farmer_landing_proje'
+    counts = {table: 0 for table, _ in USER_DELETE_PLAN}
+    ids = sorted(set(user_ids))
+    
+    for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+        chunk = ids[start:start + DELETE_CHUNK_SIZE]
+        with conn.cursor() as cur:
+            for table, sql in USER_DELETE_PLAN:
+                cur.execute(sql.format(schema=schema), {'ids': chunk})
+                counts[table] += cur.rowcount
+        conn.commit()
+    
+    return counts
+
+USER_SORT_COLUMNS = {'created_at': 'u.created_at', 'email': 'LOWER(u.email)', 'name': 'LOWER(u.name)', 'id': 'u.id'}
+PROPOSAL_SORT_COLUMNS = {'created_at': 'p.created_at', 'price': 'p.price', 'id': 'p.id'}
+MAX_PAGE_SIZE = 200
+
+def get_page_params(params: Dict[str, Any], prefix: str = '', default_size: int = 50) -> Dict[str, int]:
+    '''
+    Business: Разобрать параметры пагинации (page, page_size) с ограничением размера страницы
+    Args: params - параметры запроса, prefix - префикс имен параметров, default_size - размер по умолчанию
+    Returns: dict с page, page_size, offset
+    '''
+    try:
+        page = max(int(params.get(f'{prefix}page') or 1), 1)
+        page_size = min(max(int(params.get('page_size') or default_size), 1), MAX_PAGE_SIZE)
+    except (TypeError, ValueError):
+        page, page_size = 1, default_size
+    return {'page': page, 'page_size': page_size, 'offset': (page - 1) * page_size}
+
+def list_users_page(cur, paging: Dict[str, int], search: str = '', sort: str = 'created_at',
+                    order: str = 'desc', with_counts: bool = False) -> Dict[str, Any]:
+    '''
+    Business: Страница пользователей с поиском по префиксу email/имени и сортировкой по индексированным колонкам
+    Args: cur - курсор БД, paging - параметры страницы, search - префикс email или имени,
+          sort/order - колонка и направление сортировки, with_counts - считать предложения и заявки
+    Returns: dict с users, total, page, page_size
+    '''
+    schema = 't_p53065890_farmer_landing_proje'
+    sort_column = USER_SORT_COLUMNS.get(sort, 'u.created_at')
+    direction = 'ASC' if str(order).lower() == 'asc' else 'DESC'
+    
+    where = 'TRUE'
+    args: list = []
+    search = (search or '').strip().lower()
+    if search:
+        # Префиксный поиск использует индексы LOWER(email|name) text_pattern_ops
+        pattern = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        where = "(LOWER(u.email) LIKE %s OR LOWER(u.name) LIKE %s)"
+        args = [pattern, pattern]
+    
+    counts_sql = ''
+    if with_counts:
+        # Счетчики только для строк страницы - поиск по индексам proposals(user_id) и investments(user_id)
+        counts_sql = f""",
+            (SELECT COUNT(*) FROM {schema}.proposals p WHERE p.user_id = u.id) AS proposals_count,
+            (SELECT COUNT(*) FROM {schema}.investments i WHERE i.user_id = u.id) AS investments_count"""
+    
+    cur.execute(f"""
+        SELECT u.id, u.email, u.name, u.role, u.created_at{counts_sql}
+        FROM {schema}.users u
+        WHERE {where}
+        ORDER BY {sort_column} {direction} NULLS LAST, u.id {direction}
+        LIMIT %s OFFSET %s
+    """, args + [paging['page_size'], paging['offset']])
+    rows = cur.fetchall()
+    
+    # Итог пагинации считается вживую (index-only scan по PK без поиска), чтобы не расходиться с числом строк
+    cur.execute(f"SELECT COUNT(*) FROM {schema}.users u WHERE {where}", args)
+    total = cur.fetchone()[0]
+    
+    users = []
+    for u in rows:
+        user = {
+            'id': u[0],
+            'email': u[1],
+            'name': u[2],
+            'role': u[3],
+            'created_at': u[4].isoformat() if u[4] else None
+        }
+        if with_counts:
+            user['proposals_count'] = u[5]
+            user['investments_count'] = u[6]
+        users.append(user)
+    
+    return {'users': users, 'total': total, 'page': paging['page'], 'page_size': paging['page_size']}
+
+def list_proposals_page(cur, paging: Dict[str, int], status: str = '', sort: str = 'created_at',
+                        order: str = 'desc') -> Dict[str, Any]:
+    '''
+    Business: Страница предложений с фильтром по статусу и числом инвесторов только для строк страницы
+    Args: cur - курсор БД, paging - параметры страницы, status - фильтр статуса, sort/order - сортировка
+    Returns: dict с proposals, total, page, page_size
+    '''
+    schema = 't_p53065890_farmer_landing_proje'
+    sort_column = PROPOSAL_SORT_COLUMNS.get(sort, 'p.created_at')
+    direction = 'ASC' if str(order).lower() == 'asc' else 'DESC'
+    where = 'p.status = %s' if status else 'TRUE'
+    args: list = [status] if status else []
+    
+    cur.execute(f"""
+        SELECT 
+            p.id, p.description, p.price, p.shares, p.type, p.status,
+            u.name as farmer_name, u.email as farmer_email,
+            (SELECT COUNT(DISTINCT i.user_id) FROM {schema}.investments i WHERE i.proposal_id = p.id) as investors_count
+        FROM {schema}.proposals p
+        JOIN {schema}.users u ON p.user_id = u.id
+        WHERE {where}
+        ORDER BY {sort_column} {direction} NULLS LAST, p.id {direction}
+        LIMIT %s OFFSET %s
+    """, args + [paging['page_size'], paging['offset']])
+    rows = cur.fetchall()
+    
+    cur.execute(f"SELECT COUNT(*) FROM {schema}.proposals p WHERE {where}", args)
+    total = cur.fetchone()[0]
+    
+    proposals = []
+    for p in rows:
+        proposals.append({
+            'id': p[0],
+            'description': p[1],
+            'price': float(p[2]) if p[2] else 0,
+            'shares': p[3],
+            'type': p[4],
+            'status': p[5],
+            'farmer_name': p[6],
+            'farmer_email': p[7],
+            'investors_count': p[8]
+        })
+    
+    return {'proposals': proposals, 'total': total, 'page': paging['page'], 'page_size': paging['page_size']}
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Аутентификация пользователей (регистрация, логин, проверка токена), админ-функции и статистика
@@ -39,6 +378,23 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Не настроены переменные окружения'})
         }
     
+    if method == 'POST':
+        try:
+            body_peek = json.loads(event.get('body') or '{}')
+        except json.JSONDecodeError:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Некорректный JSON'})
+            }
+        if body_peek.get('action') == 'verify':
+            fast_response = verify_token_fast(body_peek.get('token', ''), jwt_secret)
+            if fast_response:
+                # Учет активности не влияет на результат проверки токена
+                if fast_response['statusCode'] == 200:
+                    record_activity_once(db_url, json.loads(fast_response['body'])['user']['id'])
+                return fast_response
+    
     conn = psycopg2.connect(db_url)
     cur = conn.cursor()
     
@@ -65,15 +421,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             emails_lower = [email.strip().lower() for email in emails]
-            placeholders = ','.join(['%s'] * len(emails_lower))
             
             cur.execute(
-                f"DELETE FROM t_p53065890_farmer_landing_proje.users WHERE LOWER(email) IN ({placeholders}) RETURNING id, email",
-                emails_lower
+                "SELECT id, email FROM t_p53065890_farmer_landing_proje.users WHERE LOWER(email) = ANY(%s)",
+                (emails_lower,)
             )
-            
             deleted_users = cur.fetchall()
-            conn.commit()
+            
+            deleted_by_table = delete_users_bulk(conn, [u[0] for u in deleted_users])
             
             return {
                 'statusCode': 200,
@@ -81,7 +436,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({
                     'success': True,
                     'message': f'Удалено пользователей: {len(deleted_users)}',
-                    'deleted': [{'id': u[0], 'email': u[1]} for u in deleted_users]
+                    'deleted': [{'id': u[0], 'email': u[1]} for u in deleted_users],
+                    'deleted_by_table': deleted_by_table
                 })
             }
         
@@ -109,27 +465,34 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'Неверная роль'})
                     }
                 
-                cur.execute("SELECT id FROM t_p53065890_farmer_landing_proje.users WHERE LOWER(email) = %s", (email,))
-                if cur.fetchone():
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Email уже зарегистрирован'})
-                    }
-                
                 password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
                 
+                # Один запрос без гонки SELECT-then-INSERT: конфликт по уникальному индексу LOWER(email)
                 cur.execute(
-                    "INSERT INTO t_p53065890_farmer_landing_proje.users (email, password_hash, role, name) VALUES (%s, %s, %s, %s) RETURNING id",
+                    """INSERT INTO t_p53065890_farmer_landing_proje.users (email, password_hash, role, name)
+                       VALUES (%s, %s, %s, %s)
+                       ON CONFLICT ((LOWER(email))) DO NOTHING
+                       RETURNING id""",
                     (email, password_hash, role, name)
                 )
-                user_id = cur.fetchone()[0]
+                created = cur.fetchone()
                 conn.commit()
                 
+                if not created:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Email уже зарегистрирован'})
+                    }
+                
+                user_id = created[0]
+                
                 token = jwt.encode({
                     'user_id': user_id,
                     'email': email,
                     'role': role,
+                    'name': name,
+                    'tv': 0,
                     'exp': datetime.utcnow() + timedelta(days=30)
                 }, jwt_secret, algorithm='HS256')
                 
@@ -153,7 +516,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'Заполните все поля'})
                     }
                 
-                cur.execute("SELECT id, password_hash, role, name FROM t_p53065890_farmer_landing_proje.users WHERE LOWER(email) = %s", (email,))
+                cur.execute(
+                    """SELECT u.id, u.password_hash, u.role, u.name, COALESCE(tv.token_version, 0)
+                       FROM t_p53065890_farmer_landing_proje.users u
+                       LEFT JOIN t_p53065890_farmer_landing_proje.user_token_versions tv ON tv.user_id = u.id
+                       WHERE LOWER(u.email) = %s""",
+                    (email,)
+                )
                 user = cur.fetchone()
                 
                 if not user:
@@ -163,7 +532,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'Неверный email или пароль'})
                     }
                 
-                user_id, password_hash, role, name = user
+                user_id, password_hash, role, name, token_version = user
                 
                 if not bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8')):
                     return {
@@ -172,10 +541,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'Неверный email или пароль'})
                     }
                 
+                record_activity(conn, user_id)
+                
                 token = jwt.encode({
                     'user_id': user_id,
                     'email': email,
                     'role': role,
+                    'name': name,
+                    'tv': token_version,
                     'exp': datetime.utcnow() + timedelta(days=30)
                 }, jwt_secret, algorithm='HS256')
                 
@@ -201,8 +574,23 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 payload = jwt.decode(token, jwt_secret, algorithms=['HS256'])
                 user_id = payload['user_id']
                 
-                cur.execute("SELECT id, email, role, name FROM t_p53065890_farmer_landing_proje.users WHERE id = %s", (user_id,))
-                user = cur.fetchone()
+                sync_token_versions(cur)
+                token_version = _token_versions['versions'].get(user_id, 0)
+                
+                if 'tv' in payload and payload['tv'] != token_version:
+                    return {
+                        'statusCode': 401,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Токен отозван'})
+                    }
+                
+                if 'tv' in payload and 'name' in payload:
+                    # Подписанным claims можно доверять: версия токена актуальна
+                    user = (user_id, payload.get('email'), payload.get('role'), payload['name'])
+                else:
+                    # Токены старого формата (без версии) - проверка по строке пользователя
+                    cur.execute("SELECT id, email, role, name FROM t_p53065890_farmer_landing_proje.users WHERE id = %s", (user_id,))
+                    user = cur.fetchone()
                 
                 if not user:
                     return {
@@ -211,6 +599,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'Пользователь не найден'})
                     }
                 
+                record_activity(conn, user_id)
+                
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -282,6 +672,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     "UPDATE t_p53065890_farmer_landing_proje.users SET password_hash = %s WHERE id = %s",
                     (password_hash, user_id)
                 )
+                # Смена пароля отзывает все ранее выданные токены
+                cur.execute(
+                    """INSERT INTO t_p53065890_farmer_landing_proje.user_token_versions (user_id, token_version, changed_at)
+                       VALUES (%s, 1, CURRENT_TIMESTAMP)
+                       ON CONFLICT (user_id) DO UPDATE SET
+                           token_version = user_token_versions.token_version + 1,
+                           changed_at = CURRENT_TIMESTAMP""",
+                    (user_id,)
+                )
                 conn.commit()
                 
                 return {
@@ -301,36 +700,26 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'Доступ запрещен'})
                     }
                 
-                cur.execute("SELECT id, email, role, created_at FROM t_p53065890_farmer_landing_proje.users ORDER BY id")
-                users = cur.fetchall()
-                
-                users_list = [{
-                    'id': u[0],
-                    'email': u[1],
-                    'role': u[2],
-                    'created_at': u[3].isoformat() if u[3] else None
-                } for u in users]
+                page = list_users_page(
+                    cur,
+                    get_page_params(body_data, default_size=100),
+                    search=body_data.get('search', ''),
+                    sort=body_data.get('sort', 'id'),
+                    order=body_data.get('order', 'asc')
+                )
                 
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'users': users_list})
+                    'body': json.dumps(page)
                 }
         
         elif method == 'GET':
-            query_params = event.get('queryStringParameters', {})
+            query_params = event.get('queryStringParameters') or {}
             action = query_params.get('action', '')
             
             if action == 'stats':
-                cur.execute("""
-                    SELECT 
-                        role,
-                        COUNT(*) as count
-                    FROM t_p53065890_farmer_landing_proje.users
-                    GROUP BY role
-                """)
-                
-                results = cur.fetchall()
+                results = get_rollup_totals(cur, 'signups', 'users', 'created_at', 'role', 'COUNT(*)').items()
                 
                 stats = {
                     'farmers': 0,
@@ -340,6 +729,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
                 
                 for role, count in results:
+                    count = int(count)
                     if role == 'farmer':
                         stats['farmers'] = count
                     elif role == 'investor':
@@ -360,71 +750,36 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             elif action == 'admin':
                 # Admin statistics - comprehensive data for admin panel
-                cur.execute("SELECT role, COUNT(*) as count FROM t_p53065890_farmer_landing_proje.users GROUP BY role")
-                users_by_role_results = cur.fetchall()
+                # Итоги из дневных агрегатов daily_metrics (admin-metrics), сканируется только хвост после водяного знака
                 users_by_role = {}
-                for role, count in users_by_role_results:
-                    users_by_role[role] = count
+                for role, count in get_rollup_totals(cur, 'signups', 'users', 'created_at', 'role', 'COUNT(*)').items():
+                    users_by_role[role] = int(count)
                 
-                cur.execute("SELECT COUNT(*) FROM t_p53065890_farmer_landing_proje.proposals")
-                total_proposals = cur.fetchone()[0]
+                total_proposals = int(sum(get_rollup_totals(cur, 'proposals', 'proposals', 'created_at', 'type', 'COUNT(*)').values()))
                 
                 cur.execute("SELECT COUNT(*) FROM t_p53065890_farmer_landing_proje.proposals WHERE status = 'active'")
                 active_proposals = cur.fetchone()[0]
                 
-                cur.execute("SELECT COUNT(*) FROM t_p53065890_farmer_landing_proje.investments")
-                total_investments = cur.fetchone()[0]
+                total_investments = int(sum(get_rollup_totals(cur, 'investments', 'investments', 'date', "'all'", 'COUNT(*)').values()))
                 
-                cur.execute("SELECT COALESCE(SUM(amount), 0) FROM t_p53065890_farmer_landing_proje.investments")
-                total_invested = float(cur.fetchone()[0])
-                
-                cur.execute("""
-                    SELECT 
-                        u.id, u.email, u.name, u.role, u.created_at,
-                        COALESCE(p.count, 0) as proposals_count,
-                        COALESCE(i.count, 0) as investments_count
-                    FROM t_p53065890_farmer_landing_proje.users u
-                    LEFT JOIN (SELECT user_id, COUNT(*) as count FROM t_p53065890_farmer_landing_proje.proposals GROUP BY user_id) p ON u.id = p.user_id
-                    LEFT JOIN (SELECT user_id, COUNT(*) as count FROM t_p53065890_farmer_landing_proje.investments GROUP BY user_id) i ON u.id = i.user_id
-                    ORDER BY u.created_at DESC
-                """)
-                users_results = cur.fetchall()
-                users = []
-                for u in users_results:
-                    users.append({
-                        'id': u[0],
-                        'email': u[1],
-                        'name': u[2],
-                        'role': u[3],
-                        'created_at': u[4].isoformat() if u[4] else None,
-                        'proposals_count': u[5],
-                        'investments_count': u[6]
-                    })
+                total_invested = float(sum(get_rollup_totals(cur, 'revenue', 'investments', 'date', "'all'", 'COALESCE(SUM(amount), 0)').values()))
                 
-                cur.execute("""
-                    SELECT 
-                        p.id, p.description, p.price, p.shares, p.type, p.status,
-                        u.name as farmer_name, u.email as farmer_email,
-                        COALESCE(i.count, 0) as investors_count
-                    FROM t_p53065890_farmer_landing_proje.proposals p
-                    JOIN t_p53065890_farmer_landing_proje.users u ON p.user_id = u.id
-                    LEFT JOIN (SELECT proposal_id, COUNT(DISTINCT user_id) as count FROM t_p53065890_farmer_landing_proje.investments GROUP BY proposal_id) i ON p.id = i.proposal_id
-                    ORDER BY p.created_at DESC
-                """)
-                proposals_results = cur.fetchall()
-                proposals = []
-                for p in proposals_results:
-                    proposals.append({
-                        'id': p[0],
-                        'description': p[1],
-                        'price': float(p[2]) if p[2] else 0,
-                        'shares': p[3],
-                        'type': p[4],
-                        'status': p[5],
-                        'farmer_name': p[6],
-                        'farmer_email': p[7],
-                        'investors_count': p[8]
-                    })
+                # Списки постранично: ?users_page=, ?proposals_page=, page_size, search, sort, order, status
+                users_page = list_users_page(
+                    cur,
+                    get_page_params(query_params, 'users_'),
+                    search=query_params.get('search', ''),
+                    sort=query_params.get('sort', 'created_at'),
+                    order=query_params.get('order', 'desc'),
+                    with_counts=True
+                )
+                proposals_page = list_proposals_page(
+                    cur,
+                    get_page_params(query_params, 'proposals_'),
+                    status=query_params.get('status', ''),
+                    sort=query_params.get('proposals_sort', 'created_at'),
+                    order=query_params.get('proposals_order', 'desc')
+                )
                 
                 cur.execute("""
                     SELECT region, COUNT(*) as count 
@@ -444,9 +799,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'total_investments': total_investments,
                         'total_invested': total_invested
                     },
-                    'users': users,
-                    'proposals': proposals,
-                    'regions': regions
+                    'users': users_page['users'],
+                    'proposals': proposals_page['proposals'],
+                    'regions': regions,
+                    'pagination': {
+                        'users': {k: users_page[k] for k in ('total', 'page', 'page_size')},
+                        'proposals': {k: proposals_page[k] for k in ('total', 'page', 'page_size')}
+                    }
                 }
                 
                 return {
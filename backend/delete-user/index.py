@@ -1,10 +1,80 @@
 import json
 import os
 import psycopg2
-from typing import Dict, Any
+from typing import Dict, Any, List
 
 ADMIN_SECRET = "farmer_admin_2025_secret_key"
 
+DELETE_CHUNK_SIZE = 500
+
+# Порядок удаления данных пользователей: сначала зависимые таблицы, затем сами пользователи.
+# Каждый запрос обрабатывает всю пачку ID сразу (= ANY(%(ids)s)), число запросов не зависит от числа пользователей.
+USER_DELETE_PLAN = [
+    ('investments', """DELETE FROM {schema}.investments
+        WHERE user_id = ANY(%(ids)s)
+           OR proposal_id IN (SELECT id FROM {schema}.proposals WHERE user_id = ANY(%(ids)s))"""),
+    # Доли, удержанные ожидающими заявками, возвращаются в предложения до удаления самих заявок
+    ('released_reservations', """SELECT request_id FROM {schema}.release_investment_requests(
+        ARRAY(
+            SELECT id FROM {schema}.investment_requests
+            WHERE status = 'pending' AND (
+                investor_id = ANY(%(ids)s)
+                OR offer_id IN (SELECT id FROM {schema}.investment_offers WHERE farmer_id = ANY(%(ids)s))
+            )
+        ),
+        'cancelled'
+    )"""),
+    ('investment_requests', """DELETE FROM {schema}.investment_requests
+        WHERE investor_id = ANY(%(ids)s)
+           OR offer_id IN (SELECT id FROM {schema}.investment_offers WHERE farmer_id = ANY(%(ids)s))"""),
+    ('investment_offers', "DELETE FROM {schema}.investment_offers WHERE farmer_id = ANY(%(ids)s)"),
+    ('proposals', "DELETE FROM {schema}.proposals WHERE user_id = ANY(%(ids)s)"),
+    ('products', "DELETE FROM {schema}.products WHERE user_id = ANY(%(ids)s)"),
+    ('ads', "DELETE FROM {schema}.ads WHERE user_id = ANY(%(ids)s)"),
+    ('notifications', "DELETE FROM {schema}.notifications WHERE user_id = ANY(%(ids)s)"),
+    ('farm_agro_tech', """DELETE FROM {schema}.farm_agro_tech
+        WHERE crop_id IN (
+            SELECT c.id FROM {schema}.farm_crops c
+            JOIN {schema}.farmer_data fd ON fd.id = c.farmer_data_id
+            WHERE fd.user_id = ANY(%(ids)s)
+        )"""),
+    ('farm_crops', """DELETE FROM {schema}.farm_crops
+        WHERE farmer_data_id IN (SELECT id FROM {schema}.farmer_data WHERE user_id = ANY(%(ids)s))"""),
+    ('farm_animals', """DELETE FROM {schema}.farm_animals
+        WHERE farmer_data_id IN (SELECT id FROM {schema}.farmer_data WHERE user_id = ANY(%(ids)s))"""),
+    ('farm_equipment', """DELETE FROM {schema}.farm_equipment
+        WHERE farmer_data_id IN (SELECT id FROM {schema}.farmer_data WHERE user_id = ANY(%(ids)s))"""),
+    ('farmer_data', "DELETE FROM {schema}.farmer_data WHERE user_id = ANY(%(ids)s)"),
+    ('seller_data', "DELETE FROM {schema}.seller_data WHERE user_id = ANY(%(ids)s)"),
+    ('garage', "DELETE FROM {schema}.garage WHERE user_id = ANY(%(ids)s)"),
+    ('leaderboard', "DELETE FROM {schema}.leaderboard WHERE user_id = ANY(%(ids)s)"),
+    ('users', "DELETE FROM {schema}.users WHERE id = ANY(%(ids)s)"),
+    ('user_token_versions', """INSERT INTO {schema}.user_token_versions (user_id, token_version, changed_at)
+        SELECT unnest(%(ids)s::int[]), -1, CURRENT_TIMESTAMP
+        ON CONFLICT (user_id) DO UPDATE SET token_version = -1, changed_at = CURRENT_TIMESTAMP""")
+]
+
+def delete_users_bulk(conn, user_ids: List[int]) -> Dict[str, int]:
+    '''
+    Business: Удалить пользователей и все их данные пачками: фиксированное число запросов на пачку,
+              отдельная транзакция на пачку ограничивает время удержания блокировок
+    Args: conn - соединение с БД, user_ids - ID пользователей
+    Returns: dict {таблица: число удаленных строк}
+    '''
+    schema = 't_p53065890_farmer_landing_proje'
+    counts = {table: 0 for table, _ in USER_DELETE_PLAN}
+    ids = sorted(set(user_ids))
+    
+    for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+        chunk = ids[start:start + DELETE_CHUNK_SIZE]
+        with conn.cursor() as cur:
+            for table, sql in USER_DELETE_PLAN:
+                cur.execute(sql.format(schema=schema), {'ids': chunk})
+                counts[table] += cur.rowcount
+        conn.commit()
+    
+    return counts
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Удаление пользователей с каскадным удалением всех связанных данных
@@ -67,40 +137,21 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
+    try:
+        user_ids = [int(user_id) for user_id in user_ids]
+    except (TypeError, ValueError):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'user_ids должны быть числами'}),
+            'isBase64Encoded': False
+        }
+    
     conn = psycopg2.connect(db_url)
-    cur = conn.cursor()
     
     try:
-        schema = 't_p53065890_farmer_landing_proje'
-        deleted_count = 0
-        
-        for user_id in user_ids:
-            # Удаляем инвестиции пользователя
-            cur.execute(f"DELETE FROM {schema}.investments WHERE user_id = %s", (user_id,))
-            
-            # Удаляем инвестиции В предложения этого пользователя
-            cur.execute(f"""
-                DELETE FROM {schema}.investments 
-                WHERE proposal_id IN (
-                    SELECT id FROM {schema}.proposals WHERE user_id = %s
-                )
-            """, (user_id,))
-            
-            # Теперь можно удалить предложения
-            cur.execute(f"DELETE FROM {schema}.proposals WHERE user_id = %s", (user_id,))
-            cur.execute(f"DELETE FROM {schema}.products WHERE user_id = %s", (user_id,))
-            cur.execute(f"DELETE FROM {schema}.ads WHERE user_id = %s", (user_id,))
-            cur.execute(f"DELETE FROM {schema}.farmer_data WHERE user_id = %s", (user_id,))
-            cur.execute(f"DELETE FROM {schema}.seller_data WHERE user_id = %s", (user_id,))
-            cur.execute(f"DELETE FROM {schema}.garage WHERE user_id = %s", (user_id,))
-            cur.execute(f"DELETE FROM {schema}.leaderboard WHERE user_id = %s", (user_id,))
-            
-            # Удаляем самого пользователя
-            cur.execute(f"DELETE FROM {schema}.users WHERE id = %s", (user_id,))
-            if cur.rowcount > 0:
-                deleted_count += 1
-        
-        conn.commit()
+        deleted_by_table = delete_users_bulk(conn, user_ids)
+        deleted_count = deleted_by_table['users']
         
         return {
             'statusCode': 200,
@@ -108,7 +159,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({
                 'success': True,
                 'message': f'Удалено пользователей: {deleted_count}',
-                'deleted_count': deleted_count
+                'deleted_count': deleted_count,
+                'deleted_by_table': deleted_by_table
             }),
             'isBase64Encoded': False
         }
@@ -122,5 +174,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     finally:
-        cur.close()
         conn.close()
\ No newline at end of file
@@ -1,7 +1,133 @@
 import json
 import os
+import hashlib
 import psycopg2
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+from datetime import date
+
+ACTIVITY_SHARD_BITS = 8192
+IDEMPOTENT_ACTIONS = ('create_offer', 'create_proposal')
+IDEMPOTENCY_KEY_MAX_LENGTH = 128
+MODERATE_BATCH_MAX = 500
+RESERVATION_EXPIRY_BATCH_SIZE = int(os.environ.get('SHARE_RESERVATION_EXPIRY_BATCH_SIZE', '500'))
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_KEY_TTL_HOURS', '24'))
+IDEMPOTENCY_KEY_CLEANUP_BATCH_SIZE = int(os.environ.get('IDEMPOTENCY_KEY_CLEANUP_BATCH_SIZE', '1000'))
+
+# Уже отмеченные за сегодня пользователи в этом экземпляре функции: повторные запросы не пишут в БД
+_activity_seen: Dict[str, Any] = {'day': None, 'users': set()}
+
+def record_activity(conn, user_id: Any) -> None:
+    '''
+    Business: Отметить активность пользователя за день битом в дневной битовой карте (не строкой на запрос)
+    Args: conn - соединение с БД, user_id - ID пользователя
+    Returns: None
+    '''
+    try:
+        uid = int(user_id)
+    except (TypeError, ValueError):
+        return
+    
+    today = date.today()
+    if _activity_seen['day'] != today:
+        _activity_seen['day'] = today
+        _activity_seen['users'] = set()
+    if uid in _activity_seen['users']:
+        return
+    
+    schema = 't_p53065890_farmer_landing_proje'
+    shard, bit = divmod(uid, ACTIVITY_SHARD_BITS)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                INSERT INTO {schema}.user_activity_bitmaps (day, shard, bitmap)
+                VALUES (%s, %s, set_bit(decode(repeat('00', %s), 'hex'), %s, 1))
+                ON CONFLICT (day, shard) DO UPDATE
+                SET bitmap = set_bit(user_activity_bitmaps.bitmap, %s, 1)
+                WHERE get_bit(user_activity_bitmaps.bitmap, %s) = 0
+            """, (today, shard, ACTIVITY_SHARD_BITS // 8, bit, bit, bit))
+        conn.commit()
+        _activity_seen['users'].add(uid)
+    except Exception as e:
+        conn.rollback()
+        print(f"Activity tracking failed: {e}")
+
+def begin_idempotent_request(cur, user_id: Any, key: Optional[str], action: str, body_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    '''
+    Business: Занять ключ идемпотентности в текущей транзакции или вернуть сохраненный ответ повтора
+    Args: cur - курсор БД, user_id - ID пользователя, key - заголовок Idempotency-Key (None - без идемпотентности),
+          action - действие, body_data - тело запроса
+    Returns: HTTP response для повтора или None, если запрос нужно выполнить
+    '''
+    if not key:
+        return None
+    
+    schema = 't_p53065890_farmer_landing_proje'
+    request_hash = hashlib.sha256(json.dumps(body_data, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+    
+    select_stored = (
+        f"""SELECT action, request_hash, status_code, response FROM {schema}.idempotency_keys
+           WHERE user_id = %s AND idempotency_key = %s"""
+    )
+    
+    # Повтор: один поиск по первичному ключу
+    cur.execute(select_stored, (int(user_id), key))
+    stored = cur.fetchone()
+    
+    if not stored:
+        # Вставка ждет параллельный запрос с тем же ключом до его COMMIT/ROLLBACK
+        cur.execute(
+            f"""INSERT INTO {schema}.idempotency_keys (user_id, idempotency_key, action, request_hash)
+               VALUES (%s, %s, %s, %s)
+               ON CONFLICT (user_id, idempotency_key) DO NOTHING
+               RETURNING 1""",
+            (int(user_id), key, action, request_hash)
+        )
+        if cur.fetchone():
+            return None
+        cur.execute(select_stored, (int(user_id), key))
+        stored = cur.fetchone()
+    
+    cur.connection.rollback()
+    
+    if stored[0] != action or stored[1] != request_hash:
+        return {
+            'statusCode': 422,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Idempotency-Key уже использован для другого запроса'})
+        }
+    
+    if stored[2] is None:
+        return {
+            'statusCode': 409,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Запрос с этим Idempotency-Key еще выполняется'})
+        }
+    
+    return {
+        'statusCode': stored[2],
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Idempotent-Replayed': 'true'
+        },
+        'body': json.dumps(stored[3])
+    }
+
+def save_idempotent_response(cur, user_id: Any, key: Optional[str], status_code: int, body: Dict[str, Any]) -> None:
+    '''
+    Business: Сохранить ответ под ключом идемпотентности (до COMMIT основной записи)
+    Args: cur - курсор БД, user_id - ID пользователя, key - Idempotency-Key, status_code - HTTP статус, body - тело ответа
+    Returns: None
+    '''
+    if not key:
+        return
+    
+    schema = 't_p53065890_farmer_landing_proje'
+    cur.execute(
+        f"""UPDATE {schema}.idempotency_keys SET status_code = %s, response = %s::jsonb
+           WHERE user_id = %s AND idempotency_key = %s""",
+        (status_code, json.dumps(body), int(user_id), key)
+    )
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
@@ -18,7 +144,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, Idempotency-Key',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -32,6 +158,51 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'DATABASE_URL не настроен'})
         }
     
+    schema = 't_p53065890_farmer_landing_proje'
+    params = event.get('queryStringParameters') or {}
+    
+    # POST ?action=expire_reservations - batch-задача (таймер): вернуть доли просроченных заявок
+    if method == 'POST' and params.get('action') == 'expire_reservations':
+        conn = psycopg2.connect(db_url)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""SELECT request_id FROM {schema}.expire_share_reservations(%s)""",
+                    (RESERVATION_EXPIRY_BATCH_SIZE,)
+                )
+                expired = [row[0] for row in cur.fetchall()]
+            conn.commit()
+        finally:
+            conn.close()
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'success': True, 'expired': len(expired), 'has_more': len(expired) == RESERVATION_EXPIRY_BATCH_SIZE})
+        }
+    
+    # POST ?action=cleanup_idempotency_keys - batch-задача (таймер): удалить ключи идемпотентности старше срока хранения
+    if method == 'POST' and params.get('action') == 'cleanup_idempotency_keys':
+        conn = psycopg2.connect(db_url)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    DELETE FROM {schema}.idempotency_keys
+                    WHERE ctid IN (
+                        SELECT ctid FROM {schema}.idempotency_keys
+                        WHERE created_at < now() - make_interval(hours => %s)
+                        LIMIT %s
+                    )
+                """, (IDEMPOTENCY_KEY_TTL_HOURS, IDEMPOTENCY_KEY_CLEANUP_BATCH_SIZE))
+                deleted = cur.rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'success': True, 'deleted': deleted, 'has_more': deleted == IDEMPOTENCY_KEY_CLEANUP_BATCH_SIZE})
+        }
+    
     headers = event.get('headers', {})
     user_id = headers.get('X-User-Id') or headers.get('x-user-id')
     
@@ -42,15 +213,27 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Требуется авторизация'})
         }
     
-    schema = 't_p53065890_farmer_landing_proje'
     conn = psycopg2.connect(db_url)
     cur = conn.cursor()
+    record_activity(conn, user_id)
     
     try:
         if method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
             action = body_data.get('action')
             print(f"📨 POST action: {action}, user_id: {user_id}")
+
+            # Повторы POST с тем же Idempotency-Key возвращают первый ответ без повторной записи
+            idempotency_key = (headers.get('Idempotency-Key') or headers.get('idempotency-key')) if action in IDEMPOTENT_ACTIONS else None
+            if idempotency_key and len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Слишком длинный Idempotency-Key'})
+                }
+            replay = begin_idempotent_request(cur, user_id, idempotency_key, action, body_data)
+            if replay:
+                return replay
             
             if action == 'save_diagnosis':
                 assets = body_data.get('assets', [])
@@ -211,110 +394,128 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                      region, city, socials_json, status)
                 )
                 result = cur.fetchone()
+                response_body = {
+                    'id': result[0],
+                    'farm_name': result[1],
+                    'title': result[2],
+                    'total_amount': float(result[3]),
+                    'share_price': float(result[4]),
+                    'total_shares': result[5],
+                    'available_shares': result[6],
+                    'expected_monthly_income': float(result[7]) if result[7] else None,
+                    'region': result[8],
+                    'city': result[9],
+                    'socials': result[10],
+                    'status': result[11]
+                }
+                save_idempotent_response(cur, user_id, idempotency_key, 200, response_body)
                 conn.commit()
                 
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'id': result[0],
-                        'farm_name': result[1],
-                        'title': result[2],
-                        'total_amount': float(result[3]),
-                        'share_price': float(result[4]),
-                        'total_shares': result[5],
-                        'available_shares': result[6],
-                        'expected_monthly_income': float(result[7]) if result[7] else None,
-                        'region': result[8],
-                        'city': result[9],
-                        'socials': result[10],
-                        'status': result[11]
-                    })
+                    'body': json.dumps(response_body)
                 }
             
             elif action == 'moderate_request':
-                request_id = body_data.get('request_id')
+                # request_id - одна заявка, request_ids - пакет заявок в одной транзакции
+                request_ids = body_data.get('request_ids') or ([body_data['request_id']] if body_data.get('request_id') else [])
                 action_type = body_data.get('action_type')
                 
-                if not request_id or action_type not in ['approve', 'reject']:
+                if (not request_ids or action_type not in ['approve', 'reject']
+                        or len(request_ids) > MODERATE_BATCH_MAX
+                        or not all(str(rid).isdigit() for rid in request_ids)):
                     return {
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                         'body': json.dumps({'error': 'Неверные параметры'})
                     }
+                request_ids = [int(rid) for rid in request_ids]
                 
                 cur.execute(
-                    f"""SELECT r.id, r.offer_id, r.shares_requested, r.status, r.investor_id,
-                              o.available_shares, o.farmer_id
+                    f"""SELECT r.id, r.status, r.reserved_until IS NULL, r.offer_id, r.shares_requested, r.investor_id
                        FROM {schema}.investment_requests r
                        JOIN {schema}.investment_offers o ON o.id = r.offer_id
-                       WHERE r.id = %s""",
-                    (request_id,)
+                       WHERE r.id = ANY(%s) AND o.farmer_id = %s""",
+                    (request_ids, int(user_id))
                 )
-                row = cur.fetchone()
+                rows = cur.fetchall()
                 
-                if not row or row[6] != int(user_id):
+                if not rows:
                     return {
                         'statusCode': 404,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                         'body': json.dumps({'error': 'Заявка не найдена'})
                     }
                 
-                if row[3] != 'pending':
+                pending = [row for row in rows if row[1] == 'pending']
+                if len(request_ids) == 1 and not pending:
                     return {
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                         'body': json.dumps({'error': 'Заявка уже обработана'})
                     }
                 
+                conflicts = []
                 if action_type == 'approve':
-                    shares_requested = row[2]
-                    available_shares = row[5]
-                    offer_id = row[1]
-                    investor_id = row[4]
-                    
-                    if shares_requested > available_shares:
-                        return {
-                            'statusCode': 400,
-                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                            'body': json.dumps({'error': 'Недостаточно доступных долей'})
-                        }
-                    
+                    # Заявки с резервом: доли уже удержаны, одобрение пакетом без проверки available_shares
                     cur.execute(
-                        f"""UPDATE {schema}.investment_offers
-                           SET available_shares = available_shares - %s, updated_at = now()
-                           WHERE id = %s AND available_shares >= %s""",
-                        (shares_requested, offer_id, shares_requested)
+                        f"""SELECT request_id FROM {schema}.approve_investment_requests(%s, %s)""",
+                        (int(user_id), [row[0] for row in pending if not row[2]])
                     )
+                    processed = [row[0] for row in cur.fetchall()]
+                    
+                    # Заявки, созданные до резервирования: условное списание свободных долей
+                    for row in pending:
+                        if not row[2]:
+                            continue
+                        cur.execute('SAVEPOINT legacy_approve')
+                        cur.execute(
+                            f"""UPDATE {schema}.investment_requests SET status = 'approved'
+                               WHERE id = %s AND status = 'pending'""",
+                            (row[0],)
+                        )
+                        if cur.rowcount == 0:
+                            cur.execute('RELEASE SAVEPOINT legacy_approve')
+                            continue
+                        cur.execute(
+                            f"""UPDATE {schema}.investment_offers
+                               SET available_shares = available_shares - %s, updated_at = now()
+                               WHERE id = %s AND available_shares >= %s""",
+                            (row[4], row[3], row[4])
+                        )
+                        if cur.rowcount == 0:
+                            cur.execute('ROLLBACK TO SAVEPOINT legacy_approve')
+                            conflicts.append(row[0])
+                            continue
+                        cur.execute('RELEASE SAVEPOINT legacy_approve')
+                        cur.execute(
+                            f"""INSERT INTO {schema}.notifications (user_id, role, type, payload)
+                               VALUES (%s, 'investor', 'request_approved', %s::jsonb)""",
+                            (row[5], json.dumps({'request_id': row[0]}))
+                        )
+                        processed.append(row[0])
                     
-                    if cur.rowcount == 0:
+                    if len(request_ids) == 1 and conflicts:
+                        conn.rollback()
                         return {
                             'statusCode': 409,
                             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                             'body': json.dumps({'error': 'Конфликт: долей уже не хватило'})
                         }
-                    
-                    cur.execute(
-                        f"""UPDATE {schema}.investment_requests SET status = 'approved' WHERE id = %s""",
-                        (request_id,)
-                    )
-                    
-                    cur.execute(
-                        f"""INSERT INTO {schema}.notifications (user_id, role, type, payload)
-                           VALUES (%s, 'investor', 'request_approved', %s::jsonb)""",
-                        (investor_id, json.dumps({'request_id': request_id}))
-                    )
-                    
-                elif action_type == 'reject':
+                
+                else:
                     cur.execute(
-                        f"""UPDATE {schema}.investment_requests SET status = 'rejected' WHERE id = %s""",
-                        (request_id,)
+                        f"""SELECT request_id FROM {schema}.release_investment_requests(%s, 'rejected', %s)""",
+                        ([row[0] for row in pending], int(user_id))
                     )
+                    processed = [row[0] for row in cur.fetchall()]
                 
                 cur.execute(
                     f"""INSERT INTO {schema}.notifications (role, type, payload)
-                       VALUES ('admin', 'request_moderated', %s::jsonb)""",
-                    (json.dumps({'request_id': request_id, 'action': action_type}),)
+                       SELECT 'admin', 'request_moderated', jsonb_build_object('request_id', rid, 'action', %s)
+                       FROM unnest(%s::bigint[]) AS rid""",
+                    (action_type, processed)
                 )
                 
                 conn.commit()
@@ -322,7 +523,12 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True})
+                    'body': json.dumps({
+                        'success': True,
+                        'processed': processed,
+                        'conflicts': conflicts,
+                        'skipped': [rid for rid in request_ids if rid not in processed and rid not in conflicts]
+                    })
                 }
             
             elif action == 'moderate_proposal_request':
@@ -414,12 +620,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     raise
                 proposal_id = cur.fetchone()[0]
                 
+                response_body = {'success': True, 'proposal_id': proposal_id}
+                save_idempotent_response(cur, user_id, idempotency_key, 200, response_body)
                 conn.commit()
                 
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'proposal_id': proposal_id})
+                    'body': json.dumps(response_body)
                 }
             
             elif action == 'request_delete_proposal':
@@ -432,9 +640,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'Требуется proposal_id'})
                     }
                 
+                # Блокировка строки предложения: параллельные запросы на удаление выполняются по очереди
                 cur.execute(
                     f"""SELECT p.id FROM {schema}.proposals p
-                       WHERE p.id = %s AND p.user_id = %s""",
+                       WHERE p.id = %s AND p.user_id = %s
+                       FOR UPDATE""",
                     (proposal_id, user_id)
                 )
                 if not cur.fetchone():
@@ -445,14 +655,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     }
                 
                 cur.execute(
-                    f"""SELECT DISTINCT i.user_id 
+                    f"""SELECT COUNT(DISTINCT i.user_id) 
                        FROM {schema}.investments i
                        WHERE i.proposal_id = %s AND i.status NOT IN ('cancelled', 'rejected', 'force_cancelled')""",
                     (proposal_id,)
                 )
-                active_investors = [row[0] for row in cur.fetchall()]
+                active_investors_count = cur.fetchone()[0]
                 
-                if len(active_investors) == 0:
+                if active_investors_count == 0:
                     cur.execute(
                         f"""DELETE FROM {schema}.investments WHERE proposal_id = %s""",
                         (proposal_id,)
@@ -483,21 +693,33 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'Запрос на удаление уже создан'})
                     }
                 
+                # Запрос, подтверждения и уведомления всем инвесторам - одним запросом независимо от их числа
                 cur.execute(
-                    f"""INSERT INTO {schema}.deletion_requests 
-                       (proposal_id, farmer_id, total_investors, status)
-                       VALUES (%s, %s, %s, 'pending') RETURNING id""",
-                    (proposal_id, user_id, len(active_investors))
+                    f"""WITH investors AS (
+                           SELECT DISTINCT i.user_id FROM {schema}.investments i
+                           WHERE i.proposal_id = %(proposal_id)s
+                             AND i.status NOT IN ('cancelled', 'rejected', 'force_cancelled')
+                       ),
+                       req AS (
+                           INSERT INTO {schema}.deletion_requests (proposal_id, farmer_id, total_investors, status)
+                           SELECT %(proposal_id)s, %(farmer_id)s, COUNT(*), 'pending' FROM investors
+                           RETURNING id, total_investors
+                       ),
+                       confirmations AS (
+                           INSERT INTO {schema}.deletion_confirmations (deletion_request_id, investor_id)
+                           SELECT req.id, investors.user_id FROM req CROSS JOIN investors
+                           ON CONFLICT (deletion_request_id, investor_id) DO NOTHING
+                       ),
+                       notified AS (
+                           INSERT INTO {schema}.notifications (user_id, role, type, payload)
+                           SELECT investors.user_id, 'investor', 'deletion_requested',
+                                  jsonb_build_object('request_id', req.id, 'proposal_id', %(proposal_id)s)
+                           FROM req CROSS JOIN investors
+                       )
+                       SELECT id, total_investors FROM req""",
+                    {'proposal_id': int(proposal_id), 'farmer_id': int(user_id)}
                 )
-                request_id = cur.fetchone()[0]
-                
-                for investor_id in active_investors:
-                    cur.execute(
-                        f"""INSERT INTO {schema}.deletion_confirmations 
-                           (deletion_request_id, investor_id)
-                           VALUES (%s, %s)""",
-                        (request_id, investor_id)
-                    )
+                request_id, waiting_for = cur.fetchone()
                 
                 conn.commit()
                 
@@ -507,7 +729,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({
                         'success': True,
                         'request_id': request_id,
-                        'waiting_for': len(active_investors)
+                        'waiting_for': waiting_for
                     })
                 }
             
@@ -536,36 +758,27 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                             'body': json.dumps({'error': 'Предложение не найдено'})
                         }
                     
+                    # investments.proposal_id ссылается на proposals без каскада: инвестиции удаляются вместе с предложением,
+                    # иначе DELETE предложения упадет на внешнем ключе и откатит всю транзакцию
                     cur.execute(
-                        f"""SELECT COUNT(*) FROM {schema}.investments 
-                           WHERE proposal_id = %s AND status NOT IN ('cancelled', 'rejected', 'force_cancelled')""",
+                        f"""WITH removed AS (
+                               DELETE FROM {schema}.investments WHERE proposal_id = %s
+                               RETURNING status
+                           )
+                           SELECT COUNT(*) FROM removed
+                           WHERE status NOT IN ('cancelled', 'rejected', 'force_cancelled')""",
                         (proposal_id,)
                     )
                     active_investments_count = cur.fetchone()[0]
                     
-                    if active_investments_count > 0:
-                        cur.execute(
-                            f"""UPDATE {schema}.investments 
-                               SET status = 'cancelled'
-                               WHERE proposal_id = %s AND status NOT IN ('cancelled', 'rejected', 'force_cancelled')""",
-                            (proposal_id,)
-                        )
-                    
-                    cur.execute(
-                        f"""SELECT id FROM {schema}.deletion_requests WHERE proposal_id = %s""",
-                        (proposal_id,)
-                    )
-                    deletion_request_ids = [row[0] for row in cur.fetchall()]
-                    
-                    for dr_id in deletion_request_ids:
-                        cur.execute(
-                            f"""DELETE FROM {schema}.deletion_confirmations 
-                               WHERE deletion_request_id = %s""",
-                            (dr_id,)
-                        )
-                    
+                    # Запросы на удаление и все их подтверждения - одним запросом
                     cur.execute(
-                        f"""DELETE FROM {schema}.deletion_requests WHERE proposal_id = %s""",
+                        f"""WITH removed_requests AS (
+                               DELETE FROM {schema}.deletion_requests WHERE proposal_id = %s
+                               RETURNING id
+                           )
+                           DELETE FROM {schema}.deletion_confirmations
+                           WHERE deletion_request_id IN (SELECT id FROM removed_requests)""",
                         (proposal_id,)
                     )
                     
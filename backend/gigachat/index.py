@@ -1,8 +1,9 @@
 import json
 import os
 import uuid
+import time
 import requests
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import date
 
 try:
@@ -12,7 +13,21 @@ try:
 except ImportError:
     DB_AVAILABLE = False
     print("WARNING: psycopg2 not available, usage tracking disabled")
-from datetime import date
+
+HISTORY_TOKEN_BUDGET = int(os.environ.get('GIGACHAT_HISTORY_TOKEN_BUDGET', '3000'))
+HISTORY_FETCH_LIMIT = 40
+BREAKER_NAME = 'gigachat'
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('GIGACHAT_BREAKER_THRESHOLD', '5'))
+BREAKER_COOLDOWN_SECONDS = int(os.environ.get('GIGACHAT_BREAKER_COOLDOWN', '60'))
+GIGACHAT_TIMEOUT_SECONDS = int(os.environ.get('GIGACHAT_TIMEOUT_SECONDS', '30'))
+# Пробный запрос half_open - получение токена и запрос к модели, каждый ограничен GIGACHAT_TIMEOUT_SECONDS
+BREAKER_PROBE_LEASE_SECONDS = 2 * GIGACHAT_TIMEOUT_SECONDS
+ENTITLEMENTS_TTL_SECONDS = int(os.environ.get('ENTITLEMENTS_TTL_SECONDS', '30'))
+ENTITLEMENTS_CACHE_SIZE = 10000
+ADMIN_SECRET = "farmer_admin_2025_secret_key"
+
+# Права пользователей в этом экземпляре функции: user_id -> (истекает, права)
+_entitlements_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
 
 def get_gigachat_token(api_key: str) -> str:
     """
@@ -29,7 +44,7 @@ def get_gigachat_token(api_key: str) -> str:
     }
     payload = {'scope': 'GIGACHAT_API_PERS'}
     
-    response = requests.post(url, headers=headers, data=payload, verify=False)
+    response = requests.post(url, headers=headers, data=payload, verify=False, timeout=GIGACHAT_TIMEOUT_SECONDS)
     response.raise_for_status()
     return response.json()['access_token']
 
@@ -52,10 +67,184 @@ def chat_with_gigachat(access_token: str, messages: List[Dict[str, str]], model:
         'max_tokens': 2000
     }
     
-    response = requests.post(url, headers=headers, json=payload, verify=False)
+    response = requests.post(url, headers=headers, json=payload, verify=False, timeout=GIGACHAT_TIMEOUT_SECONDS)
     response.raise_for_status()
     return response.json()['choices'][0]['message']['content']
 
+class CircuitOpenError(Exception):
+    """
+    Business: Вызов GigaChat отклонен открытым circuit breaker без обращения к API
+    """
+
+def inject_fault() -> None:
+    """
+    Business: Локальная заглушка для имитации сбоев GigaChat при тестировании
+    Args: переменная окружения GIGACHAT_FAULT_INJECTION = error | timeout | slow:<секунды>
+    Returns: None (или исключение, как при реальном сбое)
+    """
+    fault = os.environ.get('GIGACHAT_FAULT_INJECTION', '')
+    if fault == 'error':
+        raise requests.ConnectionError('Injected GigaChat fault')
+    if fault == 'timeout':
+        raise requests.Timeout('Injected GigaChat timeout')
+    if fault.startswith('slow:'):
+        time.sleep(float(fault.split(':', 1)[1]))
+
+def breaker_allow(dsn: str) -> bool:
+    """
+    Business: Проверить общий circuit breaker перед вызовом GigaChat
+    Args: dsn - подключение к БД
+    Returns: True если вызов разрешен (closed или единственный пробный запрос half_open после паузы)
+    """
+    schema = 't_p53065890_farmer_landing_proje'
+    try:
+        conn = psycopg2.connect(dsn)
+    except Exception as e:
+        print(f'Circuit breaker storage unavailable: {e}')
+        return True
+    
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f'SELECT state FROM {schema}.circuit_breakers WHERE name = %s', (BREAKER_NAME,))
+            row = cur.fetchone()
+            if not row or row['state'] == 'closed':
+                return True
+            
+            # Строка блокируется UPDATE: пробный запрос получит только один вызов
+            cur.execute(f'''
+                UPDATE {schema}.circuit_breakers
+                SET state = 'half_open',
+                    probe_started_at = CURRENT_TIMESTAMP,
+                    half_open_count = half_open_count + CASE WHEN state = 'open' THEN 1 ELSE 0 END,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE name = %s
+                  AND ((state = 'open' AND opened_at <= CURRENT_TIMESTAMP - INTERVAL '1 second' * %s)
+                       OR (state = 'half_open' AND probe_started_at <= CURRENT_TIMESTAMP - INTERVAL '1 second' * %s))
+                RETURNING name
+            ''', (BREAKER_NAME, BREAKER_COOLDOWN_SECONDS, BREAKER_PROBE_LEASE_SECONDS))
+            allowed = cur.fetchone() is not None
+            
+            if not allowed:
+                cur.execute(f'''
+                    UPDATE {schema}.circuit_breakers
+                    SET rejected_count = rejected_count + 1
+                    WHERE name = %s
+                ''', (BREAKER_NAME,))
+            
+            conn.commit()
+            return allowed
+    finally:
+        conn.close()
+
+def breaker_record(success: bool, error: Optional[str], dsn: str) -> None:
+    """
+    Business: Записать результат вызова GigaChat в circuit breaker
+    Args: success - успех вызова, error - текст ошибки, dsn - подключение к БД
+    Returns: None (успех закрывает breaker, N ошибок подряд или неудачная проба - открывают)
+    """
+    schema = 't_p53065890_farmer_landing_proje'
+    try:
+        conn = psycopg2.connect(dsn)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f'''
+                    UPDATE {schema}.circuit_breakers
+                    SET state = CASE
+                            WHEN %(ok)s THEN 'closed'
+                            WHEN state = 'half_open' OR failure_count + 1 >= %(threshold)s THEN 'open'
+                            ELSE state END,
+                        opened_at = CASE
+                            WHEN NOT %(ok)s AND state <> 'open'
+                                 AND (state = 'half_open' OR failure_count + 1 >= %(threshold)s)
+                            THEN CURRENT_TIMESTAMP ELSE opened_at END,
+                        open_count = open_count + CASE
+                            WHEN NOT %(ok)s AND state <> 'open'
+                                 AND (state = 'half_open' OR failure_count + 1 >= %(threshold)s)
+                            THEN 1 ELSE 0 END,
+                        failure_count = CASE WHEN %(ok)s THEN 0 ELSE failure_count + 1 END,
+                        last_error = CASE WHEN %(ok)s THEN last_error ELSE %(error)s END,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE name = %(name)s
+                      AND NOT (%(ok)s AND state = 'closed' AND failure_count = 0)
+                ''', {'ok': success, 'threshold': BREAKER_FAILURE_THRESHOLD, 'error': error, 'name': BREAKER_NAME})
+                conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f'Failed to record circuit breaker outcome: {e}')
+
+def breaker_status(dsn: str) -> Dict[str, Any]:
+    """
+    Business: Состояние circuit breaker и счетчики open/half_open/rejected для мониторинга
+    Args: dsn - подключение к БД
+    Returns: dict с состоянием breaker
+    """
+    schema = 't_p53065890_farmer_landing_proje'
+    conn = psycopg2.connect(dsn)
+    
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f'''
+                SELECT name, state, failure_count, opened_at, last_error,
+                       open_count, half_open_count, rejected_count
+                FROM {schema}.circuit_breakers
+                WHERE name = %s
+            ''', (BREAKER_NAME,))
+            row = cur.fetchone()
+            if not row:
+                return {'name': BREAKER_NAME, 'state': 'closed'}
+            
+            status = dict(row)
+            status['opened_at'] = row['opened_at'].isoformat() if row['opened_at'] else None
+            return status
+    finally:
+        conn.close()
+
+def guarded_call(dsn: str, func, *args):
+    """
+    Business: Выполнить вызов GigaChat через общий circuit breaker
+    Args: dsn - подключение к БД, func - функция вызова API, args - ее аргументы
+    Returns: результат func или CircuitOpenError, если breaker открыт
+    """
+    if dsn and not breaker_allow(dsn):
+        raise CircuitOpenError('GigaChat circuit breaker is open')
+    
+    try:
+        inject_fault()
+        result = func(*args)
+    except Exception as e:
+        if dsn:
+            breaker_record(False, str(e)[:500], dsn)
+        raise
+    
+    if dsn:
+        breaker_record(True, None, dsn)
+    return result
+
+def get_entitlements(cur, user_id: str) -> Dict[str, Any]:
+    """
+    Business: Права пользователя из user_entitlements с коротким кэшем в памяти экземпляра
+    Args: cur - курсор БД (RealDictCursor), user_id - ID пользователя
+    Returns: dict с tier, daily_limit, max_proposals, expires_at
+    """
+    key = str(user_id)
+    cached = _entitlements_cache.get(key)
+    if cached and cached[0] > time.time():
+        return cached[1]
+    
+    schema = 't_p53065890_farmer_landing_proje'
+    cur.execute(f'''
+        SELECT tier, daily_limit, max_proposals, expires_at
+        FROM {schema}.user_entitlements WHERE user_id = %s
+    ''', (key,))
+    row = cur.fetchone()
+    entitlements = dict(row) if row else {'tier': 'free', 'daily_limit': 3, 'max_proposals': 1, 'expires_at': None}
+    
+    if len(_entitlements_cache) >= ENTITLEMENTS_CACHE_SIZE:
+        _entitlements_cache.clear()
+    _entitlements_cache[key] = (time.time() + ENTITLEMENTS_TTL_SECONDS, entitlements)
+    return entitlements
+
 def check_usage_limit(user_id: str, dsn: str) -> Dict[str, Any]:
     """
     Business: Перевірка ліміту запитів користувача на поточний день
@@ -78,21 +267,10 @@ def check_usage_limit(user_id: str, dsn: str) -> Dict[str, Any]:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             today = date.today()
             
-            # Отримуємо підписку користувача
-            cur.execute(f'''
-                SELECT tier FROM {schema}.user_subscriptions 
-                WHERE user_id = %s
-            ''', (str(user_id),))
-            sub = cur.fetchone()
-            tier = sub['tier'] if sub else 'free'
-            
-            # Отримуємо ліміт для тарифу
-            cur.execute(f'''
-                SELECT daily_limit FROM {schema}.subscription_plans 
-                WHERE tier = %s
-            ''', (tier,))
-            plan = cur.fetchone()
-            daily_limit = plan['daily_limit'] if plan else 3
+            # Тариф і денний ліміт - з матеріалізованих прав (кеш у пам'яті)
+            entitlements = get_entitlements(cur, user_id)
+            tier = entitlements['tier']
+            daily_limit = entitlements['daily_limit']
             
             # Отримуємо кількість запитів сьогодні
             cur.execute(f'''
@@ -159,10 +337,112 @@ def increment_usage(user_id: str, dsn: str) -> None:
     finally:
         conn.close()
 
+def estimate_tokens(text: str) -> int:
+    """
+    Business: Грубая оценка числа токенов сообщения (для кириллицы ~3 символа на токен)
+    Args: text - текст сообщения
+    Returns: оценка числа токенов с учетом служебной разметки роли
+    """
+    return len(text or '') // 3 + 4
+
+def trim_history(system_prompt: Dict[str, str], history: List[Dict[str, str]], budget: int) -> List[Dict[str, str]]:
+    """
+    Business: Обрезать историю диалога под бюджет токенов - системный промпт сохраняется, старые реплики отбрасываются
+    Args: system_prompt - системное сообщение, history - сообщения от старых к новым, budget - лимит токенов
+    Returns: список сообщений для отправки в GigaChat (последнее сообщение пользователя сохраняется всегда)
+    """
+    used = estimate_tokens(system_prompt['content'])
+    kept: List[Dict[str, str]] = []
+    
+    for msg in reversed(history):
+        cost = estimate_tokens(msg.get('content', ''))
+        if kept and used + cost > budget:
+            break
+        kept.append({'role': msg.get('role', 'user'), 'content': msg.get('content', '')})
+        used += cost
+    
+    kept.reverse()
+    
+    # Диалог должен начинаться с реплики пользователя
+    while len(kept) > 1 and kept[0]['role'] != 'user':
+        kept.pop(0)
+    
+    return [system_prompt] + kept
+
+def load_conversation(conversation_id: str, user_id: str, dsn: str) -> Optional[List[Dict[str, str]]]:
+    """
+    Business: Загрузить хвост истории диалога пользователя из БД
+    Args: conversation_id - ID диалога, user_id - ID пользователя, dsn - подключение к БД
+    Returns: сообщения от старых к новым или None, если диалог не найден у пользователя
+    """
+    schema = 't_p53065890_farmer_landing_proje'
+    conn = psycopg2.connect(dsn)
+    
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f'''
+                SELECT id FROM {schema}.gigachat_conversations
+                WHERE id = %s AND user_id = %s
+            ''', (conversation_id, str(user_id)))
+            if not cur.fetchone():
+                return None
+            
+            cur.execute(f'''
+                SELECT role, content FROM {schema}.gigachat_messages
+                WHERE conversation_id = %s
+                ORDER BY id DESC
+                LIMIT %s
+            ''', (conversation_id, HISTORY_FETCH_LIMIT))
+            rows = cur.fetchall()
+            
+            return [{'role': r['role'], 'content': r['content']} for r in reversed(rows)]
+    finally:
+        conn.close()
+
+def save_turn(conversation_id: str, user_id: str, user_content: str, assistant_content: str, dsn: str) -> bool:
+    """
+    Business: Сохранить реплику пользователя и ответ GigaChat в диалог (диалог создается при первом ходе)
+    Args: conversation_id - ID диалога, user_id - ID пользователя, user_content/assistant_content - тексты, dsn - подключение к БД
+    Returns: True, если ход сохранен (только тогда conversation_id можно отдавать клиенту)
+    """
+    schema = 't_p53065890_farmer_landing_proje'
+    try:
+        conn = psycopg2.connect(dsn)
+    except Exception as e:
+        print(f"Error saving conversation turn: {e}")
+        return False
+    
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'''
+                INSERT INTO {schema}.gigachat_conversations (id, user_id, message_count)
+                VALUES (%s, %s, 2)
+                ON CONFLICT (id) DO UPDATE SET
+                    message_count = {schema}.gigachat_conversations.message_count + 2,
+                    updated_at = CURRENT_TIMESTAMP
+            ''', (conversation_id, str(user_id)))
+            
+            cur.execute(f'''
+                INSERT INTO {schema}.gigachat_messages (conversation_id, role, content, token_estimate)
+                VALUES (%s, 'user', %s, %s), (%s, 'assistant', %s, %s)
+            ''', (
+                conversation_id, user_content, estimate_tokens(user_content),
+                conversation_id, assistant_content, estimate_tokens(assistant_content)
+            ))
+            
+            conn.commit()
+        return True
+    except Exception as e:
+        print(f"Error saving conversation turn: {e}")
+        return False
+    finally:
+        conn.close()
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Business: API endpoint для чата с GigaChat - получает сообщения пользователя и возвращает ответы ИИ с учетом лимитов по тарифам
-    Args: event - dict с httpMethod, body (messages: история чата), headers (X-User-Id)
+    Args: event - dict с httpMethod, body (message + conversation_id: новое сообщение диалога,
+          либо messages: полная история чата), headers (X-User-Id)
           context - объект с request_id, function_name и другими атрибутами
     Returns: HTTP response с ответом от GigaChat или ошибкой превышения лимита
     """
@@ -174,7 +454,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Admin-Secret',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -203,6 +483,23 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'Database not configured'})
             }
         
+        params = event.get('queryStringParameters') or {}
+        if params.get('action') == 'breaker_status' and DB_AVAILABLE:
+            # Состояние breaker содержит текст ошибок внешнего API - только для администратора
+            headers = event.get('headers', {})
+            admin_secret = headers.get('x-admin-secret') or headers.get('X-Admin-Secret')
+            if admin_secret != ADMIN_SECRET:
+                return {
+                    'statusCode': 403,
+                    'headers': headers_resp,
+                    'body': json.dumps({'error': 'Access denied'})
+                }
+            return {
+                'statusCode': 200,
+                'headers': headers_resp,
+                'body': json.dumps(breaker_status(dsn))
+            }
+        
         usage_info = check_usage_limit(user_id, dsn)
         return {
             'statusCode': 200,
@@ -249,14 +546,50 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'GIGACHAT_API_KEY not configured'})
         }
     
-    body_data = json.loads(event.get('body', '{}'))
+    body_data = json.loads(event.get('body') or '{}')
     messages = body_data.get('messages', [])
+    new_message = (body_data.get('message') or '').strip()
+    conversation_id = body_data.get('conversation_id')
+    # Диалог уже существует в БД только если его ID прислал клиент (новый создается в save_turn)
+    conversation_exists = bool(conversation_id)
+    
+    # Новый протокол: клиент шлет только новое сообщение, история хранится на сервере
+    if new_message:
+        if not dsn or not DB_AVAILABLE:
+            return {
+                'statusCode': 500,
+                'headers': headers_resp,
+                'body': json.dumps({'error': 'Database not configured'})
+            }
+        
+        if conversation_id:
+            try:
+                conversation_id = str(uuid.UUID(str(conversation_id)))
+            except ValueError:
+                return {
+                    'statusCode': 400,
+                    'headers': headers_resp,
+                    'body': json.dumps({'error': 'Invalid conversation_id'})
+                }
+            
+            history = load_conversation(conversation_id, user_id, dsn)
+            if history is None:
+                return {
+                    'statusCode': 404,
+                    'headers': headers_resp,
+                    'body': json.dumps({'error': 'Conversation not found'})
+                }
+        else:
+            conversation_id = str(uuid.uuid4())
+            history = []
+        
+        messages = history + [{'role': 'user', 'content': new_message}]
     
     if not messages:
         return {
             'statusCode': 400,
             'headers': headers_resp,
-            'body': json.dumps({'error': 'Messages array is required'})
+            'body': json.dumps({'error': 'Message or messages array is required'})
         }
     
     farm_context = ''
@@ -366,11 +699,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         'content': f'Ты - опытный агроном и консультант по сельскому хозяйству. Помогай фермерам с вопросами по растениеводству, животноводству, экономике хозяйства. Давай конкретные практические советы с расчетами. Отвечай кратко и по делу на русском языке.{farm_context}'
     }
     
-    full_messages = [system_prompt] + messages
+    full_messages = trim_history(system_prompt, messages, HISTORY_TOKEN_BUDGET)
     
     try:
-        access_token = get_gigachat_token(api_key)
-        response_text = chat_with_gigachat(access_token, full_messages)
+        response_text = guarded_call(
+            dsn if DB_AVAILABLE else '',
+            lambda: chat_with_gigachat(get_gigachat_token(api_key), full_messages)
+        )
+        
+        # Несохраненный диалог не отдаем клиенту: следующее сообщение получило бы 404 и чат бы завис
+        saved = bool(new_message) and save_turn(conversation_id, user_id, new_message, response_text, dsn)
         
         # Збільшуємо лічильник успішних запитів
         if dsn:
@@ -385,10 +723,25 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False,
             'body': json.dumps({
                 'response': response_text,
+                'conversation_id': conversation_id if saved else None,
                 'request_id': context.request_id,
                 'usage': usage_info
             })
         }
+    except CircuitOpenError:
+        # Деградированный режим: быстрый ответ без обращения к API, лимит не списывается.
+        # Ход не сохраняется, поэтому ID нового (еще не созданного) диалога клиенту не отдаем
+        return {
+            'statusCode': 200,
+            'headers': headers_resp,
+            'isBase64Encoded': False,
+            'body': json.dumps({
+                'response': 'ИИ-консультант временно недоступен из-за перегрузки сервиса. Пожалуйста, повторите вопрос через минуту - этот запрос не учтен в дневном лимите.',
+                'degraded': True,
+                'conversation_id': conversation_id if new_message and conversation_exists else None,
+                'request_id': context.request_id
+            })
+        }
     except Exception as e:
         return {
             'statusCode': 500,
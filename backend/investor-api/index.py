@@ -1,7 +1,130 @@
 import json
 import os
+import hashlib
 import psycopg2
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+from datetime import date
+
+ACTIVITY_SHARD_BITS = 8192
+IDEMPOTENT_ACTIONS = ('invest', 'invest_virtual', 'create_request')
+IDEMPOTENCY_KEY_MAX_LENGTH = 128
+SHARE_RESERVATION_TTL_HOURS = int(os.environ.get('SHARE_RESERVATION_TTL_HOURS', '72'))
+
+# Уже отмеченные за сегодня пользователи в этом экземпляре функции: повторные запросы не пишут в БД
+_activity_seen: Dict[str, Any] = {'day': None, 'users': set()}
+
+def record_activity(conn, user_id: Any) -> None:
+    '''
+    Business: Отметить активность пользователя за день битом в дневной битовой карте (не строкой на запрос)
+    Args: conn - соединение с БД, user_id - ID пользователя
+    Returns: None
+    '''
+    try:
+        uid = int(user_id)
+    except (TypeError, ValueError):
+        return
+    
+    today = date.today()
+    if _activity_seen['day'] != today:
+        _activity_seen['day'] = today
+        _activity_seen['users'] = set()
+    if uid in _activity_seen['users']:
+        return
+    
+    schema = 't_p53065890_farmer_landing_proje'
+    shard, bit = divmod(uid, ACTIVITY_SHARD_BITS)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                INSERT INTO {schema}.user_activity_bitmaps (day, shard, bitmap)
+                VALUES (%s, %s, set_bit(decode(repeat('00', %s), 'hex'), %s, 1))
+                ON CONFLICT (day, shard) DO UPDATE
+                SET bitmap = set_bit(user_activity_bitmaps.bitmap, %s, 1)
+                WHERE get_bit(user_activity_bitmaps.bitmap, %s) = 0
+            """, (today, shard, ACTIVITY_SHARD_BITS // 8, bit, bit, bit))
+        conn.commit()
+        _activity_seen['users'].add(uid)
+    except Exception as e:
+        conn.rollback()
+        print(f"Activity tracking failed: {e}")
+
+def begin_idempotent_request(cur, user_id: Any, key: Optional[str], action: str, body_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    '''
+    Business: Занять ключ идемпотентности в текущей транзакции или вернуть сохраненный ответ повтора
+    Args: cur - курсор БД, user_id - ID пользователя, key - заголовок Idempotency-Key (None - без идемпотентности),
+          action - действие, body_data - тело запроса
+    Returns: HTTP response для повтора или None, если запрос нужно выполнить
+    '''
+    if not key:
+        return None
+    
+    schema = 't_p53065890_farmer_landing_proje'
+    request_hash = hashlib.sha256(json.dumps(body_data, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+    
+    select_stored = (
+        f"""SELECT action, request_hash, status_code, response FROM {schema}.idempotency_keys
+           WHERE user_id = %s AND idempotency_key = %s"""
+    )
+    
+    # Повтор: один поиск по первичному ключу
+    cur.execute(select_stored, (int(user_id), key))
+    stored = cur.fetchone()
+    
+    if not stored:
+        # Вставка ждет параллельный запрос с тем же ключом до его COMMIT/ROLLBACK
+        cur.execute(
+            f"""INSERT INTO {schema}.idempotency_keys (user_id, idempotency_key, action, request_hash)
+               VALUES (%s, %s, %s, %s)
+               ON CONFLICT (user_id, idempotency_key) DO NOTHING
+               RETURNING 1""",
+            (int(user_id), key, action, request_hash)
+        )
+        if cur.fetchone():
+            return None
+        cur.execute(select_stored, (int(user_id), key))
+        stored = cur.fetchone()
+    
+    cur.connection.rollback()
+    
+    if stored[0] != action or stored[1] != request_hash:
+        return {
+            'statusCode': 422,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Idempotency-Key уже использован для другого запроса'})
+        }
+    
+    if stored[2] is None:
+        return {
+            'statusCode': 409,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Запрос с этим Idempotency-Key еще выполняется'})
+        }
+    
+    return {
+        'statusCode': stored[2],
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Idempotent-Replayed': 'true'
+        },
+        'body': json.dumps(stored[3])
+    }
+
+def save_idempotent_response(cur, user_id: Any, key: Optional[str], status_code: int, body: Dict[str, Any]) -> None:
+    '''
+    Business: Сохранить ответ под ключом идемпотентности (до COMMIT основной записи)
+    Args: cur - курсор БД, user_id - ID пользователя, key - Idempotency-Key, status_code - HTTP статус, body - тело ответа
+    Returns: None
+    '''
+    if not key:
+        return
+    
+    schema = 't_p53065890_farmer_landing_proje'
+    cur.execute(
+        f"""UPDATE {schema}.idempotency_keys SET status_code = %s, response = %s::jsonb
+           WHERE user_id = %s AND idempotency_key = %s""",
+        (status_code, json.dumps(body), int(user_id), key)
+    )
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
@@ -18,7 +141,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, Idempotency-Key',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -44,6 +167,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     conn = psycopg2.connect(db_url)
     cur = conn.cursor()
+    record_activity(conn, user_id)
     
     try:
         if method == 'GET':
@@ -458,6 +582,18 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         elif method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
             action = body_data.get('action')
+
+            # Повторы POST с тем же Idempotency-Key возвращают первый ответ без повторной записи
+            idempotency_key = (headers.get('Idempotency-Key') or headers.get('idempotency-key')) if action in IDEMPOTENT_ACTIONS else None
+            if idempotency_key and len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Слишком длинный Idempotency-Key'})
+                }
+            replay = begin_idempotent_request(cur, user_id, idempotency_key, action, body_data)
+            if replay:
+                return replay
             
             if action == 'create_request':
                 schema = 't_p53065890_farmer_landing_proje'
@@ -472,42 +608,34 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'Некорректные данные'})
                     }
                 
+                # Резерв долей и заявка одним оператором: конкурирующие заявки не перепродают доли
                 cur.execute(
-                    f"""SELECT share_price, available_shares, farmer_id 
-                       FROM {schema}.investment_offers 
-                       WHERE id = %s AND status = 'published'""",
-                    (offer_id,)
+                    f"""SELECT request_id, farmer_id, reserved_until FROM {schema}.reserve_offer_shares(
+                           %s, %s, %s, %s, INTERVAL '1 hour' * %s)""",
+                    (offer_id, user_id, shares_requested, message, SHARE_RESERVATION_TTL_HOURS)
                 )
-                offer = cur.fetchone()
-                
-                if not offer:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Предложение не найдено'})
-                    }
-                
-                share_price = float(offer[0])
-                available_shares = offer[1]
-                farmer_id = offer[2]
-                
-                if shares_requested > available_shares:
+                reservation = cur.fetchone()
+                
+                if not reservation:
+                    conn.rollback()
+                    cur.execute(
+                        f"""SELECT 1 FROM {schema}.investment_offers 
+                           WHERE id = %s AND status = 'published'""",
+                        (offer_id,)
+                    )
+                    if not cur.fetchone():
+                        return {
+                            'statusCode': 404,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'error': 'Предложение не найдено'})
+                        }
                     return {
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                         'body': json.dumps({'error': 'Запрошено больше долей, чем доступно'})
                     }
                 
-                amount = share_price * shares_requested
-                
-                cur.execute(
-                    f"""INSERT INTO {schema}.investment_requests 
-                       (offer_id, investor_id, shares_requested, amount, message, status)
-                       VALUES (%s, %s, %s, %s, %s, 'pending')
-                       RETURNING id""",
-                    (offer_id, user_id, shares_requested, amount, message)
-                )
-                request_id = cur.fetchone()[0]
+                request_id, farmer_id, reserved_until = reservation
                 
                 cur.execute(
                     f"""INSERT INTO {schema}.notifications (user_id, role, type, payload)
@@ -518,12 +646,18 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                      json.dumps({'request_id': request_id, 'offer_id': offer_id, 'investor_id': int(user_id)}))
                 )
                 
+                response_body = {
+                    'id': request_id,
+                    'status': 'pending',
+                    'reserved_until': reserved_until.isoformat() if reserved_until else None
+                }
+                save_idempotent_response(cur, user_id, idempotency_key, 200, response_body)
                 conn.commit()
                 
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'id': request_id, 'status': 'pending'})
+                    'body': json.dumps(response_body)
                 }
             
             elif action == 'invest':
@@ -568,12 +702,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                      json.dumps({'investment_id': investment_id, 'proposal_id': proposal_id, 'investor_id': int(user_id), 'shares': shares}))
                 )
                 
+                response_body = {'success': True, 'investment_id': investment_id}
+                save_idempotent_response(cur, user_id, idempotency_key, 200, response_body)
                 conn.commit()
                 
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'investment_id': investment_id})
+                    'body': json.dumps(response_body)
                 }
             
             elif action == 'cancel_investment':
@@ -637,10 +773,12 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'Требуется confirmation_id'})
                     }
                 
+                # Блокировка подтверждения: повторный параллельный запрос не увеличит счетчик дважды
                 cur.execute(
                     f"""SELECT dc.deletion_request_id, dc.investor_id, dc.confirmed
                        FROM {schema}.deletion_confirmations dc
-                       WHERE dc.id = %s""",
+                       WHERE dc.id = %s
+                       FOR UPDATE""",
                     (confirmation_id,)
                 )
                 conf = cur.fetchone()
@@ -684,25 +822,51 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 )
                 dr_result = cur.fetchone()
                 
-                conn.commit()
+                if not dr_result:
+                    conn.rollback()
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Запрос на удаление не найден'})
+                    }
                 
                 total = dr_result[0]
                 confirmed = dr_result[1]
                 proposal_id = dr_result[2]
                 farmer_id = dr_result[3]
                 
+                # Последнее подтверждение: удаляем предложение в той же транзакции (без вызова farmer-api по HTTP)
                 if confirmed >= total:
-                    try:
-                        import requests
-                        farmer_api_url = 'https://functions.poehali.dev/1cab85a8-6eaf-4ad6-8bd1-acb7105af88e'
-                        requests.post(
-                            farmer_api_url,
-                            json={'action': 'delete_proposal', 'proposal_id': proposal_id},
-                            headers={'X-User-Id': str(farmer_id), 'Content-Type': 'application/json'},
-                            timeout=10
-                        )
-                    except:
-                        pass
+                    # investments.proposal_id ссылается на proposals без каскада: инвестиции удаляются до предложения,
+                    # иначе внешний ключ откатит транзакцию вместе с подтверждением инвестора
+                    cur.execute(
+                        f"""DELETE FROM {schema}.investments WHERE proposal_id = %s""",
+                        (proposal_id,)
+                    )
+                    
+                    cur.execute(
+                        f"""WITH removed_requests AS (
+                               DELETE FROM {schema}.deletion_requests WHERE proposal_id = %s
+                               RETURNING id
+                           )
+                           DELETE FROM {schema}.deletion_confirmations
+                           WHERE deletion_request_id IN (SELECT id FROM removed_requests)""",
+                        (proposal_id,)
+                    )
+                    
+                    cur.execute(
+                        f"""DELETE FROM {schema}.proposals 
+                           WHERE id = %s AND user_id = %s""",
+                        (proposal_id, farmer_id)
+                    )
+                    
+                    cur.execute(
+                        f"""INSERT INTO {schema}.notifications (user_id, role, type, payload)
+                           VALUES (%s, 'farmer', 'proposal_deleted', %s::jsonb)""",
+                        (farmer_id, json.dumps({'proposal_id': proposal_id, 'deletion_request_id': deletion_request_id}))
+                    )
+                
+                conn.commit()
                 
                 return {
                     'statusCode': 200,
@@ -748,18 +912,20 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     (user_id, proposal_id, amount)
                 )
                 investment_id = cur.fetchone()[0]
-                conn.commit()
                 
                 simulation = expected_product or 'Урожай для здоровья'
+                response_body = {
+                    'success': True,
+                    'investment_id': investment_id,
+                    'simulation': simulation
+                }
+                save_idempotent_response(cur, user_id, idempotency_key, 200, response_body)
+                conn.commit()
                 
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'investment_id': investment_id,
-                        'simulation': simulation
-                    })
+                    'body': json.dumps(response_body)
                 }
             
             elif action == 'update_profile':
@@ -0,0 +1,314 @@
+import json
+import os
+import time
+import select
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor
+from typing import Dict, Any, List, Optional
+
+PAGE_SIZE_DEFAULT = 20
+PAGE_SIZE_MAX = 100
+MARK_READ_MAX_IDS = 1000
+RETENTION_READ_DAYS = int(os.environ.get('NOTIFICATIONS_RETENTION_READ_DAYS', '90'))
+RETENTION_UNREAD_DAYS = int(os.environ.get('NOTIFICATIONS_RETENTION_UNREAD_DAYS', '365'))
+CLEANUP_BATCH_SIZE = int(os.environ.get('NOTIFICATIONS_CLEANUP_BATCH_SIZE', '5000'))
+CLEANUP_TIME_BUDGET_SECONDS = int(os.environ.get('NOTIFICATIONS_CLEANUP_TIME_BUDGET', '20'))
+POLL_WAIT_MAX_SECONDS = int(os.environ.get('NOTIFICATIONS_POLL_WAIT_MAX', '25'))
+SSE_RETRY_MS = 1000
+
+def json_response(status: int, body: Dict[str, Any]) -> Dict[str, Any]:
+    '''JSON-ответ с CORS-заголовком'''
+    return {
+        'statusCode': status,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'isBase64Encoded': False,
+        'body': json.dumps(body, default=str)
+    }
+
+def list_notifications(cur, user_id: int, cursor: Optional[int], limit: int, unread_only: bool) -> Dict[str, Any]:
+    '''
+    Business: Страница уведомлений по курсору (id последнего полученного), без OFFSET
+    Args: cur - курсор БД, user_id - ID пользователя, cursor - id, с которого продолжить,
+          limit - размер страницы, unread_only - только непрочитанные
+    Returns: dict с items и next_cursor (None - страниц больше нет)
+    '''
+    schema = 't_p53065890_farmer_landing_proje'
+    conditions = ['user_id = %s']
+    params: List[Any] = [user_id]
+    if cursor:
+        conditions.append('id < %s')
+        params.append(cursor)
+    if unread_only:
+        conditions.append('is_read = FALSE')
+    
+    # Берем на одну строку больше, чтобы понять, есть ли следующая страница
+    cur.execute(f"""
+        SELECT id, role, type, payload, is_read, created_at
+        FROM {schema}.notifications
+        WHERE {' AND '.join(conditions)}
+        ORDER BY id DESC
+        LIMIT %s
+    """, (*params, limit + 1))
+    rows = cur.fetchall()
+    
+    items = [dict(r) for r in rows[:limit]]
+    next_cursor = items[-1]['id'] if len(rows) > limit else None
+    return {'items': items, 'next_cursor': next_cursor}
+
+def count_unread(cur, user_id: int) -> int:
+    '''
+    Business: Число непрочитанных уведомлений (index-only scan по частичному индексу)
+    Args: cur - курсор БД, user_id - ID пользователя
+    Returns: количество непрочитанных
+    '''
+    schema = 't_p53065890_farmer_landing_proje'
+    cur.execute(f"""
+        SELECT COUNT(*) AS unread FROM {schema}.notifications
+        WHERE user_id = %s AND is_read = FALSE
+    """, (user_id,))
+    return cur.fetchone()['unread']
+
+def mark_read(cur, user_id: int, ids: List[int], up_to_id: Optional[int]) -> int:
+    '''
+    Business: Отметить прочитанными список уведомлений или все до up_to_id одним запросом
+    Args: cur - курсор БД, user_id - ID пользователя, ids - ID уведомлений,
+          up_to_id - отметить все непрочитанные с id <= up_to_id
+    Returns: число отмеченных уведомлений
+    '''
+    schema = 't_p53065890_farmer_landing_proje'
+    if up_to_id is not None:
+        cur.execute(f"""
+            UPDATE {schema}.notifications SET is_read = TRUE
+            WHERE user_id = %s AND is_read = FALSE AND id <= %s
+        """, (user_id, up_to_id))
+    else:
+        cur.execute(f"""
+            UPDATE {schema}.notifications SET is_read = TRUE
+            WHERE user_id = %s AND is_read = FALSE AND id = ANY(%s)
+        """, (user_id, ids))
+    return cur.rowcount
+
+def fetch_since(cur, user_id: int, since_id: int) -> List[Dict[str, Any]]:
+    '''
+    Business: Уведомления пользователя новее курсора в порядке появления
+    Args: cur - курсор БД, user_id - ID пользователя, since_id - id последнего полученного уведомления
+    Returns: список уведомлений (не более PAGE_SIZE_MAX)
+    '''
+    schema = 't_p53065890_farmer_landing_proje'
+    cur.execute(f"""
+        SELECT id, role, type, payload, is_read, created_at
+        FROM {schema}.notifications
+        WHERE user_id = %s AND id > %s
+        ORDER BY id
+        LIMIT %s
+    """, (user_id, since_id, PAGE_SIZE_MAX))
+    return [dict(r) for r in cur.fetchall()]
+
+def wait_for_notifications(db_url: str, user_id: int, since_id: Optional[int], wait_seconds: int) -> Dict[str, Any]:
+    '''
+    Business: Long-poll - вернуть новые уведомления сразу или дождаться pg_notify в канале пользователя
+    Args: db_url - строка подключения, user_id - ID пользователя, since_id - курсор (None - только текущий курсор),
+          wait_seconds - максимальное ожидание
+    Returns: dict с items, cursor (id последнего уведомления) и unread
+    '''
+    schema = 't_p53065890_farmer_landing_proje'
+    conn = psycopg2.connect(db_url)
+    conn.autocommit = True
+    
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            if since_id is None:
+                cur.execute(f"""
+                    SELECT COALESCE(MAX(id), 0) AS cursor FROM {schema}.notifications WHERE user_id = %s
+                """, (user_id,))
+                return {'items': [], 'cursor': cur.fetchone()['cursor'], 'unread': count_unread(cur, user_id)}
+            
+            # LISTEN до чтения: уведомление, закоммиченное между запросом и ожиданием, не потеряется
+            cur.execute(sql.SQL('LISTEN {}').format(sql.Identifier(f'notifications_user_{user_id}')))
+            items = fetch_since(cur, user_id, since_id)
+            deadline = time.time() + wait_seconds
+            
+            while not items:
+                remaining = deadline - time.time()
+                if remaining <= 0 or select.select([conn], [], [], remaining) == ([], [], []):
+                    break
+                conn.poll()
+                if conn.notifies:
+                    conn.notifies.clear()
+                    items = fetch_since(cur, user_id, since_id)
+            
+            return {
+                'items': items,
+                'cursor': items[-1]['id'] if items else since_id,
+                'unread': count_unread(cur, user_id)
+            }
+    finally:
+        conn.close()
+
+def sse_body(result: Dict[str, Any]) -> str:
+    '''
+    Business: Ответ long-poll в формате text/event-stream: EventSource переподключается сам и присылает
+              Last-Event-ID, поэтому курсор передается в поле id
+    Args: result - результат wait_for_notifications
+    Returns: тело ответа SSE
+    '''
+    lines = [f'retry: {SSE_RETRY_MS}', '']
+    for item in result['items']:
+        lines += [f"id: {item['id']}", 'event: notification', f'data: {json.dumps(item, default=str)}', '']
+    lines += [f"id: {result['cursor']}", 'event: unread', f"data: {json.dumps({'unread': result['unread']})}", '']
+    return '\n'.join(lines) + '\n'
+
+def cleanup_notifications(conn) -> Dict[str, int]:
+    '''
+    Business: Удалить уведомления старше срока хранения батчами (коммит на батч) в пределах бюджета времени
+    Args: conn - соединение с БД
+    Returns: dict с числом удаленных прочитанных и непрочитанных
+    '''
+    schema = 't_p53065890_farmer_landing_proje'
+    stats = {'read_deleted': 0, 'unread_deleted': 0, 'batches': 0}
+    passes = [
+        ('read_deleted', 'is_read = TRUE', RETENTION_READ_DAYS),
+        ('unread_deleted', 'is_read = FALSE', RETENTION_UNREAD_DAYS)
+    ]
+    deadline = time.time() + CLEANUP_TIME_BUDGET_SECONDS
+    
+    with conn.cursor() as cur:
+        for name, condition, days in passes:
+            while time.time() < deadline:
+                cur.execute(f"""
+                    DELETE FROM {schema}.notifications
+                    WHERE id IN (
+                        SELECT id FROM {schema}.notifications
+                        WHERE created_at < NOW() - INTERVAL '1 day' * %s AND {condition}
+                        ORDER BY created_at
+                        LIMIT %s
+                    )
+                """, (days, CLEANUP_BATCH_SIZE))
+                deleted = cur.rowcount
+                conn.commit()
+                stats[name] += deleted
+                stats['batches'] += 1
+                if deleted < CLEANUP_BATCH_SIZE:
+                    break
+    
+    return stats
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Входящие уведомления пользователя (лента по курсору, счетчик непрочитанных, отметка прочитанными)
+    Args: event - dict с httpMethod, queryStringParameters (action=list|unread_count|poll, cursor, limit, unread=1,
+          since, wait - long-poll до появления новых уведомлений),
+          body (action=mark_read, ids или up_to_id), headers (X-User-Id);
+          POST ?action=cleanup - удаление уведомлений старше срока хранения (таймер)
+          context - объект с request_id
+    Returns: HTTP response с уведомлениями или ошибкой
+    '''
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, Last-Event-ID',
+                'Access-Control-Max-Age': '86400'
+            },
+            'isBase64Encoded': False,
+            'body': ''
+        }
+    
+    if method not in ('GET', 'POST'):
+        return json_response(405, {'error': 'Метод не поддерживается'})
+    
+    db_url = os.environ.get('DATABASE_URL')
+    if not db_url:
+        return json_response(500, {'error': 'DATABASE_URL не настроен'})
+    
+    params = event.get('queryStringParameters') or {}
+    
+    # POST ?action=cleanup - batch-задача (таймер): срок хранения вместо бесконечного роста таблицы
+    if method == 'POST' and params.get('action') == 'cleanup':
+        conn = psycopg2.connect(db_url)
+        try:
+            stats = cleanup_notifications(conn)
+        finally:
+            conn.close()
+        return json_response(200, {'success': True, **stats})
+    
+    headers = event.get('headers') or {}
+    user_id = headers.get('X-User-Id') or headers.get('x-user-id')
+    if not user_id or not str(user_id).isdigit():
+        return json_response(401, {'error': 'Требуется авторизация'})
+    user_id = int(user_id)
+    
+    try:
+        if method == 'GET':
+            action = params.get('action', 'list')
+            cursor = params.get('cursor')
+            limit = params.get('limit')
+            if (cursor and not cursor.isdigit()) or (limit and not limit.isdigit()):
+                return json_response(400, {'error': 'cursor и limit должны быть числами'})
+            if action not in ('list', 'unread_count', 'poll'):
+                return json_response(400, {'error': 'Неизвестное действие'})
+        else:
+            body_data = json.loads(event.get('body') or '{}')
+            ids = body_data.get('ids') or []
+            up_to_id = body_data.get('up_to_id')
+            if body_data.get('action') != 'mark_read':
+                return json_response(400, {'error': 'Неизвестное действие'})
+            if up_to_id is None and not ids:
+                return json_response(400, {'error': 'Требуется ids или up_to_id'})
+            if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids) or len(ids) > MARK_READ_MAX_IDS:
+                return json_response(400, {'error': f'ids - список чисел (не более {MARK_READ_MAX_IDS})'})
+            if up_to_id is not None and not isinstance(up_to_id, int):
+                return json_response(400, {'error': 'up_to_id должен быть числом'})
+    except json.JSONDecodeError:
+        return json_response(400, {'error': 'Некорректный JSON'})
+    
+    # GET ?action=poll&since=<id>&wait=N - long-poll; с Accept: text/event-stream - ответ в формате SSE
+    if method == 'GET' and action == 'poll':
+        last_event_id = headers.get('Last-Event-ID') or headers.get('last-event-id')
+        since = params.get('since') or last_event_id
+        wait = params.get('wait')
+        if (since and not since.isdigit()) or (wait and not wait.isdigit()):
+            return json_response(400, {'error': 'since и wait должны быть числами'})
+        
+        wait_seconds = min(int(wait) if wait else POLL_WAIT_MAX_SECONDS, POLL_WAIT_MAX_SECONDS)
+        result = wait_for_notifications(db_url, user_id, int(since) if since else None, wait_seconds)
+        
+        accept = headers.get('Accept') or headers.get('accept') or ''
+        if 'text/event-stream' in accept or params.get('format') == 'sse':
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'text/event-stream',
+                    'Cache-Control': 'no-cache',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'isBase64Encoded': False,
+                'body': sse_body(result)
+            }
+        return json_response(200, result)
+    
+    conn = psycopg2.connect(db_url)
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            if method == 'GET' and action == 'unread_count':
+                return json_response(200, {'unread': count_unread(cur, user_id)})
+            
+            if method == 'GET':
+                page_size = min(max(int(limit or PAGE_SIZE_DEFAULT), 1), PAGE_SIZE_MAX)
+                page = list_notifications(cur, user_id, int(cursor) if cursor else None, page_size, params.get('unread') == '1')
+                page['unread'] = count_unread(cur, user_id)
+                return json_response(200, page)
+            
+            marked = mark_read(cur, user_id, ids, up_to_id)
+            conn.commit()
+            return json_response(200, {'success': True, 'marked': marked, 'unread': count_unread(cur, user_id)})
+    except Exception as e:
+        conn.rollback()
+        return json_response(500, {'error': str(e)})
+    finally:
+        conn.close()
@@ -107,21 +107,14 @@ def create_or_login_oauth_user(db_url: str, jwt_secret: str, provider: str, prov
     conn = psycopg2.connect(db_url)
     cur = conn.cursor()
     
+    schema = 't_p53065890_farmer_landing_proje'
+    
     cur.execute(
-        "SELECT id, email, name, role FROM users WHERE oauth_provider = %s AND oauth_provider_id = %s",
-        (provider, provider_id)
+        f"SELECT id, email, name, role FROM {schema}.upsert_oauth_user(p_provider => %s, p_provider_id => %s, p_email => %s, p_name => %s)",
+        (provider, str(provider_id), email, name)
     )
-    user = cur.fetchone()
-    
-    if user:
-        user_id, email, name, role = user
-    else:
-        cur.execute(
-            "INSERT INTO users (email, name, password_hash, role, oauth_provider, oauth_provider_id, created_at) VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id, role",
-            (email, name, '', 'farmer', provider, provider_id, datetime.now())
-        )
-        user_id, role = cur.fetchone()
-        conn.commit()
+    user_id, email, name, role = cur.fetchone()
+    conn.commit()
     
     cur.close()
     conn.close()
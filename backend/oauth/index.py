@@ -2,11 +2,102 @@ import json
 import os
 import psycopg2
 import jwt
+import time
 import requests
 from datetime import datetime, timedelta
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from urllib.parse import urlencode
 
+OAUTH_CONNECT_TIMEOUT = float(os.environ.get('OAUTH_CONNECT_TIMEOUT', '3'))
+OAUTH_READ_TIMEOUT = float(os.environ.get('OAUTH_READ_TIMEOUT', '5'))
+OAUTH_HTTP_RETRIES = int(os.environ.get('OAUTH_HTTP_RETRIES', '2'))
+
+# Базовые URL провайдеров: для офлайн нагрузочного теста указываются адреса fake-oauth-provider.py
+YANDEX_OAUTH_URL = os.environ.get('YANDEX_OAUTH_URL', 'https://oauth.yandex.ru')
+YANDEX_LOGIN_URL = os.environ.get('YANDEX_LOGIN_URL', 'https://login.yandex.ru')
+VK_OAUTH_URL = os.environ.get('VK_OAUTH_URL', 'https://oauth.vk.com')
+VK_API_URL = os.environ.get('VK_API_URL', 'https://api.vk.com')
+
+LATENCY_BUCKETS_MS = [50, 100, 250, 500, 1000, 2500, 5000]
+
+def create_http_session() -> requests.Session:
+    '''
+    Business: HTTP-сессия к OAuth-провайдерам с keep-alive пулом и повтором только безопасных запросов
+    Args: нет
+    Returns: requests.Session
+    '''
+    # Повторяются ошибки соединения и 502/503/504 для GET; обмен кода (POST) при ответе не повторяется
+    retry = Retry(
+        total=OAUTH_HTTP_RETRIES,
+        connect=OAUTH_HTTP_RETRIES,
+        read=0,
+        status=OAUTH_HTTP_RETRIES,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(['GET']),
+        backoff_factor=0.2,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+# Сессия живет между вызовами теплого экземпляра функции - TLS-соединения переиспользуются
+_http_session = create_http_session()
+_latency_histograms: Dict[str, Dict[str, Any]] = {}
+
+def provider_request(provider: str, method: str, url: str, **kwargs) -> Optional[requests.Response]:
+    '''
+    Business: Запрос к OAuth-провайдеру со строгим таймаутом и учетом задержки в гистограмме провайдера
+    Args: provider - имя провайдера для метрик, method - HTTP-метод, url - адрес, kwargs - параметры requests
+    Returns: Response или None, если провайдер недоступен
+    '''
+    histogram = _latency_histograms.setdefault(provider, {
+        'buckets': {str(b): 0 for b in LATENCY_BUCKETS_MS + ['inf']},
+        'count': 0,
+        'errors': 0,
+        'total_ms': 0.0
+    })
+    started = time.monotonic()
+    try:
+        response = _http_session.request(
+            method, url, timeout=(OAUTH_CONNECT_TIMEOUT, OAUTH_READ_TIMEOUT), **kwargs
+        )
+    except requests.RequestException as e:
+        response = None
+        print(f"OAuth provider {provider} request failed: {e}")
+    
+    elapsed_ms = (time.monotonic() - started) * 1000
+    bucket = next((str(b) for b in LATENCY_BUCKETS_MS if elapsed_ms <= b), 'inf')
+    histogram['buckets'][bucket] += 1
+    histogram['count'] += 1
+    histogram['total_ms'] += elapsed_ms
+    if response is None or response.status_code >= 500:
+        histogram['errors'] += 1
+    
+    return response
+
+def http_stats_response() -> Dict[str, Any]:
+    '''
+    Business: Гистограммы задержек запросов к провайдерам в этом экземпляре функции
+    Args: нет
+    Returns: HTTP response с гистограммами
+    '''
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'buckets_ms': LATENCY_BUCKETS_MS,
+            'providers': {
+                provider: {**h, 'avg_ms': round(h['total_ms'] / h['count'], 1) if h['count'] else 0}
+                for provider, h in _latency_histograms.items()
+            }
+        })
+    }
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: OAuth авторизация через Telegram, Яндекс, VK
@@ -43,6 +134,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     params = event.get('queryStringParameters') or {}
     
+    if params.get('action') == 'http_stats':
+        return http_stats_response()
+    
     # Определяем провайдера из query параметров
     provider = params.get('provider')
     
@@ -102,24 +196,24 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             code = params['code']
             
             # Обмен кода на токен
-            token_response = requests.post('https://oauth.yandex.ru/token', data={
+            token_response = provider_request('yandex', 'POST', f'{YANDEX_OAUTH_URL}/token', data={
                 'grant_type': 'authorization_code',
                 'code': code,
                 'client_id': yandex_client_id,
                 'client_secret': yandex_client_secret
             })
             
-            if token_response.status_code != 200:
+            if token_response is None or token_response.status_code != 200:
                 return error_response('Ошибка получения токена Яндекс')
             
             access_token = token_response.json()['access_token']
             
             # Получение данных пользователя
-            user_response = requests.get('https://login.yandex.ru/info', headers={
+            user_response = provider_request('yandex', 'GET', f'{YANDEX_LOGIN_URL}/info', headers={
                 'Authorization': f'OAuth {access_token}'
             })
             
-            if user_response.status_code != 200:
+            if user_response is None or user_response.status_code != 200:
                 return error_response('Ошибка получения данных пользователя')
             
             user_data = user_response.json()
@@ -149,7 +243,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'client_id': yandex_client_id,
                 'redirect_uri': callback_url
             }
-            auth_url = f"https://oauth.yandex.ru/authorize?{urlencode(auth_params)}"
+            auth_url = f"{YANDEX_OAUTH_URL}/authorize?{urlencode(auth_params)}"
             
             return {
                 'statusCode': 302,
@@ -172,14 +266,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             callback_url = f"{function_url}?provider=vk"
             
             # Обмен кода на токен
-            token_response = requests.get('https://oauth.vk.com/access_token', params={
+            token_response = provider_request('vk', 'GET', f'{VK_OAUTH_URL}/access_token', params={
                 'client_id': vk_client_id,
                 'client_secret': vk_client_secret,
                 'redirect_uri': callback_url,
                 'code': code
             })
             
-            if token_response.status_code != 200:
+            if token_response is None or token_response.status_code != 200:
                 return error_response('Ошибка получения токена VK')
             
             token_data = token_response.json()
@@ -188,12 +282,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             email = token_data.get('email', f'vk_{vk_user_id}@oauth.local')
             
             # Получение данных пользователя
-            user_response = requests.get('https://api.vk.com/method/users.get', params={
+            user_response = provider_request('vk', 'GET', f'{VK_API_URL}/method/users.get', params={
                 'user_ids': vk_user_id,
                 'access_token': access_token,
                 'v': '5.131'
             })
             
+            if user_response is None or user_response.status_code != 200:
+                return error_response('Ошибка получения данных пользователя')
+            
             user_data = user_response.json()['response'][0]
             name = f"{user_data.get('first_name', '')} {user_data.get('last_name', '')}".strip() or 'Пользователь'
             
@@ -222,7 +319,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'response_type': 'code',
                 'v': '5.131'
             }
-            auth_url = f"https://oauth.vk.com/authorize?{urlencode(auth_params)}"
+            auth_url = f"{VK_OAUTH_URL}/authorize?{urlencode(auth_params)}"
             
             return {
                 'statusCode': 302,
@@ -237,41 +334,19 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 
 
 def create_or_login_oauth_user(db_url: str, jwt_secret: str, provider: str, provider_id: str, email: str, name: str) -> str:
-    '''Создает или авторизует пользователя через OAuth'''
+    '''Создает или авторизует пользователя через OAuth (один запрос upsert_oauth_user)'''
     conn = psycopg2.connect(db_url)
     cur = conn.cursor()
     
     schema = 't_p53065890_farmer_landing_proje'
     
-    # Проверяем, есть ли пользователь с таким provider_id
-    cur.execute(f"SELECT id, email, role, name FROM {schema}.users WHERE oauth_provider = %s AND oauth_provider_id = %s", 
-                (provider, provider_id))
-    user = cur.fetchone()
-    
-    if user:
-        # Пользователь уже существует
-        user_id, email, role, name = user
-    else:
-        # Проверяем email
-        cur.execute(f"SELECT id, role, name FROM {schema}.users WHERE LOWER(email) = %s", (email.lower(),))
-        existing = cur.fetchone()
-        
-        if existing:
-            # Email уже занят, привязываем OAuth
-            user_id, role, name = existing
-            cur.execute(f"UPDATE {schema}.users SET oauth_provider = %s, oauth_provider_id = %s WHERE id = %s",
-                       (provider, provider_id, user_id))
-            conn.commit()
-        else:
-            # Создаем нового пользователя
-            role = 'farmer'  # По умолчанию farmer
-            cur.execute(
-                f"INSERT INTO {schema}.users (email, role, name, oauth_provider, oauth_provider_id) VALUES (%s, %s, %s, %s, %s) RETURNING id",
-                (email, role, name, provider, provider_id)
-            )
-            user_id = cur.fetchone()[0]
-            conn.commit()
-    
+    # Поиск по провайдеру, привязка по email или создание пользователя (роль по умолчанию farmer)
+    cur.execute(
+        f"SELECT id, email, role, name FROM {schema}.upsert_oauth_user(p_provider => %s, p_provider_id => %s, p_email => %s, p_name => %s)",
+        (provider, str(provider_id), email, name)
+    )
+    user_id, email, role, name = cur.fetchone()
+    conn.commit()
     conn.close()
     
     # Генерируем JWT токен
@@ -5,13 +5,255 @@ import psycopg2.extras
 import uuid
 import base64
 import requests
-from datetime import datetime, timedelta
-from typing import Dict, Any
+import time
+from typing import Dict, Any, Optional
+
+WEBHOOK_BATCH_SIZE = int(os.environ.get('PAYMENT_WEBHOOK_BATCH_SIZE', '50'))
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('PAYMENT_WEBHOOK_MAX_ATTEMPTS', '5'))
+FINAL_PAYMENT_STATUSES = ('succeeded', 'canceled', 'failed')
+SWEEP_BATCH_SIZE = int(os.environ.get('SUBSCRIPTION_SWEEP_BATCH_SIZE', '500'))
+SWEEP_TIME_BUDGET_SECONDS = int(os.environ.get('SUBSCRIPTION_SWEEP_TIME_BUDGET', '20'))
+
+def is_webhook_request(params: Dict[str, Any], body_data: Dict[str, Any]) -> bool:
+    """YooKassa notifications carry type=notification; action=webhook is kept for manual calls"""
+    return (
+        params.get('action') == 'webhook'
+        or body_data.get('action') == 'webhook'
+        or body_data.get('type') == 'notification'
+    )
+
+def enqueue_webhook_event(conn, body_data: Dict[str, Any]) -> Optional[bool]:
+    """Store the notification in the inbox with a single insert; returns None for invalid data, False for a duplicate"""
+    schema = 't_p53065890_farmer_landing_proje'
+    yukassa_data = body_data.get('object') or {}
+    yukassa_payment_id = yukassa_data.get('id')
+    status = yukassa_data.get('status')
+    
+    if not yukassa_payment_id or not status:
+        return None
+    
+    with conn.cursor() as cur:
+        cur.execute(f'''
+            INSERT INTO {schema}.payment_webhook_events (yukassa_payment_id, payment_status, payload)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (yukassa_payment_id, payment_status) DO NOTHING
+            RETURNING id
+        ''', (yukassa_payment_id, status, json.dumps(body_data)))
+        inserted = cur.fetchone() is not None
+    conn.commit()
+    return inserted
+
+def apply_webhook_event(cur, yukassa_payment_id: str, status: str) -> str:
+    """Apply one payment status change; a payment already in a final status is left untouched"""
+    schema = 't_p53065890_farmer_landing_proje'
+    cur.execute(f'''
+        SELECT p.user_id, p.subscription_id, p.status, sp.duration_days
+        FROM {schema}.payments p
+        LEFT JOIN {schema}.user_subscriptions us ON p.subscription_id = us.id
+        LEFT JOIN {schema}.subscription_plans sp ON us.tier = sp.tier
+        WHERE p.yukassa_payment_id = %s
+        LIMIT 1
+        FOR UPDATE OF p
+    ''', (yukassa_payment_id,))
+    payment = cur.fetchone()
+    
+    if not payment:
+        raise ValueError('Payment not found')
+    
+    # Повторное или запоздавшее уведомление: платеж уже в конечном статусе
+    if payment['status'] in FINAL_PAYMENT_STATUSES:
+        return 'skipped'
+    
+    cur.execute(f'''
+        UPDATE {schema}.payments
+        SET status = %s, paid_at = CASE WHEN %s = 'succeeded' THEN NOW() ELSE paid_at END, updated_at = NOW()
+        WHERE yukassa_payment_id = %s
+    ''', (status, status, yukassa_payment_id))
+    
+    if status == 'succeeded':
+        duration_days = payment['duration_days'] or 30
+        
+        cur.execute(f'''
+            UPDATE {schema}.user_subscriptions
+            SET status = 'active', started_at = NOW(), expires_at = NOW() + INTERVAL '1 day' * %s
+            WHERE id = %s
+        ''', (duration_days, payment['subscription_id']))
+        
+        cur.execute(f'''
+            INSERT INTO {schema}.usage_limits (user_id, subscription_id, proposals_used, reset_at)
+            VALUES (%s, %s, 0, NOW() + INTERVAL '1 day' * %s)
+            ON CONFLICT (user_id) DO UPDATE
+            SET subscription_id = EXCLUDED.subscription_id, proposals_used = 0, reset_at = EXCLUDED.reset_at
+        ''', (payment['user_id'], payment['subscription_id'], duration_days))
+    
+    elif status in ('canceled', 'failed'):
+        cur.execute(f'''
+            UPDATE {schema}.user_subscriptions
+            SET status = 'canceled'
+            WHERE id = %s
+        ''', (payment['subscription_id'],))
+    
+    cur.execute(f'SELECT {schema}.refresh_user_entitlements(ARRAY[%s])', (int(payment['user_id']),))
+    return 'applied'
+
+def process_webhook_events(conn, limit: int) -> Dict[str, int]:
+    """Worker step: claim pending inbox rows (concurrent workers skip locked ones) and apply each in its own savepoint"""
+    schema = 't_p53065890_farmer_landing_proje'
+    stats = {'applied': 0, 'skipped': 0, 'failed': 0}
+    
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        cur.execute(f'''
+            SELECT id, yukassa_payment_id, payment_status
+            FROM {schema}.payment_webhook_events
+            WHERE processed_at IS NULL AND attempts < %s
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ''', (WEBHOOK_MAX_ATTEMPTS, limit))
+        events = cur.fetchall()
+        
+        for ev in events:
+            cur.execute('SAVEPOINT webhook_event')
+            try:
+                outcome = apply_webhook_event(cur, ev['yukassa_payment_id'], ev['payment_status'])
+                cur.execute('RELEASE SAVEPOINT webhook_event')
+                cur.execute(f'''
+                    UPDATE {schema}.payment_webhook_events
+                    SET processed_at = NOW(), attempts = attempts + 1, error = NULL
+                    WHERE id = %s
+                ''', (ev['id'],))
+                stats[outcome] += 1
+            except Exception as e:
+                # Событие остается в очереди до WEBHOOK_MAX_ATTEMPTS попыток
+                cur.execute('ROLLBACK TO SAVEPOINT webhook_event')
+                cur.execute(f'''
+                    UPDATE {schema}.payment_webhook_events
+                    SET attempts = attempts + 1, error = %s
+                    WHERE id = %s
+                ''', (str(e), ev['id']))
+                stats['failed'] += 1
+        
+        cur.execute(f'''
+            SELECT COUNT(*) AS pending FROM {schema}.payment_webhook_events
+            WHERE processed_at IS NULL AND attempts < %s
+        ''', (WEBHOOK_MAX_ATTEMPTS,))
+        stats['pending'] = cur.fetchone()['pending']
+    
+    conn.commit()
+    return stats
+
+def expire_subscriptions_batch(cur, limit: int) -> int:
+    """Expire one batch of due subscriptions, notify paid subscribers in bulk and refresh their entitlements"""
+    schema = 't_p53065890_farmer_landing_proje'
+    cur.execute(f'''
+        WITH due AS (
+            SELECT id FROM {schema}.user_subscriptions
+            WHERE status = 'active' AND expires_at <= NOW()
+            ORDER BY expires_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ),
+        expired AS (
+            UPDATE {schema}.user_subscriptions s
+            SET status = 'expired', updated_at = NOW()
+            FROM due
+            WHERE s.id = due.id
+            RETURNING s.id, s.user_id, s.tier, s.expires_at
+        ),
+        notified AS (
+            INSERT INTO {schema}.notifications (user_id, role, type, payload)
+            SELECT u.id, u.role, 'subscription_expired',
+                   jsonb_build_object('subscription_id', x.id, 'tier', x.tier, 'expires_at', x.expires_at)
+            FROM expired x
+            JOIN {schema}.users u ON u.id::text = x.user_id
+            WHERE x.tier <> 'free'
+        )
+        SELECT user_id FROM expired
+    ''', (limit,))
+    rows = cur.fetchall()
+    
+    user_ids = sorted({int(r['user_id']) for r in rows if str(r['user_id']).isdigit()})
+    if user_ids:
+        cur.execute(f'SELECT {schema}.refresh_user_entitlements(%s::integer[])', (user_ids,))
+    return len(rows)
+
+def expire_seller_tiers_batch(cur, limit: int) -> int:
+    """Drop expired seller tiers in one batch; the users trigger refreshes entitlements"""
+    schema = 't_p53065890_farmer_landing_proje'
+    cur.execute(f'''
+        WITH due AS (
+            SELECT id, subscription_tier FROM {schema}.users
+            WHERE subscription_tier <> 'none' AND subscription_expires_at <= NOW()
+            ORDER BY subscription_expires_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ),
+        expired AS (
+            UPDATE {schema}.users u
+            SET subscription_tier = 'none'
+            FROM due
+            WHERE u.id = due.id
+            RETURNING u.id, u.role, due.subscription_tier AS tier
+        ),
+        notified AS (
+            INSERT INTO {schema}.notifications (user_id, role, type, payload)
+            SELECT id, role, 'seller_subscription_expired', jsonb_build_object('tier', tier)
+            FROM expired
+        )
+        SELECT COUNT(*) AS expired FROM expired
+    ''', (limit,))
+    return cur.fetchone()['expired']
+
+def reset_usage_limits_batch(cur, limit: int) -> int:
+    """Start a new usage window for one batch of limits whose reset_at has passed"""
+    schema = 't_p53065890_farmer_landing_proje'
+    cur.execute(f'''
+        WITH due AS (
+            SELECT ul.id, COALESCE(sp.duration_days, 30) AS duration_days
+            FROM {schema}.usage_limits ul
+            LEFT JOIN {schema}.user_subscriptions us ON us.id = ul.subscription_id
+            LEFT JOIN {schema}.subscription_plans sp ON sp.tier = us.tier
+            WHERE ul.reset_at <= NOW()
+            ORDER BY ul.reset_at
+            LIMIT %s
+            FOR UPDATE OF ul SKIP LOCKED
+        )
+        UPDATE {schema}.usage_limits ul
+        SET proposals_used = 0, reset_at = NOW() + INTERVAL '1 day' * due.duration_days, updated_at = NOW()
+        FROM due
+        WHERE ul.id = due.id
+    ''', (limit,))
+    return cur.rowcount
+
+def sweep_subscriptions(conn, limit: int) -> Dict[str, int]:
+    """Worker step: run expiry and usage-reset batches (commit per batch) until drained or out of time budget"""
+    stats = {'subscriptions_expired': 0, 'seller_tiers_expired': 0, 'usage_limits_reset': 0, 'batches': 0}
+    jobs = [
+        ('subscriptions_expired', expire_subscriptions_batch),
+        ('seller_tiers_expired', expire_seller_tiers_batch),
+        ('usage_limits_reset', reset_usage_limits_batch)
+    ]
+    deadline = time.time() + SWEEP_TIME_BUDGET_SECONDS
+    
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        for name, run_batch in jobs:
+            while time.time() < deadline:
+                count = run_batch(cur, limit)
+                conn.commit()
+                stats[name] += count
+                stats['batches'] += 1
+                # Неполный батч - очередь просрочек исчерпана
+                if count < limit:
+                    break
+    
+    return stats
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Создание платежей через ЮКасса и управление подписками
-    Args: event - dict with httpMethod, body, headers
+    Args: event - dict with httpMethod, body, headers, queryStringParameters
+          (webhook ЮКасса - только запись в inbox; POST action=process_webhooks - применить события;
+          POST action=expire_subscriptions - истечение подписок и сброс лимитов)
           context - object with request_id
     Returns: HTTP response with payment confirmation URL or status
     '''
@@ -31,6 +273,51 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     try:
+        params = event.get('queryStringParameters') or {}
+        body_data = json.loads(event.get('body') or '{}') if method == 'POST' else {}
+        
+        # Webhook ЮКасса и воркеры вызываются без пользователя: вставка в inbox / обработка очередей
+        worker_action = params.get('action') in ('process_webhooks', 'expire_subscriptions')
+        if method == 'POST' and (worker_action or is_webhook_request(params, body_data)):
+            database_url = os.environ.get('DATABASE_URL')
+            if not database_url:
+                return {
+                    'statusCode': 500,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps({'error': 'DATABASE_URL not configured'})
+                }
+            
+            conn = psycopg2.connect(database_url)
+            try:
+                # POST ?action=process_webhooks[&limit=N] - batch-задача (таймер)
+                if params.get('action') == 'process_webhooks':
+                    limit = min(max(int(params.get('limit') or WEBHOOK_BATCH_SIZE), 1), 500)
+                    result = {'success': True, **process_webhook_events(conn, limit)}
+                # POST ?action=expire_subscriptions[&limit=N] - batch-задача (таймер)
+                elif params.get('action') == 'expire_subscriptions':
+                    limit = min(max(int(params.get('limit') or SWEEP_BATCH_SIZE), 1), 5000)
+                    result = {'success': True, **sweep_subscriptions(conn, limit)}
+                else:
+                    inserted = enqueue_webhook_event(conn, body_data)
+                    if inserted is None:
+                        return {
+                            'statusCode': 400,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'isBase64Encoded': False,
+                            'body': json.dumps({'error': 'Invalid webhook data'})
+                        }
+                    result = {'success': True, 'duplicate': not inserted}
+            finally:
+                conn.close()
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'isBase64Encoded': False,
+                'body': json.dumps(result)
+            }
+        
         headers = event.get('headers') or {}
         user_id = headers.get('X-User-Id') or headers.get('x-user-id')
         
@@ -61,16 +348,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         # GET - получить текущую подписку и историю платежей
         if method == 'GET':
             with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-                # Текущая подписка
+                # Текущая подписка - из материализованных прав (без пересчета по user_subscriptions)
                 cur.execute(f'''
-                    SELECT us.*, sp.tier, sp.daily_limit, sp.price_rub, sp.description, sp.features, sp.max_proposals
-                    FROM {schema}.user_subscriptions us
-                    LEFT JOIN {schema}.subscription_plans sp ON us.tier = sp.tier
-                    WHERE us.user_id = %s AND us.status = 'active'
-                    AND (us.expires_at IS NULL OR us.expires_at > NOW())
-                    ORDER BY us.created_at DESC
-                    LIMIT 1
-                ''', (user_id,))
+                    SELECT e.subscription_id AS id, e.user_id, e.tier, e.status, e.started_at, e.expires_at,
+                           e.daily_limit, e.max_proposals, sp.price_rub, sp.description, sp.features
+                    FROM {schema}.user_entitlements e
+                    LEFT JOIN {schema}.subscription_plans sp ON e.tier = sp.tier
+                    WHERE e.user_id = %s AND e.subscription_id IS NOT NULL
+                ''', (str(user_id),))
                 
                 subscription = cur.fetchone()
                 
@@ -109,7 +394,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         # POST - создать платеж
         elif method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
             action = body_data.get('action', 'create_payment')
             
             # Создание нового платежа
@@ -193,6 +477,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                                 VALUES (%s, %s, 0, NOW() + INTERVAL '%s days')
                             ''', (int(user_id), sub_id, plan['duration_days']))
                         
+                        cur.execute(f'SELECT {schema}.refresh_user_entitlements(ARRAY[%s])', (int(user_id),))
                         conn.commit()
                         conn.close()
                         
@@ -305,98 +590,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         })
                     }
             
-            # Webhook от ЮКасса о статусе платежа
-            elif action == 'webhook':
-                yukassa_data = body_data.get('object', {})
-                yukassa_payment_id = yukassa_data.get('id')
-                status = yukassa_data.get('status')
-                
-                if not yukassa_payment_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'isBase64Encoded': False,
-                        'body': json.dumps({'error': 'Invalid webhook data'})
-                    }
-                
-                with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-                    # Находим платеж
-                    cur.execute(f'''
-                        SELECT p.*, us.tier, sp.duration_days
-                        FROM {schema}.payments p
-                        LEFT JOIN {schema}.user_subscriptions us ON p.subscription_id = us.id
-                        LEFT JOIN {schema}.subscription_plans sp ON us.tier = sp.tier
-                        WHERE p.yukassa_payment_id = %s
-                        LIMIT 1
-                    ''', (yukassa_payment_id,))
-                    
-                    payment = cur.fetchone()
-                    
-                    if not payment:
-                        conn.close()
-                        return {
-                            'statusCode': 404,
-                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                            'isBase64Encoded': False,
-                            'body': json.dumps({'error': 'Payment not found'})
-                        }
-                    
-                    # Обновляем статус платежа
-                    cur.execute(f'''
-                        UPDATE {schema}.payments
-                        SET status = %s, paid_at = %s, updated_at = NOW()
-                        WHERE yukassa_payment_id = %s
-                    ''', (status, datetime.now() if status == 'succeeded' else None, yukassa_payment_id))
-                    
-                    # Если платеж успешен - активируем подписку
-                    if status == 'succeeded':
-                        duration_days = payment['duration_days'] or 30
-                        
-                        cur.execute(f'''
-                            UPDATE {schema}.user_subscriptions
-                            SET status = 'active', started_at = NOW(), expires_at = NOW() + INTERVAL '%s days'
-                            WHERE id = %s
-                        ''', (duration_days, payment['subscription_id']))
-                        
-                        # Создаем или обновляем лимиты
-                        cur.execute(f'''
-                            SELECT id FROM {schema}.usage_limits
-                            WHERE user_id = %s
-                            LIMIT 1
-                        ''', (payment['user_id'],))
-                        
-                        existing_lim = cur.fetchone()
-                        
-                        if existing_lim:
-                            cur.execute(f'''
-                                UPDATE {schema}.usage_limits
-                                SET subscription_id = %s, reset_at = NOW() + INTERVAL '%s days', proposals_used = 0
-                                WHERE user_id = %s
-                            ''', (payment['subscription_id'], duration_days, payment['user_id']))
-                        else:
-                            cur.execute(f'''
-                                INSERT INTO {schema}.usage_limits (user_id, subscription_id, proposals_used, reset_at)
-                                VALUES (%s, %s, 0, NOW() + INTERVAL '%s days')
-                            ''', (payment['user_id'], payment['subscription_id'], duration_days))
-                    
-                    # Если отменен - отменяем подписку
-                    elif status in ['canceled', 'failed']:
-                        cur.execute(f'''
-                            UPDATE {schema}.user_subscriptions
-                            SET status = 'canceled'
-                            WHERE id = %s
-                        ''', (payment['subscription_id'],))
-                    
-                    conn.commit()
-                    conn.close()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'isBase64Encoded': False,
-                        'body': json.dumps({'success': True})
-                    }
-        
         conn.close()
         return {
             'statusCode': 405,
@@ -2,7 +2,83 @@ import json
 import os
 import psycopg2
 import time
-from typing import Dict, Any
+from typing import Dict, Any, Tuple
+from datetime import date
+
+ACTIVITY_SHARD_BITS = 8192
+ENTITLEMENTS_TTL_SECONDS = int(os.environ.get('ENTITLEMENTS_TTL_SECONDS', '30'))
+ENTITLEMENTS_CACHE_SIZE = 10000
+
+# Уже отмеченные за сегодня пользователи в этом экземпляре функции: повторные запросы не пишут в БД
+_activity_seen: Dict[str, Any] = {'day': None, 'users': set()}
+
+def record_activity(conn, user_id: Any) -> None:
+    '''
+    Business: Отметить активность пользователя за день битом в дневной битовой карте (не строкой на запрос)
+    Args: conn - соединение с БД, user_id - ID пользователя
+    Returns: None
+    '''
+    try:
+        uid = int(user_id)
+    except (TypeError, ValueError):
+        return
+    
+    today = date.today()
+    if _activity_seen['day'] != today:
+        _activity_seen['day'] = today
+        _activity_seen['users'] = set()
+    if uid in _activity_seen['users']:
+        return
+    
+    schema = 't_p53065890_farmer_landing_proje'
+    shard, bit = divmod(uid, ACTIVITY_SHARD_BITS)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                INSERT INTO {schema}.user_activity_bitmaps (day, shard, bitmap)
+                VALUES (%s, %s, set_bit(decode(repeat('00', %s), 'hex'), %s, 1))
+                ON CONFLICT (day, shard) DO UPDATE
+                SET bitmap = set_bit(user_activity_bitmaps.bitmap, %s, 1)
+                WHERE get_bit(user_activity_bitmaps.bitmap, %s) = 0
+            """, (today, shard, ACTIVITY_SHARD_BITS // 8, bit, bit, bit))
+        conn.commit()
+        _activity_seen['users'].add(uid)
+    except Exception as e:
+        conn.rollback()
+        print(f"Activity tracking failed: {e}")
+
+# Права пользователей в этом экземпляре функции: user_id -> (истекает, права)
+_entitlements_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+
+def get_entitlements(cur, user_id: Any) -> Dict[str, Any]:
+    '''
+    Business: Права пользователя из user_entitlements с коротким кэшем в памяти экземпляра
+    Args: cur - курсор БД, user_id - ID пользователя
+    Returns: dict с tier, daily_limit, max_proposals, expires_at, seller_tier
+    '''
+    key = str(user_id)
+    cached = _entitlements_cache.get(key)
+    if cached and cached[0] > time.time():
+        return cached[1]
+    
+    schema = 't_p53065890_farmer_landing_proje'
+    cur.execute(f"""
+        SELECT tier, daily_limit, max_proposals, expires_at, seller_tier
+        FROM {schema}.user_entitlements WHERE user_id = %s
+    """, (key,))
+    row = cur.fetchone()
+    entitlements = {
+        'tier': row[0] if row else 'free',
+        'daily_limit': row[1] if row else 3,
+        'max_proposals': row[2] if row else 1,
+        'expires_at': row[3] if row else None,
+        'seller_tier': row[4] if row else 'none'
+    }
+    
+    if len(_entitlements_cache) >= ENTITLEMENTS_CACHE_SIZE:
+        _entitlements_cache.clear()
+    _entitlements_cache[key] = (time.time() + ENTITLEMENTS_TTL_SECONDS, entitlements)
+    return entitlements
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
@@ -48,6 +124,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     conn = psycopg2.connect(db_url)
     cur = conn.cursor()
+    record_activity(conn, user_id)
     schema = 't_p53065890_farmer_landing_proje'
     
     try:
@@ -105,12 +182,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             elif action == 'get_farmers':
-                cur.execute(
-                    f"""SELECT subscription_tier FROM {schema}.users WHERE id = %s""",
-                    (user_id,)
-                )
-                tier_row = cur.fetchone()
-                tier = tier_row[0] if tier_row else 'none'
+                tier = get_entitlements(cur, user_id)['seller_tier']
                 
                 region_filter = params.get('region', '')
                 occupation_filter = params.get('occupation', '')
@@ -192,12 +264,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             elif action == 'get_analytics':
-                cur.execute(
-                    f"""SELECT subscription_tier FROM {schema}.users WHERE id = %s""",
-                    (user_id,)
-                )
-                tier_row = cur.fetchone()
-                tier = tier_row[0] if tier_row else 'none'
+                tier = get_entitlements(cur, user_id)['seller_tier']
                 
                 if tier == 'none':
                     return {
@@ -368,12 +435,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             elif action == 'add_product':
-                cur.execute(
-                    f"""SELECT subscription_tier FROM {schema}.users WHERE id = %s""",
-                    (user_id,)
-                )
-                tier_row = cur.fetchone()
-                tier = tier_row[0] if tier_row else 'none'
+                tier = get_entitlements(cur, user_id)['seller_tier']
                 
                 cur.execute(
                     f"""SELECT products FROM {schema}.seller_data WHERE user_id = %s""",
@@ -461,12 +523,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             elif action == 'add_ad':
-                cur.execute(
-                    f"""SELECT subscription_tier FROM {schema}.users WHERE id = %s""",
-                    (user_id,)
-                )
-                tier_row = cur.fetchone()
-                tier = tier_row[0] if tier_row else 'none'
+                tier = get_entitlements(cur, user_id)['seller_tier']
                 
                 if tier == 'none':
                     return {
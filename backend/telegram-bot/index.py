@@ -151,37 +151,14 @@ def create_or_login_oauth_user(
     schema = 't_p53065890_farmer_landing_proje'
     
     cur.execute(
-        f"SELECT id, email, role, name FROM {schema}.users WHERE oauth_provider = %s AND oauth_provider_id = %s",
-        (provider, provider_id)
+        f"""SELECT id, email, role, name FROM {schema}.upsert_oauth_user(
+                p_provider => %s, p_provider_id => %s, p_email => %s, p_name => %s, p_role => %s,
+                p_first_name => %s, p_last_name => %s
+            )""",
+        (provider, str(provider_id), email, name, role, first_name, last_name)
     )
-    user = cur.fetchone()
-    
-    if user:
-        user_id, email, role, name = user
-        cur.execute(
-            f"UPDATE {schema}.users SET first_name = %s, last_name = %s WHERE id = %s",
-            (first_name, last_name, user_id)
-        )
-        conn.commit()
-    else:
-        cur.execute(f"SELECT id, role, name FROM {schema}.users WHERE LOWER(email) = %s", (email.lower(),))
-        existing = cur.fetchone()
-        
-        if existing:
-            user_id, role, name = existing
-            cur.execute(
-                f"UPDATE {schema}.users SET oauth_provider = %s, oauth_provider_id = %s, first_name = %s, last_name = %s WHERE id = %s",
-                (provider, provider_id, first_name, last_name, user_id)
-            )
-            conn.commit()
-        else:
-            cur.execute(
-                f"INSERT INTO {schema}.users (email, role, name, first_name, last_name, oauth_provider, oauth_provider_id) VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id",
-                (email, role, name, first_name, last_name, provider, provider_id)
-            )
-            user_id = cur.fetchone()[0]
-            conn.commit()
-    
+    user_id, email, role, name = cur.fetchone()
+    conn.commit()
     conn.close()
     
     token = jwt.encode({
@@ -0,0 +1,196 @@
+"""
+Конкурентный бенчмарк распределения долей одного "горячего" инвестиционного предложения.
+
+Запуск:  DATABASE_URL=postgresql://... python3 bench-share-allocation.py \
+             --farmer-id 1 --investor-ids 2,3,4 [--shares 10000] [--workers 32] [--requests 2000]
+             [--shares-per-request 1] [--approve-batch 200] [--keep]
+
+Создает предложение со --shares долями, затем --workers потоков параллельно создают --requests заявок
+через reserve_offer_shares (как investor-api create_request) и одобряют их пакетами через
+approve_investment_requests (как farmer-api moderate_request с request_ids).
+Печатает пропускную способность резервирования и одобрения, число отказов и проверяет инвариант
+available + reserved + одобренные = total, а также что ни у одного предложения reserved_shares
+не расходится с ожидающими заявками. Без --keep созданные строки удаляются.
+Требуются миграции до V0064 и существующие пользователи farmer-id и investor-ids.
+"""
+
+import argparse
+import os
+import statistics
+import threading
+import time
+import psycopg2
+
+SCHEMA = 't_p53065890_farmer_landing_proje'
+
+def create_offer(dsn: str, farmer_id: int, shares: int) -> int:
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                INSERT INTO {SCHEMA}.investment_offers
+                    (farmer_id, farm_name, title, total_amount, share_price, total_shares, available_shares, status)
+                VALUES (%s, 'bench', 'bench-share-allocation', %s, 1, %s, %s, 'published')
+                RETURNING id
+            """, (farmer_id, shares, shares, shares))
+            offer_id = cur.fetchone()[0]
+        conn.commit()
+        return offer_id
+    finally:
+        conn.close()
+
+def reserve_worker(dsn: str, offer_id: int, investor_ids: list, count: int, shares: int, results: dict, lock: threading.Lock) -> None:
+    conn = psycopg2.connect(dsn)
+    latencies, created, rejected = [], [], 0
+    try:
+        with conn.cursor() as cur:
+            for i in range(count):
+                started = time.perf_counter()
+                cur.execute(
+                    f"SELECT request_id FROM {SCHEMA}.reserve_offer_shares(%s, %s, %s, 'bench', INTERVAL '1 hour')",
+                    (offer_id, investor_ids[i % len(investor_ids)], shares)
+                )
+                row = cur.fetchone()
+                conn.commit()
+                latencies.append(time.perf_counter() - started)
+                if row:
+                    created.append(row[0])
+                else:
+                    rejected += 1
+    finally:
+        conn.close()
+
+    with lock:
+        results['latencies'] += latencies
+        results['created'] += created
+        results['rejected'] += rejected
+
+def approve_worker(dsn: str, farmer_id: int, batches: list, results: dict, lock: threading.Lock) -> None:
+    conn = psycopg2.connect(dsn)
+    approved = 0
+    try:
+        with conn.cursor() as cur:
+            for batch in batches:
+                cur.execute(
+                    f"SELECT request_id FROM {SCHEMA}.approve_investment_requests(%s, %s)",
+                    (farmer_id, batch)
+                )
+                approved += len(cur.fetchall())
+                conn.commit()
+    finally:
+        conn.close()
+
+    with lock:
+        results['approved'] += approved
+
+def run_threads(targets: list) -> float:
+    threads = [threading.Thread(target=fn, args=args) for fn, args in targets]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - started
+
+def check_invariant(dsn: str, offer_id: int) -> dict:
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT o.total_shares, o.available_shares, o.reserved_shares,
+                       COALESCE(SUM(r.shares_requested) FILTER (WHERE r.status = 'approved'), 0),
+                       COALESCE(SUM(r.shares_requested) FILTER (WHERE r.status = 'pending'), 0)
+                FROM {SCHEMA}.investment_offers o
+                LEFT JOIN {SCHEMA}.investment_requests r ON r.offer_id = o.id
+                WHERE o.id = %s
+                GROUP BY o.id
+            """, (offer_id,))
+            total, available, reserved, approved, pending = cur.fetchone()
+            
+            # Утечки резервов по всем предложениям: reserved_shares должен совпадать с ожидающими заявками
+            # (например, после удаления инвестора без release_investment_requests)
+            cur.execute(f"""
+                SELECT COUNT(*) FROM {SCHEMA}.investment_offers o
+                WHERE o.reserved_shares <> COALESCE((
+                    SELECT SUM(r.shares_requested) FROM {SCHEMA}.investment_requests r
+                    WHERE r.offer_id = o.id AND r.status = 'pending' AND r.reserved_until IS NOT NULL
+                ), 0)
+            """)
+            leaked_offers = cur.fetchone()[0]
+        return {
+            'total': total, 'available': available, 'reserved': reserved,
+            'approved': approved, 'pending': pending, 'leaked_offers': leaked_offers,
+            'ok': available + reserved + approved == total and reserved == pending and leaked_offers == 0
+        }
+    finally:
+        conn.close()
+
+def cleanup(dsn: str, offer_id: int) -> None:
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                DELETE FROM {SCHEMA}.notifications
+                WHERE type = 'request_approved' AND (payload->>'request_id')::bigint IN (
+                    SELECT id FROM {SCHEMA}.investment_requests WHERE offer_id = %s
+                )
+            """, (offer_id,))
+            cur.execute(f"DELETE FROM {SCHEMA}.investment_requests WHERE offer_id = %s", (offer_id,))
+            cur.execute(f"DELETE FROM {SCHEMA}.investment_offers WHERE id = %s", (offer_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Бенчмарк резервирования долей горячего предложения')
+    parser.add_argument('--farmer-id', type=int, required=True)
+    parser.add_argument('--investor-ids', required=True, help='ID инвесторов через запятую')
+    parser.add_argument('--shares', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--shares-per-request', type=int, default=1)
+    parser.add_argument('--approve-batch', type=int, default=200)
+    parser.add_argument('--keep', action='store_true', help='не удалять созданные предложение и заявки')
+    args = parser.parse_args()
+
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        raise SystemExit('DATABASE_URL не задан')
+    investor_ids = [int(x) for x in args.investor_ids.split(',') if x.strip()]
+
+    offer_id = create_offer(dsn, args.farmer_id, args.shares)
+    print(f'offer_id={offer_id} shares={args.shares} workers={args.workers} requests={args.requests}')
+
+    try:
+        lock = threading.Lock()
+        results = {'latencies': [], 'created': [], 'rejected': 0, 'approved': 0}
+        per_worker = [args.requests // args.workers + (1 if i < args.requests % args.workers else 0) for i in range(args.workers)]
+        elapsed = run_threads([
+            (reserve_worker, (dsn, offer_id, investor_ids, n, args.shares_per_request, results, lock))
+            for n in per_worker if n
+        ])
+
+        latencies = sorted(results['latencies'])
+        print(f"reserve: {len(latencies) / elapsed:.0f} req/s, created={len(results['created'])}, "
+              f"rejected(sold out)={results['rejected']}, "
+              f"p50={statistics.median(latencies) * 1000:.1f}ms p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms")
+
+        ids = sorted(results['created'])
+        batches = [ids[i:i + args.approve_batch] for i in range(0, len(ids), args.approve_batch)]
+        approvers = min(4, len(batches)) or 1
+        elapsed = run_threads([
+            (approve_worker, (dsn, args.farmer_id, batches[i::approvers], results, lock))
+            for i in range(approvers)
+        ])
+        print(f"approve: {results['approved'] / elapsed:.0f} req/s in {len(batches)} batches, approved={results['approved']}")
+
+        invariant = check_invariant(dsn, offer_id)
+        print(f"invariant: {invariant}")
+        if not invariant['ok']:
+            raise SystemExit(1)
+    finally:
+        if not args.keep:
+            cleanup(dsn, offer_id)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+-- Серверное хранилище диалогов GigaChat: клиент отправляет только новое сообщение
+CREATE TABLE IF NOT EXISTS t_p53065890_farmer_landing_proje.gigachat_conversations (
+    id VARCHAR(36) PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS t_p53065890_farmer_landing_proje.gigachat_messages (
+    id BIGSERIAL PRIMARY KEY,
+    conversation_id VARCHAR(36) NOT NULL,
+    role VARCHAR(20) NOT NULL,
+    content TEXT NOT NULL,
+    token_estimate INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Индексы: диалоги пользователя и хвост истории диалога (ORDER BY id DESC LIMIT n)
+CREATE INDEX IF NOT EXISTS idx_gigachat_conversations_user
+    ON t_p53065890_farmer_landing_proje.gigachat_conversations(user_id, updated_at DESC);
+CREATE INDEX IF NOT EXISTS idx_gigachat_messages_conversation
+    ON t_p53065890_farmer_landing_proje.gigachat_messages(conversation_id, id DESC);
+
+COMMENT ON TABLE t_p53065890_farmer_landing_proje.gigachat_conversations IS 'Диалоги пользователей с GigaChat';
+COMMENT ON TABLE t_p53065890_farmer_landing_proje.gigachat_messages IS 'Сообщения диалогов GigaChat (история обрезается по бюджету токенов при отправке)';
+COMMENT ON COLUMN t_p53065890_farmer_landing_proje.gigachat_messages.token_estimate IS 'Оценка числа токенов сообщения';
@@ -0,0 +1,25 @@
+-- Асинхронные задачи AI-анализа хозяйства (ai-advisor, ai-analysis) с сохранением результата
+CREATE TABLE IF NOT EXISTS t_p53065890_farmer_landing_proje.ai_analysis_jobs (
+    id VARCHAR(36) PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    source VARCHAR(32) NOT NULL,
+    diagnostics_version VARCHAR(64) NOT NULL,
+    farm_data JSONB NOT NULL DEFAULT '{}',
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    result JSONB,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    UNIQUE(user_id, source, diagnostics_version)
+);
+
+-- Индекс для воркера: выборка очереди задач по источнику
+CREATE INDEX IF NOT EXISTS idx_ai_analysis_jobs_queue
+    ON t_p53065890_farmer_landing_proje.ai_analysis_jobs(source, created_at)
+    WHERE status IN ('pending', 'running');
+
+COMMENT ON TABLE t_p53065890_farmer_landing_proje.ai_analysis_jobs IS 'Задачи AI-анализа: один результат на пользователя, источник и версию диагностики';
+COMMENT ON COLUMN t_p53065890_farmer_landing_proje.ai_analysis_jobs.diagnostics_version IS 'SHA-256 нормализованных данных хозяйства, по которым выполнялся анализ';
+COMMENT ON COLUMN t_p53065890_farmer_landing_proje.ai_analysis_jobs.status IS 'Статус: pending, running, done, failed';
@@ -0,0 +1,29 @@
+-- Кэш ответов GigaChat по хэшу нормализованных данных хозяйства и версии промпта
+CREATE TABLE IF NOT EXISTS t_p53065890_farmer_landing_proje.ai_response_cache (
+    cache_key VARCHAR(64) PRIMARY KEY,
+    source VARCHAR(32) NOT NULL,
+    prompt_version VARCHAR(16) NOT NULL,
+    response JSONB NOT NULL,
+    hit_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_hit_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL
+);
+
+-- Индексы для вытеснения: по сроку жизни и по давности последнего обращения (LRU)
+CREATE INDEX IF NOT EXISTS idx_ai_response_cache_expires
+    ON t_p53065890_farmer_landing_proje.ai_response_cache(expires_at);
+CREATE INDEX IF NOT EXISTS idx_ai_response_cache_last_hit
+    ON t_p53065890_farmer_landing_proje.ai_response_cache(source, last_hit_at DESC);
+
+-- Счетчики попаданий/промахов кэша по дням
+CREATE TABLE IF NOT EXISTS t_p53065890_farmer_landing_proje.ai_cache_metrics (
+    metric_date DATE NOT NULL DEFAULT CURRENT_DATE,
+    source VARCHAR(32) NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    misses INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (metric_date, source)
+);
+
+COMMENT ON TABLE t_p53065890_farmer_landing_proje.ai_response_cache IS 'Кэш AI-анализов: ключ = SHA-256(версия промпта + нормализованные данные хозяйства)';
+COMMENT ON TABLE t_p53065890_farmer_landing_proje.ai_cache_metrics IS 'Дневные счетчики hit/miss кэша AI-ответов';
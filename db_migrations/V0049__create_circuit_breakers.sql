@@ -0,0 +1,19 @@
+-- Общее состояние circuit breaker для внешних зависимостей (GigaChat) между вызовами функций
+CREATE TABLE IF NOT EXISTS t_p53065890_farmer_landing_proje.circuit_breakers (
+    name VARCHAR(64) PRIMARY KEY,
+    state VARCHAR(16) NOT NULL DEFAULT 'closed',
+    failure_count INTEGER NOT NULL DEFAULT 0,
+    opened_at TIMESTAMP,
+    probe_started_at TIMESTAMP,
+    last_error TEXT,
+    open_count BIGINT NOT NULL DEFAULT 0,
+    half_open_count BIGINT NOT NULL DEFAULT 0,
+    rejected_count BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p53065890_farmer_landing_proje.circuit_breakers (name) VALUES ('gigachat')
+ON CONFLICT (name) DO NOTHING;
+
+COMMENT ON TABLE t_p53065890_farmer_landing_proje.circuit_breakers IS 'Circuit breaker внешних API: closed -> open (после N ошибок) -> half_open (пробный запрос после паузы)';
+COMMENT ON COLUMN t_p53065890_farmer_landing_proje.circuit_breakers.rejected_count IS 'Сколько вызовов отклонено без обращения к внешнему API';
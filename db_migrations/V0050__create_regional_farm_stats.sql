@@ -0,0 +1,28 @@
+-- Предрасчитанная региональная статистика хозяйств (по данным farm_diagnostics)
+CREATE TABLE IF NOT EXISTS t_p53065890_farmer_landing_proje.regional_farm_stats (
+    region VARCHAR(255) NOT NULL,
+    metric VARCHAR(32) NOT NULL,
+    farm_count INTEGER NOT NULL DEFAULT 0,
+    mean NUMERIC(14,2),
+    median NUMERIC(14,2),
+    p25 NUMERIC(14,2),
+    p75 NUMERIC(14,2),
+    p90 NUMERIC(14,2),
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (region, metric)
+);
+
+-- Водяные знаки инкрементальных batch-задач
+CREATE TABLE IF NOT EXISTS t_p53065890_farmer_landing_proje.stats_watermarks (
+    job_name VARCHAR(64) PRIMARY KEY,
+    watermark TIMESTAMP NOT NULL DEFAULT '1970-01-01',
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Индекс для выборки диагностик, измененных после водяного знака
+CREATE INDEX IF NOT EXISTS idx_farm_diagnostics_updated_at
+    ON t_p53065890_farmer_landing_proje.farm_diagnostics(updated_at);
+
+COMMENT ON TABLE t_p53065890_farmer_landing_proje.regional_farm_stats IS 'Среднее, медиана и перцентили показателей хозяйств по регионам (регион "Россия" - по всей стране)';
+COMMENT ON COLUMN t_p53065890_farmer_landing_proje.regional_farm_stats.metric IS 'Показатель: land_area, animals, crop_yield, employees';
+COMMENT ON TABLE t_p53065890_farmer_landing_proje.stats_watermarks IS 'Последняя обработанная отметка времени для инкрементальных пересчетов';
@@ -0,0 +1,9 @@
+-- Кэш собранных метрик админ-панели: пересчет не чаще раза в TTL (ADMIN_METRICS_TTL_SECONDS)
+CREATE TABLE IF NOT EXISTS t_p53065890_farmer_landing_proje.admin_metrics_cache (
+    metric_type VARCHAR(32) PRIMARY KEY,
+    payload JSONB NOT NULL,
+    computed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE t_p53065890_farmer_landing_proje.admin_metrics_cache IS 'Последний результат admin-metrics по типу метрик (all, users, financial, ...)';
+COMMENT ON COLUMN t_p53065890_farmer_landing_proje.admin_metrics_cache.computed_at IS 'Время расчета; запись устаревает через ADMIN_METRICS_TTL_SECONDS';
@@ -0,0 +1,17 @@
+-- Дневные агрегаты для графиков админ-панели: регистрации, выручка, инвестиции, предложения
+CREATE TABLE IF NOT EXISTS t_p53065890_farmer_landing_proje.daily_metrics (
+    day DATE NOT NULL,
+    metric VARCHAR(32) NOT NULL,
+    dimension VARCHAR(64) NOT NULL DEFAULT '',
+    value NUMERIC(18,2) NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (day, metric, dimension)
+);
+
+-- Чтение рядов по метрике за период
+CREATE INDEX IF NOT EXISTS idx_daily_metrics_metric_day
+    ON t_p53065890_farmer_landing_proje.daily_metrics(metric, day DESC);
+
+COMMENT ON TABLE t_p53065890_farmer_landing_proje.daily_metrics IS 'Агрегаты по дням; дозаполняются admin-metrics по водяным знакам stats_watermarks (job_name = daily_metrics:<metric>)';
+COMMENT ON COLUMN t_p53065890_farmer_landing_proje.daily_metrics.metric IS 'Метрика: signups (по ролям), revenue, investments, proposals (по типам)';
+COMMENT ON COLUMN t_p53065890_farmer_landing_proje.daily_metrics.dimension IS 'Разрез метрики: роль пользователя, тип предложения или all';
@@ -0,0 +1,9 @@
+-- Индексы по времени для метрик админ-панели (полуоткрытые диапазоны created_at >= a AND created_at < b)
+CREATE INDEX IF NOT EXISTS idx_users_created_at
+    ON t_p53065890_farmer_landing_proje.users(created_at);
+
+-- Включенные колонки позволяют считать активных авторов/инвесторов и выручку по index-only scan
+CREATE INDEX IF NOT EXISTS idx_proposals_created_at
+    ON t_p53065890_farmer_landing_proje.proposals(created_at) INCLUDE (user_id, type);
+CREATE INDEX IF NOT EXISTS idx_investments_date
+    ON t_p53065890_farmer_landing_proje.investments(date) INCLUDE (user_id, amount);
@@ -0,0 +1,9 @@
+-- Дневная активность пользователей: битовая карта на шард из 8192 ID (бит user_id % 8192 = был активен)
+CREATE TABLE IF NOT EXISTS t_p53065890_farmer_landing_proje.user_activity_bitmaps (
+    day DATE NOT NULL,
+    shard INTEGER NOT NULL,
+    bitmap BYTEA NOT NULL,
+    PRIMARY KEY (day, shard)
+);
+
+COMMENT ON TABLE t_p53065890_farmer_landing_proje.user_activity_bitmaps IS 'Активные пользователи по дням: shard = user_id / 8192, 1 КБ на шард; DAU/WAU/MAU = число бит в OR битовых карт за окно';
@@ -0,0 +1,15 @@
+-- Индексы постраничных списков админ-панели (auth action=admin, list_users)
+
+-- Поиск пользователей по префиксу email или имени: LOWER(col) LIKE 'abc%'
+CREATE INDEX IF NOT EXISTS idx_users_lower_email_pattern
+    ON t_p53065890_farmer_landing_proje.users(LOWER(email) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_users_lower_name_pattern
+    ON t_p53065890_farmer_landing_proje.users(LOWER(name) text_pattern_ops);
+
+-- Сортировка по имени/email без сортировки всей таблицы
+CREATE INDEX IF NOT EXISTS idx_users_lower_name
+    ON t_p53065890_farmer_landing_proje.users(LOWER(name));
+
+-- Фильтр предложений по статусу с сортировкой по дате
+CREATE INDEX IF NOT EXISTS idx_proposals_status_created_at
+    ON t_p53065890_farmer_landing_proje.proposals(status, created_at DESC);
@@ -0,0 +1,30 @@
+-- Уникальный индекс по email без учета регистра: поиск WHERE LOWER(email) = %s (вход, регистрация, OAuth)
+-- без последовательного сканирования users и регистрация через INSERT ... ON CONFLICT ((LOWER(email)))
+
+-- Аккаунты с email, различающимися только регистром, могут принадлежать разным людям: автоматически
+-- их не сливаем, а останавливаем миграцию со списком конфликтов. После ручного слияния (перенос данных
+-- на основной аккаунт и удаление через delete-user) миграцию можно повторить.
+DO $$
+DECLARE
+    conflicts TEXT;
+BEGIN
+    SELECT string_agg(format('%s (ids %s)', email_key, ids), '; ')
+    INTO conflicts
+    FROM (
+        SELECT LOWER(email) AS email_key, array_agg(id ORDER BY id)::text AS ids
+        FROM t_p53065890_farmer_landing_proje.users
+        GROUP BY LOWER(email)
+        HAVING COUNT(*) > 1
+        ORDER BY 1
+        LIMIT 20
+    ) dup;
+
+    IF conflicts IS NOT NULL THEN
+        RAISE EXCEPTION 'users: email, различающиеся только регистром, нужно слить вручную: %', conflicts
+            USING HINT = 'SELECT LOWER(email), array_agg(id) FROM t_p53065890_farmer_landing_proje.users GROUP BY 1 HAVING COUNT(*) > 1;';
+    END IF;
+END
+$$;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_lower_email_unique
+    ON t_p53065890_farmer_landing_proje.users(LOWER(email));
@@ -0,0 +1,13 @@
+-- Версии JWT-токенов пользователей для проверки токена без запроса к users (auth action=verify)
+-- Токен действителен, пока его claim tv совпадает с версией; нет строки - версия 0
+CREATE TABLE IF NOT EXISTS t_p53065890_farmer_landing_proje.user_token_versions (
+    user_id INTEGER PRIMARY KEY,
+    token_version INTEGER NOT NULL DEFAULT 0,
+    changed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Инкрементальная синхронизация кэша версий в экземплярах функции auth
+CREATE INDEX IF NOT EXISTS idx_user_token_versions_changed_at
+    ON t_p53065890_farmer_landing_proje.user_token_versions(changed_at);
+
+COMMENT ON TABLE t_p53065890_farmer_landing_proje.user_token_versions IS 'Версии токенов: увеличивается при сбросе пароля, -1 для удаленных пользователей (без FK, чтобы пережить удаление)';
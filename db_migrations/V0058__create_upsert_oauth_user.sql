@@ -0,0 +1,89 @@
+-- Единый вход через OAuth (oauth, oauth-vk, oauth-telegram, telegram-bot, auth-vk, auth-yandex, auth-telegram)
+
+-- auth-vk/auth-yandex/auth-telegram хранили ID провайдера в oauth_id: переносим в oauth_provider_id
+UPDATE t_p53065890_farmer_landing_proje.users
+SET oauth_provider_id = oauth_id
+WHERE oauth_provider_id IS NULL AND oauth_id IS NOT NULL;
+
+-- Вход через оба потока (auth-vk: vk<id>@farmer.local, oauth: vk_<id>@oauth.local) создавал два аккаунта
+-- с одной парой (провайдер, ID). Основным остается самый старый, у дублей снимается oauth_provider_id
+-- (oauth_id сохраняется для ручного слияния данных), иначе уникальный индекс ниже не построится.
+-- Затронутые строки до применения:
+-- SELECT oauth_provider, COALESCE(oauth_provider_id, oauth_id), array_agg(id ORDER BY created_at, id)
+-- FROM t_p53065890_farmer_landing_proje.users WHERE oauth_provider IS NOT NULL
+-- GROUP BY 1, 2 HAVING COUNT(*) > 1;
+UPDATE t_p53065890_farmer_landing_proje.users u
+SET oauth_provider_id = NULL
+FROM (
+    SELECT id, ROW_NUMBER() OVER (
+        PARTITION BY oauth_provider, oauth_provider_id
+        ORDER BY created_at NULLS LAST, id
+    ) AS rn
+    FROM t_p53065890_farmer_landing_proje.users
+    WHERE oauth_provider IS NOT NULL AND oauth_provider_id IS NOT NULL
+) dup
+WHERE u.id = dup.id AND dup.rn > 1;
+
+-- Один аккаунт на пару (провайдер, ID у провайдера): защищает от дублей при параллельных входах
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_oauth_provider_unique
+    ON t_p53065890_farmer_landing_proje.users(oauth_provider, oauth_provider_id);
+
+-- Поиск по провайдеру -> привязка по email -> создание пользователя одним запросом
+CREATE OR REPLACE FUNCTION t_p53065890_farmer_landing_proje.upsert_oauth_user(
+    p_provider VARCHAR,
+    p_provider_id VARCHAR,
+    p_email VARCHAR,
+    p_name VARCHAR,
+    p_role VARCHAR DEFAULT 'farmer',
+    p_first_name VARCHAR DEFAULT NULL,
+    p_last_name VARCHAR DEFAULT NULL,
+    p_avatar_url TEXT DEFAULT NULL,
+    p_photo_url TEXT DEFAULT NULL,
+    p_access_token TEXT DEFAULT NULL
+)
+RETURNS TABLE (id INTEGER, email VARCHAR, role VARCHAR, name VARCHAR, created BOOLEAN)
+LANGUAGE sql
+AS $$
+    WITH by_provider AS (
+        UPDATE t_p53065890_farmer_landing_proje.users u SET
+            first_name = COALESCE(NULLIF(p_first_name, ''), u.first_name),
+            last_name = COALESCE(NULLIF(p_last_name, ''), u.last_name),
+            avatar_url = COALESCE(NULLIF(p_avatar_url, ''), u.avatar_url),
+            photo_url = COALESCE(NULLIF(p_photo_url, ''), u.photo_url),
+            oauth_access_token = COALESCE(p_access_token, u.oauth_access_token)
+        WHERE u.oauth_provider = p_provider AND u.oauth_provider_id = p_provider_id
+        RETURNING u.id, u.email, u.role, u.name, FALSE AS created
+    ),
+    by_email AS (
+        UPDATE t_p53065890_farmer_landing_proje.users u SET
+            oauth_provider = p_provider,
+            oauth_provider_id = p_provider_id,
+            oauth_id = p_provider_id,
+            first_name = COALESCE(NULLIF(p_first_name, ''), u.first_name),
+            last_name = COALESCE(NULLIF(p_last_name, ''), u.last_name),
+            avatar_url = COALESCE(NULLIF(p_avatar_url, ''), u.avatar_url),
+            photo_url = COALESCE(NULLIF(p_photo_url, ''), u.photo_url),
+            oauth_access_token = COALESCE(p_access_token, u.oauth_access_token)
+        WHERE LOWER(u.email) = LOWER(p_email)
+          AND NOT EXISTS (SELECT 1 FROM by_provider)
+        RETURNING u.id, u.email, u.role, u.name, FALSE AS created
+    ),
+    inserted AS (
+        INSERT INTO t_p53065890_farmer_landing_proje.users AS u
+            (email, password_hash, role, name, first_name, last_name, avatar_url, photo_url,
+             oauth_provider, oauth_provider_id, oauth_id, oauth_access_token)
+        SELECT p_email, '', p_role, p_name, p_first_name, p_last_name, p_avatar_url, p_photo_url,
+               p_provider, p_provider_id, p_provider_id, p_access_token
+        WHERE NOT EXISTS (SELECT 1 FROM by_provider) AND NOT EXISTS (SELECT 1 FROM by_email)
+        -- Параллельный первый вход того же пользователя: строку уже вставил другой запрос
+        ON CONFLICT (oauth_provider, oauth_provider_id) DO UPDATE SET
+            oauth_access_token = COALESCE(EXCLUDED.oauth_access_token, u.oauth_access_token)
+        RETURNING u.id, u.email, u.role, u.name, (u.xmax = 0) AS created
+    )
+    SELECT * FROM by_provider
+    UNION ALL SELECT * FROM by_email
+    UNION ALL SELECT * FROM inserted
+    LIMIT 1
+$$;
+
+COMMENT ON FUNCTION t_p53065890_farmer_landing_proje.upsert_oauth_user IS 'Вход через OAuth одним запросом: (id, email, role, name, created)';
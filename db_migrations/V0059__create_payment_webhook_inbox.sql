@@ -0,0 +1,28 @@
+-- Входящие webhook-уведомления ЮКасса: ответ сразу после вставки, применение - воркером
+CREATE TABLE IF NOT EXISTS t_p53065890_farmer_landing_proje.payment_webhook_events (
+    id BIGSERIAL PRIMARY KEY,
+    yukassa_payment_id VARCHAR(255) NOT NULL,
+    payment_status VARCHAR(50) NOT NULL,
+    payload JSONB NOT NULL DEFAULT '{}',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    processed_at TIMESTAMP,
+    UNIQUE(yukassa_payment_id, payment_status)
+);
+
+-- Индекс для воркера: только необработанные события
+CREATE INDEX IF NOT EXISTS idx_payment_webhook_events_pending
+    ON t_p53065890_farmer_landing_proje.payment_webhook_events(id)
+    WHERE processed_at IS NULL;
+
+-- Одна строка лимитов на пользователя (для INSERT ... ON CONFLICT): удаляем дубли, оставляя последнюю
+DELETE FROM t_p53065890_farmer_landing_proje.usage_limits ul
+USING t_p53065890_farmer_landing_proje.usage_limits newer
+WHERE newer.user_id = ul.user_id AND newer.id > ul.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_usage_limits_user_id
+    ON t_p53065890_farmer_landing_proje.usage_limits(user_id);
+
+COMMENT ON TABLE t_p53065890_farmer_landing_proje.payment_webhook_events IS 'Inbox webhook ЮКасса: повторная доставка того же (платеж, статус) не создает новую запись';
+COMMENT ON COLUMN t_p53065890_farmer_landing_proje.payment_webhook_events.processed_at IS 'Когда событие применено воркером (NULL - ожидает обработки или повтора)';
@@ -0,0 +1,75 @@
+-- Материализованные права пользователя: тариф, лимиты и срок действия в одной строке
+CREATE TABLE IF NOT EXISTS t_p53065890_farmer_landing_proje.user_entitlements (
+    user_id TEXT PRIMARY KEY,
+    subscription_id INTEGER,
+    tier TEXT NOT NULL DEFAULT 'free',
+    status VARCHAR(50) NOT NULL DEFAULT 'none',
+    started_at TIMESTAMP,
+    expires_at TIMESTAMP,
+    daily_limit INTEGER NOT NULL DEFAULT 3,
+    max_proposals INTEGER,
+    seller_tier VARCHAR(20) NOT NULL DEFAULT 'none',
+    seller_expires_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Пересчет прав по активной подписке и тарифу (NULL - для всех пользователей)
+CREATE OR REPLACE FUNCTION t_p53065890_farmer_landing_proje.refresh_user_entitlements(p_user_ids INTEGER[])
+RETURNS INTEGER
+LANGUAGE sql
+AS $$
+    WITH upserted AS (
+        INSERT INTO t_p53065890_farmer_landing_proje.user_entitlements AS e
+            (user_id, subscription_id, tier, status, started_at, expires_at,
+             daily_limit, max_proposals, seller_tier, seller_expires_at, updated_at)
+        SELECT u.id::text, us.id, COALESCE(us.tier, 'free'), COALESCE(us.status, 'none'), us.started_at, us.expires_at,
+               COALESCE(sp.daily_limit, 3), sp.max_proposals,
+               COALESCE(u.subscription_tier, 'none'), u.subscription_expires_at, CURRENT_TIMESTAMP
+        FROM t_p53065890_farmer_landing_proje.users u
+        LEFT JOIN LATERAL (
+            SELECT s.id, s.tier, s.status, s.started_at, s.expires_at
+            FROM t_p53065890_farmer_landing_proje.user_subscriptions s
+            WHERE s.user_id = u.id::text AND s.status = 'active'
+              AND (s.expires_at IS NULL OR s.expires_at > CURRENT_TIMESTAMP)
+            ORDER BY s.created_at DESC
+            LIMIT 1
+        ) us ON TRUE
+        LEFT JOIN t_p53065890_farmer_landing_proje.subscription_plans sp ON sp.tier = COALESCE(us.tier, 'free')
+        WHERE p_user_ids IS NULL OR u.id = ANY(p_user_ids)
+        ON CONFLICT (user_id) DO UPDATE SET
+            subscription_id = EXCLUDED.subscription_id,
+            tier = EXCLUDED.tier,
+            status = EXCLUDED.status,
+            started_at = EXCLUDED.started_at,
+            expires_at = EXCLUDED.expires_at,
+            daily_limit = EXCLUDED.daily_limit,
+            max_proposals = EXCLUDED.max_proposals,
+            seller_tier = EXCLUDED.seller_tier,
+            seller_expires_at = EXCLUDED.seller_expires_at,
+            updated_at = EXCLUDED.updated_at
+        RETURNING 1
+    )
+    SELECT COUNT(*)::int FROM upserted
+$$;
+
+-- Тариф продавца хранится в users и меняется вне функций: синхронизируем триггером
+CREATE OR REPLACE FUNCTION t_p53065890_farmer_landing_proje.sync_user_entitlements()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM t_p53065890_farmer_landing_proje.refresh_user_entitlements(ARRAY[NEW.id]);
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_users_entitlements ON t_p53065890_farmer_landing_proje.users;
+CREATE TRIGGER trg_users_entitlements
+    AFTER INSERT OR UPDATE OF subscription_tier, subscription_expires_at
+    ON t_p53065890_farmer_landing_proje.users
+    FOR EACH ROW EXECUTE FUNCTION t_p53065890_farmer_landing_proje.sync_user_entitlements();
+
+SELECT t_p53065890_farmer_landing_proje.refresh_user_entitlements(NULL);
+
+COMMENT ON TABLE t_p53065890_farmer_landing_proje.user_entitlements IS 'Права пользователя (тариф, дневной лимит AI, лимит объявлений, тариф продавца); пишутся воркером платежей и при истечении подписки';
+COMMENT ON FUNCTION t_p53065890_farmer_landing_proje.refresh_user_entitlements IS 'Пересчитать user_entitlements для списка ID пользователей (NULL - для всех)';
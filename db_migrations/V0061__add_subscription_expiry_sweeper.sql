@@ -0,0 +1,52 @@
+-- Истечение подписок выполняет воркер payment (POST ?action=expire_subscriptions) батчами:
+-- чтение прав больше не фильтрует по времени, статус 'active' означает действующую подписку
+
+-- Индексы очередей воркера: только строки, которые еще могут истечь
+CREATE INDEX IF NOT EXISTS idx_user_subs_active_expires
+    ON t_p53065890_farmer_landing_proje.user_subscriptions(expires_at)
+    WHERE status = 'active';
+CREATE INDEX IF NOT EXISTS idx_users_seller_tier_expires
+    ON t_p53065890_farmer_landing_proje.users(subscription_expires_at)
+    WHERE subscription_tier <> 'none';
+CREATE INDEX IF NOT EXISTS idx_usage_limits_reset_at
+    ON t_p53065890_farmer_landing_proje.usage_limits(reset_at);
+
+-- Пересчет прав без предиката по expires_at: просроченные подписки уже переведены в 'expired'
+CREATE OR REPLACE FUNCTION t_p53065890_farmer_landing_proje.refresh_user_entitlements(p_user_ids INTEGER[])
+RETURNS INTEGER
+LANGUAGE sql
+AS $$
+    WITH upserted AS (
+        INSERT INTO t_p53065890_farmer_landing_proje.user_entitlements AS e
+            (user_id, subscription_id, tier, status, started_at, expires_at,
+             daily_limit, max_proposals, seller_tier, seller_expires_at, updated_at)
+        SELECT u.id::text, us.id, COALESCE(us.tier, 'free'), COALESCE(us.status, 'none'), us.started_at, us.expires_at,
+               COALESCE(sp.daily_limit, 3), sp.max_proposals,
+               COALESCE(u.subscription_tier, 'none'), u.subscription_expires_at, CURRENT_TIMESTAMP
+        FROM t_p53065890_farmer_landing_proje.users u
+        LEFT JOIN LATERAL (
+            SELECT s.id, s.tier, s.status, s.started_at, s.expires_at
+            FROM t_p53065890_farmer_landing_proje.user_subscriptions s
+            WHERE s.user_id = u.id::text AND s.status = 'active'
+            ORDER BY s.created_at DESC
+            LIMIT 1
+        ) us ON TRUE
+        LEFT JOIN t_p53065890_farmer_landing_proje.subscription_plans sp ON sp.tier = COALESCE(us.tier, 'free')
+        WHERE p_user_ids IS NULL OR u.id = ANY(p_user_ids)
+        ON CONFLICT (user_id) DO UPDATE SET
+            subscription_id = EXCLUDED.subscription_id,
+            tier = EXCLUDED.tier,
+            status = EXCLUDED.status,
+            started_at = EXCLUDED.started_at,
+            expires_at = EXCLUDED.expires_at,
+            daily_limit = EXCLUDED.daily_limit,
+            max_proposals = EXCLUDED.max_proposals,
+            seller_tier = EXCLUDED.seller_tier,
+            seller_expires_at = EXCLUDED.seller_expires_at,
+            updated_at = EXCLUDED.updated_at
+        RETURNING 1
+    )
+    SELECT COUNT(*)::int FROM upserted
+$$;
+
+COMMENT ON COLUMN t_p53065890_farmer_landing_proje.user_subscriptions.status IS 'Статус: pending, active, expired, canceled';
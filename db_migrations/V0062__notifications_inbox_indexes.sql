@@ -0,0 +1,21 @@
+-- Входящие уведомления пользователя: постраничное чтение по курсору (id) и счетчик непрочитанных
+
+-- Лента пользователя: WHERE user_id = ? AND id < курсор ORDER BY id DESC LIMIT n
+CREATE INDEX IF NOT EXISTS idx_notif_user_id_desc
+    ON t_p53065890_farmer_landing_proje.notifications(user_id, id DESC);
+
+-- Непрочитанные: частичный индекс остается маленьким при любом объеме истории
+CREATE INDEX IF NOT EXISTS idx_notif_user_unread_id
+    ON t_p53065890_farmer_landing_proje.notifications(user_id, id DESC)
+    WHERE is_read = FALSE;
+
+-- Очистка по сроку хранения (POST ?action=cleanup): батчи WHERE created_at < ... ORDER BY created_at LIMIT n
+CREATE INDEX IF NOT EXISTS idx_notif_created_at
+    ON t_p53065890_farmer_landing_proje.notifications(created_at);
+
+-- Старые индексы покрываются новыми
+DROP INDEX IF EXISTS t_p53065890_farmer_landing_proje.idx_notif_user;
+DROP INDEX IF EXISTS t_p53065890_farmer_landing_proje.idx_notif_user_unread;
+DROP INDEX IF EXISTS t_p53065890_farmer_landing_proje.idx_notif_is_read;
+
+COMMENT ON TABLE t_p53065890_farmer_landing_proje.notifications IS 'Уведомления пользователей; хранение ограничено сроком (функция notifications, POST ?action=cleanup)';
@@ -0,0 +1,23 @@
+-- Push-доставка уведомлений: после вставки отправляем pg_notify в канал пользователя
+-- Канал notifications_user_<id>, payload - максимальный id новых уведомлений пользователя.
+-- Триггер на оператор (а не на строку): массовая рассылка дает одно событие на пользователя
+CREATE OR REPLACE FUNCTION t_p53065890_farmer_landing_proje.notify_notifications_inserted()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM pg_notify('notifications_user_' || user_id, MAX(id)::text)
+    FROM inserted
+    WHERE user_id IS NOT NULL
+    GROUP BY user_id;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_notifications_notify ON t_p53065890_farmer_landing_proje.notifications;
+CREATE TRIGGER trg_notifications_notify
+    AFTER INSERT ON t_p53065890_farmer_landing_proje.notifications
+    REFERENCING NEW TABLE AS inserted
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p53065890_farmer_landing_proje.notify_notifications_inserted();
+
+COMMENT ON FUNCTION t_p53065890_farmer_landing_proje.notify_notifications_inserted IS 'pg_notify в канал notifications_user_<id> (доставляется при COMMIT) для long-poll/SSE функции notifications';
@@ -0,0 +1,172 @@
+-- Распределение долей инвестиционных предложений через резервирование
+-- available_shares - свободные доли, reserved_shares - удержанные заявками в статусе pending до reserved_until
+
+ALTER TABLE t_p53065890_farmer_landing_proje.investment_offers
+ADD COLUMN IF NOT EXISTS reserved_shares INT NOT NULL DEFAULT 0 CHECK (reserved_shares >= 0);
+
+ALTER TABLE t_p53065890_farmer_landing_proje.investment_requests
+ADD COLUMN IF NOT EXISTS reserved_until TIMESTAMPTZ;
+
+-- Очередь истечения резервов
+CREATE INDEX IF NOT EXISTS idx_requests_reserved_until
+    ON t_p53065890_farmer_landing_proje.investment_requests(reserved_until)
+    WHERE status = 'pending' AND reserved_until IS NOT NULL;
+
+-- Существующие pending-заявки резервируем по порядку создания, пока хватает свободных долей;
+-- остальные остаются без резерва и одобряются прежней проверкой available_shares
+WITH fits AS (
+    SELECT r.id, r.offer_id, r.shares_requested
+    FROM (
+        SELECT r.id, r.offer_id, r.shares_requested,
+               SUM(r.shares_requested) OVER (PARTITION BY r.offer_id ORDER BY r.id) AS running
+        FROM t_p53065890_farmer_landing_proje.investment_requests r
+        WHERE r.status = 'pending' AND r.reserved_until IS NULL
+    ) r
+    JOIN t_p53065890_farmer_landing_proje.investment_offers o ON o.id = r.offer_id
+    WHERE r.running <= o.available_shares
+),
+marked AS (
+    UPDATE t_p53065890_farmer_landing_proje.investment_requests r
+    SET reserved_until = now() + INTERVAL '72 hours'
+    FROM fits
+    WHERE r.id = fits.id
+)
+UPDATE t_p53065890_farmer_landing_proje.investment_offers o
+SET available_shares = o.available_shares - s.shares, reserved_shares = o.reserved_shares + s.shares
+FROM (SELECT offer_id, SUM(shares_requested) AS shares FROM fits GROUP BY offer_id) s
+WHERE o.id = s.offer_id;
+
+-- Резерв долей и создание заявки одним оператором: без чтения available_shares перед записью
+CREATE OR REPLACE FUNCTION t_p53065890_farmer_landing_proje.reserve_offer_shares(
+    p_offer_id BIGINT,
+    p_investor_id BIGINT,
+    p_shares INT,
+    p_message TEXT,
+    p_ttl INTERVAL
+)
+RETURNS TABLE (request_id BIGINT, farmer_id BIGINT, amount NUMERIC, reserved_until TIMESTAMPTZ)
+LANGUAGE sql
+AS $$
+    WITH reserved AS (
+        UPDATE t_p53065890_farmer_landing_proje.investment_offers o
+        SET available_shares = o.available_shares - p_shares,
+            reserved_shares = o.reserved_shares + p_shares,
+            updated_at = now()
+        WHERE o.id = p_offer_id AND o.status = 'published' AND o.available_shares >= p_shares
+        RETURNING o.id, o.farmer_id, o.share_price
+    ),
+    req AS (
+        INSERT INTO t_p53065890_farmer_landing_proje.investment_requests
+            (offer_id, investor_id, shares_requested, amount, message, status, reserved_until)
+        SELECT id, p_investor_id, p_shares, share_price * p_shares, p_message, 'pending', now() + p_ttl
+        FROM reserved
+        RETURNING id, amount, reserved_until
+    )
+    SELECT req.id, reserved.farmer_id, req.amount, req.reserved_until
+    FROM req CROSS JOIN reserved
+$$;
+
+-- Пакетное одобрение: доли уже удержаны, снимаем резерв; заявки, занятые другой транзакцией, пропускаются
+CREATE OR REPLACE FUNCTION t_p53065890_farmer_landing_proje.approve_investment_requests(
+    p_farmer_id BIGINT,
+    p_request_ids BIGINT[]
+)
+RETURNS TABLE (request_id BIGINT, investor_id BIGINT)
+LANGUAGE sql
+AS $$
+    WITH target AS (
+        SELECT r.id
+        FROM t_p53065890_farmer_landing_proje.investment_requests r
+        JOIN t_p53065890_farmer_landing_proje.investment_offers o ON o.id = r.offer_id
+        WHERE r.id = ANY(p_request_ids) AND o.farmer_id = p_farmer_id
+          AND r.status = 'pending' AND r.reserved_until IS NOT NULL
+        FOR UPDATE OF r SKIP LOCKED
+    ),
+    approved AS (
+        UPDATE t_p53065890_farmer_landing_proje.investment_requests r
+        SET status = 'approved'
+        FROM target
+        WHERE r.id = target.id
+        RETURNING r.id, r.offer_id, r.investor_id, r.shares_requested
+    ),
+    settled AS (
+        UPDATE t_p53065890_farmer_landing_proje.investment_offers o
+        SET reserved_shares = o.reserved_shares - s.shares, updated_at = now()
+        FROM (SELECT offer_id, SUM(shares_requested) AS shares FROM approved GROUP BY offer_id) s
+        WHERE o.id = s.offer_id
+    ),
+    notified AS (
+        INSERT INTO t_p53065890_farmer_landing_proje.notifications (user_id, role, type, payload)
+        SELECT investor_id, 'investor', 'request_approved', jsonb_build_object('request_id', id)
+        FROM approved
+    )
+    SELECT id, investor_id FROM approved
+$$;
+
+-- Отклонение или истечение заявок: удержанные доли возвращаются в available_shares
+CREATE OR REPLACE FUNCTION t_p53065890_farmer_landing_proje.release_investment_requests(
+    p_request_ids BIGINT[],
+    p_status VARCHAR,
+    p_farmer_id BIGINT DEFAULT NULL
+)
+RETURNS TABLE (request_id BIGINT, investor_id BIGINT)
+LANGUAGE sql
+AS $$
+    WITH target AS (
+        SELECT r.id
+        FROM t_p53065890_farmer_landing_proje.investment_requests r
+        JOIN t_p53065890_farmer_landing_proje.investment_offers o ON o.id = r.offer_id
+        WHERE r.id = ANY(p_request_ids) AND r.status = 'pending'
+          AND (p_farmer_id IS NULL OR o.farmer_id = p_farmer_id)
+        FOR UPDATE OF r SKIP LOCKED
+    ),
+    released AS (
+        UPDATE t_p53065890_farmer_landing_proje.investment_requests r
+        SET status = p_status
+        FROM target
+        WHERE r.id = target.id
+        RETURNING r.id, r.offer_id, r.investor_id, r.shares_requested, r.reserved_until
+    ),
+    restored AS (
+        UPDATE t_p53065890_farmer_landing_proje.investment_offers o
+        SET available_shares = o.available_shares + s.shares,
+            reserved_shares = o.reserved_shares - s.shares,
+            updated_at = now()
+        FROM (
+            SELECT offer_id, SUM(shares_requested) AS shares FROM released
+            WHERE reserved_until IS NOT NULL
+            GROUP BY offer_id
+        ) s
+        WHERE o.id = s.offer_id
+    ),
+    notified AS (
+        INSERT INTO t_p53065890_farmer_landing_proje.notifications (user_id, role, type, payload)
+        SELECT investor_id, 'investor', 'request_' || p_status, jsonb_build_object('request_id', id)
+        FROM released
+    )
+    SELECT id, investor_id FROM released
+$$;
+
+-- Истечение резервов батчем; параллельные воркеры берут разные заявки
+CREATE OR REPLACE FUNCTION t_p53065890_farmer_landing_proje.expire_share_reservations(p_limit INT)
+RETURNS TABLE (request_id BIGINT, investor_id BIGINT)
+LANGUAGE sql
+AS $$
+    SELECT * FROM t_p53065890_farmer_landing_proje.release_investment_requests(
+        ARRAY(
+            SELECT r.id FROM t_p53065890_farmer_landing_proje.investment_requests r
+            WHERE r.status = 'pending' AND r.reserved_until IS NOT NULL AND r.reserved_until <= now()
+            ORDER BY r.reserved_until
+            LIMIT p_limit
+            FOR UPDATE SKIP LOCKED
+        ),
+        'expired'
+    )
+$$;
+
+COMMENT ON COLUMN t_p53065890_farmer_landing_proje.investment_offers.reserved_shares IS 'Доли, удержанные заявками в статусе pending (не входят в available_shares)';
+COMMENT ON COLUMN t_p53065890_farmer_landing_proje.investment_requests.reserved_until IS 'Срок резерва долей; NULL - заявка создана до резервирования';
+COMMENT ON FUNCTION t_p53065890_farmer_landing_proje.reserve_offer_shares IS 'Резерв долей и заявка одним оператором: пустой результат - предложение не найдено или долей не хватает';
+COMMENT ON FUNCTION t_p53065890_farmer_landing_proje.approve_investment_requests IS 'Пакетное одобрение заявок фермера в одной транзакции';
+COMMENT ON FUNCTION t_p53065890_farmer_landing_proje.release_investment_requests IS 'Отклонение/истечение заявок с возвратом удержанных долей';
+COMMENT ON FUNCTION t_p53065890_farmer_landing_proje.expire_share_reservations IS 'Истечение просроченных резервов батчем (FOR UPDATE SKIP LOCKED)';
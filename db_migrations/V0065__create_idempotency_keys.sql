@@ -0,0 +1,18 @@
+-- Ключи идемпотентности POST-запросов (заголовок Idempotency-Key): повтор возвращает сохраненный ответ
+CREATE TABLE IF NOT EXISTS t_p53065890_farmer_landing_proje.idempotency_keys (
+    user_id BIGINT NOT NULL,
+    idempotency_key VARCHAR(128) NOT NULL,
+    action VARCHAR(64) NOT NULL,
+    request_hash VARCHAR(64) NOT NULL,
+    status_code INTEGER,
+    response JSONB,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (user_id, idempotency_key)
+);
+
+-- Индекс для удаления ключей старше срока хранения
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created_at
+    ON t_p53065890_farmer_landing_proje.idempotency_keys(created_at);
+
+COMMENT ON TABLE t_p53065890_farmer_landing_proje.idempotency_keys IS 'Ответы на POST с Idempotency-Key (investor-api invest/invest_virtual/create_request, farmer-api create_offer/create_proposal); ключ пишется в той же транзакции, что и сама запись';
+COMMENT ON COLUMN t_p53065890_farmer_landing_proje.idempotency_keys.request_hash IS 'SHA-256 тела запроса: тот же ключ с другим телом отклоняется (422)';
@@ -0,0 +1,63 @@
+-- Удаления из users/proposals/investments откатывают водяной знак daily_metrics до дня самой ранней удаленной строки.
+-- Итоги (get_rollup_totals) берут daily_metrics только до дня водяного знака и живой хвост после него,
+-- поэтому в той же транзакции, что и удаление, итоги снова совпадают с числом строк;
+-- следующий запуск admin-metrics пересчитывает затронутые дни.
+CREATE OR REPLACE FUNCTION t_p53065890_farmer_landing_proje.rewind_daily_metrics(
+    p_metrics VARCHAR[],
+    p_since TIMESTAMP
+)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    UPDATE t_p53065890_farmer_landing_proje.stats_watermarks
+    SET watermark = date_trunc('day', p_since) - INTERVAL '1 second',
+        updated_at = CURRENT_TIMESTAMP
+    WHERE job_name IN (SELECT 'daily_metrics:' || m FROM unnest(p_metrics) m)
+      AND p_since IS NOT NULL
+      AND watermark >= date_trunc('day', p_since)
+$$;
+
+-- Триггер на оператор: пакетное удаление тысяч строк - одно обновление водяного знака
+CREATE OR REPLACE FUNCTION t_p53065890_farmer_landing_proje.rewind_daily_metrics_on_delete()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'users' THEN
+        PERFORM t_p53065890_farmer_landing_proje.rewind_daily_metrics(
+            ARRAY['signups'], (SELECT MIN(created_at) FROM deleted));
+    ELSIF TG_TABLE_NAME = 'proposals' THEN
+        PERFORM t_p53065890_farmer_landing_proje.rewind_daily_metrics(
+            ARRAY['proposals'], (SELECT MIN(created_at) FROM deleted));
+    ELSIF TG_TABLE_NAME = 'investments' THEN
+        PERFORM t_p53065890_farmer_landing_proje.rewind_daily_metrics(
+            ARRAY['investments', 'revenue'], (SELECT MIN(date) FROM deleted));
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_users_rewind_daily_metrics ON t_p53065890_farmer_landing_proje.users;
+CREATE TRIGGER trg_users_rewind_daily_metrics
+    AFTER DELETE ON t_p53065890_farmer_landing_proje.users
+    REFERENCING OLD TABLE AS deleted
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p53065890_farmer_landing_proje.rewind_daily_metrics_on_delete();
+
+DROP TRIGGER IF EXISTS trg_proposals_rewind_daily_metrics ON t_p53065890_farmer_landing_proje.proposals;
+CREATE TRIGGER trg_proposals_rewind_daily_metrics
+    AFTER DELETE ON t_p53065890_farmer_landing_proje.proposals
+    REFERENCING OLD TABLE AS deleted
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p53065890_farmer_landing_proje.rewind_daily_metrics_on_delete();
+
+DROP TRIGGER IF EXISTS trg_investments_rewind_daily_metrics ON t_p53065890_farmer_landing_proje.investments;
+CREATE TRIGGER trg_investments_rewind_daily_metrics
+    AFTER DELETE ON t_p53065890_farmer_landing_proje.investments
+    REFERENCING OLD TABLE AS deleted
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p53065890_farmer_landing_proje.rewind_daily_metrics_on_delete();
+
+-- Удаления, сделанные до этой миграции, уже завысили итоги: пересобрать агрегаты с нуля при следующем запуске
+UPDATE t_p53065890_farmer_landing_proje.stats_watermarks
+SET watermark = '1970-01-01', updated_at = CURRENT_TIMESTAMP
+WHERE job_name LIKE 'daily_metrics:%';
+
+COMMENT ON FUNCTION t_p53065890_farmer_landing_proje.rewind_daily_metrics IS 'Откат водяного знака daily_metrics:<metric> до дня перед p_since (данные с этого дня читаются вживую и пересчитываются)';
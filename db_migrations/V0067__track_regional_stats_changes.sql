@@ -0,0 +1,58 @@
+-- Регионы, статистику которых нужно пересчитать, хотя farm_diagnostics.updated_at не менялся:
+-- фермер сменил регион, диагностика или пользователь удалены. Очередь разбирает ai-analytics-data
+-- (POST ?action=refresh) в той же транзакции, что и пересчет.
+CREATE TABLE IF NOT EXISTS t_p53065890_farmer_landing_proje.regional_stats_dirty (
+    region VARCHAR(255) PRIMARY KEY,
+    marked_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Регион приводится так же, как в ai-analytics-data: пустой -> 'Не указан'
+CREATE OR REPLACE FUNCTION t_p53065890_farmer_landing_proje.mark_regional_stats_dirty()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'users' AND TG_OP = 'UPDATE' THEN
+        INSERT INTO t_p53065890_farmer_landing_proje.regional_stats_dirty (region)
+        SELECT DISTINCT COALESCE(NULLIF(r, ''), 'Не указан')
+        FROM unnest(ARRAY[OLD.region, NEW.region]) r
+        WHERE EXISTS (
+            SELECT 1 FROM t_p53065890_farmer_landing_proje.farm_diagnostics d WHERE d.user_id = NEW.id
+        )
+        ON CONFLICT (region) DO NOTHING;
+    ELSIF TG_TABLE_NAME = 'users' THEN
+        INSERT INTO t_p53065890_farmer_landing_proje.regional_stats_dirty (region)
+        SELECT DISTINCT COALESCE(NULLIF(region, ''), 'Не указан') FROM deleted
+        ON CONFLICT (region) DO NOTHING;
+    ELSE
+        INSERT INTO t_p53065890_farmer_landing_proje.regional_stats_dirty (region)
+        SELECT DISTINCT COALESCE(NULLIF(u.region, ''), 'Не указан')
+        FROM deleted d
+        JOIN t_p53065890_farmer_landing_proje.users u ON u.id = d.user_id
+        ON CONFLICT (region) DO NOTHING;
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_users_region_stats_dirty ON t_p53065890_farmer_landing_proje.users;
+CREATE TRIGGER trg_users_region_stats_dirty
+    AFTER UPDATE OF region ON t_p53065890_farmer_landing_proje.users
+    FOR EACH ROW
+    WHEN (OLD.region IS DISTINCT FROM NEW.region)
+    EXECUTE FUNCTION t_p53065890_farmer_landing_proje.mark_regional_stats_dirty();
+
+-- Удаления - триггер на оператор: пакетное удаление пользователей дает одну вставку
+DROP TRIGGER IF EXISTS trg_users_delete_stats_dirty ON t_p53065890_farmer_landing_proje.users;
+CREATE TRIGGER trg_users_delete_stats_dirty
+    AFTER DELETE ON t_p53065890_farmer_landing_proje.users
+    REFERENCING OLD TABLE AS deleted
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p53065890_farmer_landing_proje.mark_regional_stats_dirty();
+
+DROP TRIGGER IF EXISTS trg_farm_diagnostics_delete_stats_dirty ON t_p53065890_farmer_landing_proje.farm_diagnostics;
+CREATE TRIGGER trg_farm_diagnostics_delete_stats_dirty
+    AFTER DELETE ON t_p53065890_farmer_landing_proje.farm_diagnostics
+    REFERENCING OLD TABLE AS deleted
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p53065890_farmer_landing_proje.mark_regional_stats_dirty();
+
+COMMENT ON TABLE t_p53065890_farmer_landing_proje.regional_stats_dirty IS 'Регионы для пересчета regional_farm_stats помимо изменений по водяному знаку (смена региона, удаления)';
@@ -0,0 +1,91 @@
+"""
+Локальный фейковый OAuth-провайдер (Яндекс ID и VK) для офлайн нагрузочного теста входа.
+
+Запуск:  python3 fake-oauth-provider.py [--port 8900] [--latency-ms 50] [--error-rate 0.0]
+Функции oauth, auth-vk, auth-yandex направляются на него переменными окружения:
+    YANDEX_OAUTH_URL=http://localhost:8900/yandex-oauth
+    YANDEX_LOGIN_URL=http://localhost:8900/yandex-login
+    VK_OAUTH_URL=http://localhost:8900/vk-oauth
+    VK_API_URL=http://localhost:8900/vk-api
+Любой code принимается; ID пользователя берется из code (code=42 -> пользователь 42).
+"""
+
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+settings = {'latency_ms': 0, 'error_rate': 0.0}
+
+def user_id_from(value: str) -> str:
+    digits = ''.join(ch for ch in (value or '') if ch.isdigit())
+    return digits or '1'
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def send_json(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def route(self, params: dict) -> None:
+        if settings['latency_ms']:
+            time.sleep(settings['latency_ms'] / 1000)
+        if random.random() < settings['error_rate']:
+            self.send_json(503, {'error': 'unavailable'})
+            return
+        
+        path = urlparse(self.path).path
+        code = params.get('code', [''])[0]
+        token = self.headers.get('Authorization', '').replace('OAuth ', '')
+        
+        if path == '/yandex-oauth/token':
+            self.send_json(200, {'access_token': f'ya-token-{user_id_from(code)}', 'token_type': 'bearer'})
+        elif path == '/yandex-login/info':
+            uid = user_id_from(token)
+            self.send_json(200, {
+                'id': uid,
+                'default_email': f'load{uid}@yandex.test',
+                'first_name': 'Load',
+                'last_name': f'Yandex{uid}',
+                'display_name': f'Load Yandex{uid}'
+            })
+        elif path == '/vk-oauth/access_token':
+            uid = user_id_from(code)
+            self.send_json(200, {'access_token': f'vk-token-{uid}', 'user_id': int(uid), 'email': f'load{uid}@vk.test'})
+        elif path == '/vk-api/method/users.get':
+            uid = user_id_from(params.get('user_ids', [''])[0])
+            self.send_json(200, {'response': [{'id': int(uid), 'first_name': 'Load', 'last_name': f'Vk{uid}', 'photo_200': ''}]})
+        else:
+            self.send_json(404, {'error': 'not_found'})
+    
+    def do_GET(self):
+        self.route(parse_qs(urlparse(self.path).query))
+    
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        form = parse_qs(self.rfile.read(length).decode('utf-8'))
+        self.route({**parse_qs(urlparse(self.path).query), **form})
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake Yandex ID / VK OAuth provider')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency-ms', type=int, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    
+    settings['latency_ms'] = args.latency_ms
+    settings['error_rate'] = args.error_rate
+    
+    server = ThreadingHTTPServer(('0.0.0.0', args.port), FakeProviderHandler)
+    print(f'Fake OAuth provider on http://localhost:{args.port} (latency {args.latency_ms} ms, errors {args.error_rate:.0%})')
+    server.serve_forever()
@@ -81,7 +81,8 @@ const OfferRequestsTable = ({ userId, offerId }: OfferRequestsTableProps) => {
     const variants: Record<string, { className: string; label: string; icon: string }> = {
       pending: { className: 'bg-yellow-100 text-yellow-800', label: 'Ожидает', icon: 'Clock' },
       approved: { className: 'bg-green-100 text-green-800', label: 'Одобрена', icon: 'CheckCircle' },
-      rejected: { className: 'bg-red-100 text-red-800', label: 'Отклонена', icon: 'XCircle' }
+      rejected: { className: 'bg-red-100 text-red-800', label: 'Отклонена', icon: 'XCircle' },
+      expired: { className: 'bg-gray-100 text-gray-800', label: 'Истек резерв', icon: 'TimerOff' }
     };
     const variant = variants[status] || variants.pending;
     return (
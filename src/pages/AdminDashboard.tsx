@@ -43,6 +43,11 @@ interface AdminStats {
     name: string;
     count: number;
   }>;
+  pagination?: Record<'users' | 'proposals', {
+    total: number;
+    page: number;
+    page_size: number;
+  }>;
 }
 
 const ADMIN_PASSWORD = 'Krasnopeev95!';
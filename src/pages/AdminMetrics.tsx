@@ -27,7 +27,11 @@ const METRICS_API = 'https://functions.poehali.dev/e07a87af-9e24-471c-b21c-3cc12
 interface MetricsData {
   users?: {
     dau: number;
+    wau: number;
     mau: number;
+    retention_week: number;
+    signups_today: number;
+    signups_month: number;
     total: number;
     by_role: Record<string, number>;
     daily_signups: Array<{ date: string; count: number }>;
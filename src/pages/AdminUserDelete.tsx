@@ -1,6 +1,7 @@
 import { useState, useEffect } from 'react';
 import { Button } from '@/components/ui/button';
 import { Card } from '@/components/ui/card';
+import { Input } from '@/components/ui/input';
 import { useNavigate } from 'react-router-dom';
 import { toast } from 'sonner';
 import Icon from '@/components/ui/icon';
@@ -8,6 +9,7 @@ import Icon from '@/components/ui/icon';
 const AUTH_API = 'https://functions.poehali.dev/0a0119c5-f173-40c2-bc49-c845a420422f';
 const DELETE_API = 'https://functions.poehali.dev/68b32d82-8055-4ae6-b41c-28ff4dad404b';
 const ADMIN_SECRET = 'farmer_admin_2025_secret_key';
+const PAGE_SIZE = 100;
 
 interface User {
   id: number;
@@ -21,12 +23,15 @@ const AdminUserDelete = () => {
   const [users, setUsers] = useState<User[]>([]);
   const [selectedIds, setSelectedIds] = useState<number[]>([]);
   const [loading, setLoading] = useState(false);
+  const [page, setPage] = useState(1);
+  const [total, setTotal] = useState(0);
+  const [search, setSearch] = useState('');
 
   useEffect(() => {
-    loadUsers();
-  }, []);
+    loadUsers(page, search);
+  }, [page]);
 
-  const loadUsers = async () => {
+  const loadUsers = async (pageToLoad = page, searchQuery = search) => {
     setLoading(true);
     try {
       const response = await fetch(AUTH_API, {
@@ -35,7 +40,7 @@ const AdminUserDelete = () => {
           'Content-Type': 'application/json',
           'X-Admin-Secret': ADMIN_SECRET
         },
-        body: JSON.stringify({ action: 'list_users' })
+        body: JSON.stringify({ action: 'list_users', page: pageToLoad, page_size: PAGE_SIZE, search: searchQuery })
       });
 
       const data = await response.json();
@@ -45,6 +50,7 @@ const AdminUserDelete = () => {
       }
 
       setUsers(data.users || []);
+      setTotal(data.total || 0);
     } catch (error: any) {
       toast.error(error.message || 'Ошибка загрузки пользователей');
     } finally {
@@ -128,6 +134,24 @@ const AdminUserDelete = () => {
           </div>
         ) : (
           <>
+            <form
+              className="flex gap-2 mb-4"
+              onSubmit={(e) => {
+                e.preventDefault();
+                setPage(1);
+                loadUsers(1, search);
+              }}
+            >
+              <Input
+                value={search}
+                onChange={(e) => setSearch(e.target.value)}
+                placeholder="Поиск по началу email или имени"
+              />
+              <Button type="submit" variant="outline" disabled={loading}>
+                <Icon name="Search" size={18} />
+              </Button>
+            </form>
+
             <div className="space-y-2 mb-6">
               {users.map(user => (
                 <div
@@ -159,6 +183,29 @@ const AdminUserDelete = () => {
               ))}
             </div>
 
+            <div className="flex items-center justify-between mb-6 text-sm text-gray-600">
+              <span>Всего: {total}</span>
+              <div className="flex items-center gap-2">
+                <Button
+                  variant="outline"
+                  size="sm"
+                  onClick={() => setPage(page - 1)}
+                  disabled={loading || page <= 1}
+                >
+                  <Icon name="ChevronLeft" size={16} />
+                </Button>
+                <span>Страница {page} из {Math.max(1, Math.ceil(total / PAGE_SIZE))}</span>
+                <Button
+                  variant="outline"
+                  size="sm"
+                  onClick={() => setPage(page + 1)}
+                  disabled={loading || page * PAGE_SIZE >= total}
+                >
+                  <Icon name="ChevronRight" size={16} />
+                </Button>
+              </div>
+            </div>
+
             <div className="flex gap-4">
               <Button
                 onClick={handleDelete}
@@ -94,6 +94,7 @@ export default function SmartFarm() {
   const [isTyping, setIsTyping] = useState(false);
   const [loadingDiagnostics, setLoadingDiagnostics] = useState(true);
   const [usageInfo, setUsageInfo] = useState<{used: number; limit: number; remaining: number; tier: string} | null>(null);
+  const [conversationId, setConversationId] = useState<string | null>(null);
 
   useEffect(() => {
     if (!user) {
@@ -221,18 +222,13 @@ export default function SmartFarm() {
     setIsTyping(true);
 
     try {
-      const messagesToSend = [...chatMessages, userMessage].map(msg => ({
-        role: msg.role,
-        content: msg.content
-      }));
-
       const response = await fetch('https://functions.poehali.dev/058d6fd2-bddb-408f-8975-4e567b3109fa', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
           'X-User-Id': user?.id.toString() || ''
         },
-        body: JSON.stringify({ messages: messagesToSend })
+        body: JSON.stringify({ message: userMessage.content, conversation_id: conversationId })
       });
 
       if (response.status === 429) {
@@ -249,6 +245,10 @@ export default function SmartFarm() {
 
       const data = await response.json();
       
+      if (data.conversation_id) {
+        setConversationId(data.conversation_id);
+      }
+      
       // Обновляем информацию о лимитах
       if (data.usage) {
         setUsageInfo(data.usage);